@@ -1,34 +1,97 @@
+import os
+import json
 import time
-from flask import Flask, render_template, request, flash
-import orjson
-import indexer
+from flask import Flask, render_template, request, flash, jsonify
+import metrics
+from searcher import Searcher, IndexNotBuiltError
 
 app = Flask(__name__)
 app.secret_key = "000"
 
+# searcher shared across requests, created on the first query
+searcher = None
+
+# directory of the index to search
+index_dir = os.environ.get("SEARCH_INDEX_DIR", ".")
+
+# number of cached query results and how long they are kept in seconds, SEARCH_CACHE_PATH is a sqlite file
+# that shares the cached results between the worker processes of a deployment
+cache_size = int(os.environ.get("SEARCH_CACHE_SIZE", 1024))
+cache_ttl = float(os.environ.get("SEARCH_CACHE_TTL", 300))
+cache_path = os.environ.get("SEARCH_CACHE_PATH")
+
+# ranking function of the results: tfidf, bm25 or cosine
+scorer = os.environ.get("SEARCH_SCORER", "tfidf")
+
+# weights of the title, heading, bold and anchor frequencies as JSON, like {"title": 3, "anchor": 1}
+field_weights = json.loads(os.environ.get("SEARCH_FIELD_WEIGHTS", "{}"))
+
+# share of the query words a result has to include, like 0.5, results include every query word if it isn't set
+min_match = float(os.environ["SEARCH_MIN_MATCH"]) if os.environ.get("SEARCH_MIN_MATCH") else None
+
+# time every stage of the searches (shown at /metrics) and profile the searches with cProfile to this file
+# (shown at /profile)
+collect_metrics = os.environ.get("SEARCH_METRICS", "") not in ("", "0")
+profile_path = os.environ.get("SEARCH_PROFILE")
+
+def get_searcher():
+	global searcher
+	if searcher is None:
+		searcher = Searcher(index_dir=index_dir, cache_size=cache_size, cache_ttl=cache_ttl, cache_path=cache_path,
+		                    scorer=scorer, field_weights=field_weights, min_match=min_match,
+		                    collect_metrics=collect_metrics, profile_path=profile_path)
+	return searcher
+
+@app.errorhandler(IndexNotBuiltError)
+def index_not_built(error):
+	# the searcher is created again by the next request, once the index is built
+	return str(error) + "\n", 503, {"Content-Type": "text/plain"}
+
 @app.route("/")
 def index():
 	return render_template("index.html")
 
+@app.route("/stats")
+def stats():
+	return jsonify(get_searcher().stats())
+
+@app.route("/metrics")
+def search_metrics():
+	# /metrics?reset=1 starts over after returning the current metrics
+	result = get_searcher().metrics_summary()
+	if request.args.get("reset"):
+		metrics.search_metrics.reset()
+	return jsonify(result)
+
+@app.route("/profile")
+def profile():
+	report = get_searcher().profile_report(request.args.get("limit", default=30, type=int))
+	if report is None:
+		return "set SEARCH_PROFILE to a file to profile the searches\n", 404, {"Content-Type": "text/plain"}
+	return report, 200, {"Content-Type": "text/plain"}
+
+@app.route("/search")
+def search():
+	# /search?q=...&k=... returns the results as JSON, used by programs and the load test
+	query = request.args.get("q", default="")
+	k = max(request.args.get("k", default=5, type=int), 1)
+	url_results, result_query, exact_query = get_searcher().search(query, k)
+	return jsonify({"query": query, "results": url_results, "result_query": result_query, "exact": exact_query})
+
 @app.route("/query", methods=['POST', 'GET'])
 def getResults():
 	#results = indexer.tokenize("DEV/cert_ics_uci_edu/948f66bf8fdd193f5eb74187895b656377f02cf98907582fc065fb81a032aad0.json")
 	# flash('Showing results for "' + str(request.form['name_input']) + '"')
 	
-	# load the token locations file
-	with open("combined_token_locations.json", "r") as token_loc_file:
-		loaded_token_loc_dict = orjson.loads(token_loc_file.read())    
-
-	# load the url dict from file
-	with open("url_dict.json", "r") as url_dict_file:
-		loaded_url_dict = orjson.loads(url_dict_file.read())    
-	
 	queryInput = str(request.form['name_input'])
 
+	# number of results to show, can be passed as k in the form or the url
+	k = max(request.values.get('k', default=5, type=int), 1)
+
 	# start the timer in ms
 	start_time = time.time_ns() // 1000000   
 
-	url_results, result_query, exact_query = indexer.process_search(queryInput, loaded_token_loc_dict, loaded_url_dict)
+	url_results, result_query, exact_query = get_searcher().search(queryInput, k)
 	
 	# print the results
 	if url_results == []:
@@ -0,0 +1,133 @@
+"""
+Compare the per-document parse time of the single-pass HTMLParser extractor with the previous three
+BeautifulSoup passes on a sample of the DEV folder, and check both give the same tokens.
+
+    python -m benchmarks.html_extract --sample 500
+"""
+import os
+import re
+import time
+import random
+import argparse
+import orjson
+import numpy as np
+from bs4 import BeautifulSoup
+import extractor
+
+# tags whose words got an extra copy in the tokens of parse_tokens, once for the bold pass and twice for the
+# second pass
+bold_tag_names = {"b", "strong"}
+boosted_tag_names = {"a", "b", "strong", "h1", "h2", "h3"}
+
+
+def parse_tokens(content: str) -> list:
+    """
+    Return the tokens of a page followed by extra copies of its bold, heading and anchor words, the token
+    weighting used before the index stored field frequencies. Words of a bold tag get one extra copy and words
+    of an anchor, bold or heading tag get two more, but only words that are also in the page text.
+    """
+    tokens, tag_tokens = extractor.split_tag_tokens(*extractor.extract_text(content))
+    bold_tokens = [token for tag, temps in tag_tokens if tag in bold_tag_names for token in temps]
+    boosted_tokens = [token for tag, temps in tag_tokens if tag in boosted_tag_names for token in temps]
+
+    tokens.extend(bold_tokens)
+    for token in boosted_tokens:
+        tokens.append(token)
+        tokens.append(token)
+    return tokens
+
+
+def soup_tokens(content: str) -> list:
+    """
+    Same tokens as parse_tokens with three BeautifulSoup passes, the original extractor kept to check and
+    benchmark parse_tokens against.
+    """
+    # create a bs obj to scrape the content
+    soup = BeautifulSoup(content, "html.parser")
+
+    # remove extra whitespace
+    text = re.sub(r'\s+', ' ', soup.get_text())
+
+    # use regex to split on non-alphanumeric characters
+    tokens = re.split(r'[^a-zA-Z0-9]+', text.lower())
+
+    # remove empty strings and single chars from token list
+    tokens = [token for token in tokens if token and len(token) > 1]
+
+    # Find all bolded (<b>, <strong>) tags
+    bold_tags = soup.find_all(['b', 'strong'])
+    for tag in bold_tags:
+        text = re.sub(r'\s+', ' ', tag.get_text())
+        temps = re.split(r'[^a-zA-Z0-9]+', text.lower())
+        temps = [temp for temp in temps if temp and len(temp) > 1]
+        for temp in temps:
+            if temp in tokens:
+                tokens.append(temp)
+
+    # Find all heading tags (<h1>, <h2>, <h3>), title, and anchors
+    title_header_anchor_tags = soup.find_all(['a', 'b', 'strong', 'h1', 'h2', 'h3'])
+    for tag in title_header_anchor_tags:
+        text = re.sub(r'\s+', ' ', tag.get_text())
+        temps = re.split(r'[^a-zA-Z0-9]+', text.lower())
+        temps = [temp for temp in temps if temp and len(temp) > 1]
+        for temp in temps:
+            if temp in tokens:
+                tokens.append(temp)
+                tokens.append(temp)
+    return tokens
+
+
+def sample_pages(dev_dir, sample_size, seed=0):
+    """
+    read the HTML content of a random sample of the pages
+    """
+    files = sorted(os.path.join(root, name) for root, _, names in os.walk(dev_dir) for name in names)
+    random.Random(seed).shuffle(files)
+    pages = []
+    for file in files:
+        with open(file, "rb") as input_file:
+            content = orjson.loads(input_file.read())["content"]
+        if "</html>" in content.lower():
+            pages.append(content)
+            if len(pages) == sample_size:
+                break
+    return pages
+
+
+def measure(extract, pages):
+    """
+    return the tokens of every page and the parse time of every page in ms
+    """
+    tokens = []
+    latencies = []
+    for content in pages:
+        start_time = time.perf_counter()
+        tokens.append(extract(content))
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    return tokens, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dev-dir", default="DEV")
+    parser.add_argument("--sample", type=int, default=500)
+    args = parser.parse_args()
+
+    pages = sample_pages(args.dev_dir, args.sample)
+    soup_page_tokens, soup_latencies = measure(soup_tokens, pages)
+    parser_page_tokens, parser_latencies = measure(parse_tokens, pages)
+
+    results = {"pages": len(pages),
+               "mismatches": sum(a != b for a, b in zip(soup_page_tokens, parser_page_tokens))}
+    for name, latencies in (("beautifulsoup", soup_latencies), ("htmlparser", parser_latencies)):
+        results[name] = {
+            "mean_ms": round(float(np.mean(latencies)), 3),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        }
+    results["speedup"] = round(float(np.sum(soup_latencies) / max(np.sum(parser_latencies), 1e-9)), 2)
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
+
+
+if __name__ == "__main__":
+    main()
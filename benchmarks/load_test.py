@@ -0,0 +1,227 @@
+"""
+Load test the pre-forked server (serve.py) with 1 and N worker processes: clients send /search requests over
+keep-alive connections at rising concurrency, and the latency percentiles and queries per second of every level,
+the highest queries per second with a p99 latency within --p99-ms and the memory of the server processes are
+reported as JSON. The rss of the workers counts the shared pages of the index once per worker, the pss splits
+them between the processes that share them, so the total pss is the memory the server really uses.
+
+    python -m benchmarks.load_test --index-dir /path/to/index --workers 1,4
+    python -m benchmarks.load_test --queries queries.txt --concurrency 1,4,16 --p99-ms 100
+
+The clients run on the same machine as the server, on a machine with few cpus they take cpu time from the
+workers and more workers than cpus can't raise the queries per second.
+"""
+import os
+import sys
+import time
+import random
+import socket
+import argparse
+import subprocess
+import http.client
+import urllib.parse
+import multiprocessing
+import orjson
+import numpy as np
+from benchmarks.query_latency import default_queries
+
+# seconds to wait for the server to load the index and start its workers
+start_timeout = 120
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_memory_kb(pid):
+    """
+    rss and pss of a process in kB.
+    """
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as smaps:
+        for line in smaps:
+            name, _, value = line.partition(":")
+            if name in ("Rss", "Pss"):
+                memory[name.lower() + "_kb"] = int(value.split()[0])
+    return memory
+
+
+def worker_processes(server_pid):
+    with open(f"/proc/{server_pid}/task/{server_pid}/children", "r") as children:
+        return [int(pid) for pid in children.read().split()]
+
+
+def server_memory(server_pid, worker_pids):
+    """
+    rss and pss of the server's parent process and workers in MB, with the sums over all of them.
+    """
+    processes = {"parent": process_memory_kb(server_pid)}
+    processes.update((f"worker {worker_number}", process_memory_kb(worker_pid))
+                     for worker_number, worker_pid in enumerate(worker_pids, 1))
+    memory = {name: {key[:-3] + "_mb": round(value / 1024, 1) for key, value in process.items()}
+              for name, process in processes.items()}
+    memory["total"] = {"rss_mb": round(sum(process["rss_kb"] for process in processes.values()) / 1024, 1),
+                       "pss_mb": round(sum(process["pss_kb"] for process in processes.values()) / 1024, 1)}
+    return memory
+
+
+def start_server(args, workers):
+    """
+    start serve.py and return the process, its port and the worker pids once it serves requests
+    """
+    port = free_port()
+    env = dict(os.environ, SEARCH_INDEX_DIR=os.path.abspath(args.index_dir), SEARCH_CACHE_SIZE=str(args.cache_size),
+               SEARCH_SCORER=args.scorer)
+    repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen([sys.executable, "serve.py", "--port", str(port), "--workers", str(workers), "--quiet"],
+                              cwd=repository_dir, env=env, stdout=subprocess.DEVNULL)
+
+    # wait until every worker is started and one of them answers
+    deadline = time.time() + start_timeout
+    while True:
+        if server.poll() is not None:
+            raise RuntimeError("the server exited before serving requests")
+        try:
+            worker_pids = worker_processes(server.pid)
+            if len(worker_pids) == workers:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+                connection.request("GET", "/stats")
+                connection.getresponse().read()
+                connection.close()
+                return server, port, worker_pids
+        except OSError:
+            pass
+        if time.time() > deadline:
+            stop_server(server)
+            raise RuntimeError(f"the server didn't start within {start_timeout} seconds")
+        time.sleep(0.1)
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def run_client(client_args):
+    """
+    send random queries over one keep-alive connection until the deadline and return the latencies in ms
+    """
+    port, queries, k, seed, deadline = client_args
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    latencies = []
+    errors = 0
+    while time.time() < deadline:
+        path = "/search?" + urllib.parse.urlencode({"q": rng.choice(queries), "k": k})
+        start_time = time.perf_counter()
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+                continue
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            continue
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    connection.close()
+    return latencies, errors
+
+
+def run_level(port, queries, k, concurrency, duration, seed):
+    """
+    run concurrency clients for duration seconds and return the latency percentiles and queries per second
+    """
+    deadline = time.time() + duration
+    with multiprocessing.Pool(concurrency) as pool:
+        client_results = pool.map(run_client, [(port, queries, k, seed + client, deadline)
+                                               for client in range(concurrency)])
+    latencies = [latency for client_latencies, _ in client_results for latency in client_latencies]
+    errors = sum(client_errors for _, client_errors in client_results)
+    if not latencies:
+        return {"concurrency": concurrency, "requests": 0, "errors": errors}
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "qps": round(len(latencies) / duration, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def load_test(args, workers, queries):
+    server, port, worker_pids = start_server(args, workers)
+    try:
+        # warm up the page cache and the lazily loaded tables of every worker
+        run_level(port, queries, args.k, workers, args.warmup, args.seed)
+        warm_memory = server_memory(server.pid, worker_pids)
+        levels = [run_level(port, queries, args.k, concurrency, args.duration, args.seed)
+                  for concurrency in args.concurrency]
+        loaded_memory = server_memory(server.pid, worker_pids)
+    finally:
+        stop_server(server)
+
+    within_target = [level["qps"] for level in levels if level.get("requests") and level["p99_ms"] <= args.p99_ms]
+    return {
+        "workers": workers,
+        "levels": levels,
+        "max_qps_at_p99": max(within_target, default=None),
+        "memory_after_warmup": warm_memory,
+        "memory_after_load": loaded_memory,
+    }
+
+
+def parse_numbers(text):
+    return [int(number) for number in text.split(",") if number.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", default=".")
+    parser.add_argument("--queries", help="file with one query per line (default: the queries of query_latency)")
+    parser.add_argument("--workers", type=parse_numbers, default=[1, max(os.cpu_count() or 1, 2)],
+                        help="comma-separated worker counts to test, 1 and the number of cpus by default")
+    parser.add_argument("--concurrency", type=parse_numbers, default=[1, 2, 4, 8, 16],
+                        help="comma-separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of queries before the measured ones")
+    parser.add_argument("--p99-ms", type=float, default=50.0, help="p99 latency target of max_qps_at_p99")
+    parser.add_argument("--k", type=int, default=5, help="results per query")
+    parser.add_argument("--scorer", default="tfidf", help="ranking function: tfidf, bm25 or cosine")
+    parser.add_argument("--cache-size", type=int, default=0,
+                        help="cached query results per worker, 0 so every request searches the index")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries, "r") as query_file:
+            queries = [line.strip() for line in query_file if line.strip()]
+    else:
+        queries = [query for shape_queries in default_queries.values() for query in shape_queries]
+
+    results = {
+        "cpus": os.cpu_count(),
+        "settings": {"duration": args.duration, "p99_ms": args.p99_ms, "k": args.k, "scorer": args.scorer,
+                     "cache_size": args.cache_size, "queries": len(queries)},
+        "runs": [load_test(args, workers, queries) for workers in args.workers],
+    }
+
+    output = orjson.dumps(results, option=orjson.OPT_INDENT_2).decode()
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare building a partial index by scanning each token's postings list for the current doc id
+(the previous process_file) with counting the tokens once per document and appending to array postings.
+
+    python -m benchmarks.postings_insert --documents 5000 --tokens 800
+"""
+import sys
+import time
+import random
+import argparse
+import resource
+import subprocess
+from collections import Counter
+import orjson
+import indexer
+
+
+def generate_documents(document_count, tokens_per_document, vocabulary_size, seed=0):
+    """
+    generate documents with zipf distributed tokens so a few tokens have long postings lists
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"tok{i}" for i in range(vocabulary_size)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary_size)]
+    for _ in range(document_count):
+        yield rng.choices(vocabulary, weights, k=tokens_per_document)
+
+
+def scan_insert(partial_index, doc_id, tokens):
+    """
+    the previous process_file: a linear scan of the token's postings for every token occurrence
+    """
+    for token in tokens:
+        if token in partial_index:
+            occurences = partial_index[token]
+            word_found_in_file = False
+            for occurence in occurences:
+                if occurence[0] == doc_id:
+                    occurence[1] += 1
+                    word_found_in_file = True
+                    break
+            if word_found_in_file == False:
+                occurences.append([doc_id, 1])
+        else:
+            partial_index[token] = [[doc_id, 1]]
+
+
+def count_insert(doc_id, tokens):
+    """
+    the current process_file: one posting per (token, doc) appended to parallel arrays
+    """
+    indexer.process_file(doc_id, Counter(tokens), {})
+
+
+def run_variant(variant, args):
+    documents = list(generate_documents(args.documents, args.tokens, args.vocabulary))
+    partial_index = {}
+    start_time = time.perf_counter()
+    for doc_id, tokens in enumerate(documents, start=1):
+        if variant == "scan":
+            scan_insert(partial_index, doc_id, tokens)
+        else:
+            count_insert(doc_id, tokens)
+    seconds = time.perf_counter() - start_time
+    # peak rss in kB on linux, bytes on macos
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+    return {"variant": variant, "seconds": round(seconds, 3), "peak_rss_mb": round(peak_rss_mb, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=5000)
+    parser.add_argument("--tokens", type=int, default=800, help="tokens per document")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--variant", choices=["scan", "count"], help="run a single variant in this process")
+    args = parser.parse_args()
+
+    if args.variant:
+        print(orjson.dumps(run_variant(args.variant, args)).decode())
+        return
+
+    # run every variant in a fresh process so the peak rss of one doesn't hide the other
+    for variant in ("scan", "count"):
+        command = [sys.executable, "-m", "benchmarks.postings_insert", "--variant", variant,
+                   "--documents", str(args.documents), "--tokens", str(args.tokens),
+                   "--vocabulary", str(args.vocabulary)]
+        print(subprocess.run(command, capture_output=True, text=True, check=True).stdout.strip())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measure the latency of process_user_query per query shape on a built index.
+
+    python -m benchmarks.query_latency --repeat 50
+    python -m benchmarks.query_latency --queries queries.txt
+"""
+import time
+import argparse
+import orjson
+import numpy as np
+import indexer
+import segments
+
+# queries grouped by shape, replaced by the lines of --queries
+default_queries = {
+    "1 term": ["uci", "computer", "research"],
+    "2 terms": ["computer science", "machine learning", "graduate student"],
+    "3 terms": ["computer science research", "machine learning data", "uci graduate program"],
+    "rare + common": ["wics uci", "robotics computer", "cybersecurity research"],
+}
+
+
+def measure(index, queries, repeat):
+    """
+    run every query repeat times and return the latencies in ms
+    """
+    latencies = []
+    for query in queries:
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            indexer.process_user_query(query, index.lexicon, index)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", default=".")
+    parser.add_argument("--queries", help="file with one query per line, measured as a single shape")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--scorer", default="tfidf", help="ranking function: tfidf, bm25 or cosine")
+    parser.add_argument("--field-weights", type=orjson.loads, default=None,
+                        help='weights of the title, heading, bold and anchor frequencies, like {"title": 3}')
+    args = parser.parse_args()
+
+    query_shapes = default_queries
+    if args.queries:
+        with open(args.queries, "r") as query_file:
+            query_shapes = {args.queries: [line.strip() for line in query_file if line.strip()]}
+
+    index = segments.SegmentedIndex(args.index_dir, args.scorer, args.field_weights)
+
+    # warm up the stemmers and the page cache
+    measure(index, [query for queries in query_shapes.values() for query in queries], 1)
+
+    results = {}
+    for shape, queries in query_shapes.items():
+        latencies = measure(index, queries, args.repeat)
+        results[shape] = {
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+            "max_ms": round(float(np.max(latencies)), 3),
+        }
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""
+Build the index of a synthetic DEV folder and replay a query log through process_search, and report the time
+of every build stage, the query latency percentiles, the queries per second and the peak rss of the build and
+of the searcher as JSON. The corpus and the queries only depend on the seed and the sizes, so runs on different
+commits can be compared with --compare.
+
+    python -m benchmarks.suite --documents 2000 --output before.json
+    python -m benchmarks.suite --documents 2000 --compare before.json
+    python -m benchmarks.suite --queries queries.txt --scorer bm25
+
+The build and the last replay of the queries run with the stage timers of metrics.py on, the build stages are
+reported in seconds and the search stages in ms per query.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import resource
+import tempfile
+import platform
+import contextlib
+import subprocess
+import orjson
+import numpy as np
+
+# word pieces of the synthetic vocabulary, the suffixes give the stemmer words to fold together
+syllables = [consonant + vowel for consonant in "bcdfghklmnprstvz" for vowel in "aeiou"]
+suffixes = ["", "", "", "s", "ing", "ed", "er", "ation", "ness", "ly"]
+
+# number of vocabulary words drawn for each page
+page_vocabulary_size = 400
+
+# share of the documents that are exact or near copies of an earlier document
+duplicate_share = 0.02
+near_duplicate_share = 0.02
+
+# query shapes of the synthetic query log with their share of the queries
+query_shares = {"1 term": 0.3, "2 terms": 0.3, "3 terms": 0.2, "phrase": 0.1, "misspelled": 0.1}
+
+# metrics checked for regressions by --compare, a larger value is better for the first ones and a smaller
+# one for the others (times are checked once they take at least min_compared_seconds)
+higher_is_better = {"docs_per_second", "qps"}
+lower_is_better = {"seconds", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb", "index_mb"}
+min_compared_seconds = 0.5
+
+
+def generate_vocabulary(size, rng):
+    """
+    distinct words of two to four syllables with a suffix, in zipf rank order
+    """
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = "".join(rng.choices(syllables, k=rng.randint(2, 4))) + rng.choice(suffixes)
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def generate_page(vocabulary, weights, rng, words_per_page):
+    """
+    HTML page with a title, headings, bold words and links around its paragraph words, returns the page and its
+    paragraph words. The page draws its words from its own zipf ranking of a sample of the vocabulary (common words
+    are more likely to be in the sample), so pages don't all share the same most frequent words and fingerprint.
+    """
+    page_vocabulary = list(dict.fromkeys(rng.choices(vocabulary, weights, k=page_vocabulary_size)))
+    rng.shuffle(page_vocabulary)
+    page_weights = [1 / (rank + 1) for rank in range(len(page_vocabulary))]
+    words = rng.choices(page_vocabulary, page_weights, k=rng.randint(words_per_page // 2, words_per_page * 3 // 2))
+    paragraphs = []
+    for start in range(0, len(words), 60):
+        paragraph = words[start:start + 60]
+        paragraph[0] = "<b>" + paragraph[0] + "</b>"
+        paragraph[-1] = '<a href="#">' + paragraph[-1] + "</a>"
+        paragraphs.append("<p>" + " ".join(paragraph) + "</p>")
+    title = " ".join(words[:rng.randint(2, 5)])
+    heading = " ".join(words[5:rng.randint(7, 10)])
+    page = (f"<html><head><title>{title}</title></head><body><h1>{heading}</h1>" + "".join(paragraphs) +
+            "</body></html>")
+    return page, words
+
+
+def generate_corpus(dev_dir, document_count, vocabulary_size, words_per_page, seed):
+    """
+    write document_count pages to dev_dir the way the crawler stores them (one JSON file per page in a folder per
+    domain), a few of them exact or near copies of earlier ones. Returns the vocabulary with its weights and
+    the words of some pages for the query log.
+    """
+    rng = random.Random(seed)
+    vocabulary = generate_vocabulary(vocabulary_size, rng)
+    weights = [1 / (rank + 1) for rank in range(vocabulary_size)]
+    domains = [f"{''.join(rng.choices(syllables, k=3))}_ics_uci_edu" for _ in range(max(document_count // 200, 1))]
+    for domain in domains:
+        os.makedirs(os.path.join(dev_dir, domain), exist_ok=True)
+
+    pages = []
+    sample_words = []
+    for document_number in range(document_count):
+        share = rng.random()
+        if pages and share < duplicate_share:
+            page = rng.choice(pages)
+        elif pages and share < duplicate_share + near_duplicate_share:
+            page = rng.choice(pages).replace("<p>", "<p>" + rng.choice(vocabulary) + " ", 1)
+        else:
+            page, words = generate_page(vocabulary, weights, rng, words_per_page)
+            if len(sample_words) < 1000:
+                sample_words.append(words)
+        if len(pages) < 1000:
+            pages.append(page)
+
+        domain = domains[document_number % len(domains)]
+        url = f"https://{domain.replace('_', '.')}/page/{document_number}"
+        file_name = hashlib.sha256(url.encode()).hexdigest() + ".json"
+        with open(os.path.join(dev_dir, domain, file_name), "wb") as f:
+            f.write(orjson.dumps({"url": url, "content": page, "encoding": "utf-8"}))
+    return vocabulary, weights, sample_words
+
+
+def generate_queries(vocabulary, weights, sample_words, query_count, seed):
+    """
+    query log with the shapes of query_shares, the words are drawn from the most common half of the vocabulary
+    so most queries have results, phrases are taken from the pages and misspelled words lose a letter
+    """
+    rng = random.Random(seed)
+    common_words = vocabulary[:len(vocabulary) // 2]
+    common_weights = weights[:len(vocabulary) // 2]
+    queries = []
+    for shape, share in query_shares.items():
+        for _ in range(round(query_count * share)):
+            if shape == "phrase":
+                words = rng.choice(sample_words)
+                start = rng.randrange(len(words) - 2)
+                queries.append('"' + " ".join(words[start:start + 2]) + '"')
+            elif shape == "misspelled":
+                word = rng.choices(common_words, common_weights)[0]
+                position = rng.randrange(len(word))
+                queries.append(word[:position] + word[position + 1:])
+            else:
+                queries.append(" ".join(rng.choices(common_words, common_weights, k=int(shape.split()[0]))))
+    rng.shuffle(queries)
+    return queries
+
+
+def peak_rss_mb():
+    # peak rss in kB on linux, bytes on macos
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024, 1)
+
+
+def directory_size(path, skipped=()):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [name for name in dirs if name not in skipped]
+        size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return size
+
+
+def run_build(args):
+    """
+    build the index of work_dir/DEV in work_dir and return the time of every stage
+    """
+    import indexer
+    import metrics
+
+    os.chdir(args.work_dir)
+    indexer.max_memory = indexer.parse_memory_size(args.max_memory)
+    metrics.build_metrics.enabled = True
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        indexer.create_inverted_index(workers=args.workers)
+    seconds = time.perf_counter() - start_time
+
+    # the stages of the worker processes are included, so with several workers they can add up to more than
+    # the build time
+    stages = {stage: round(stage_times["total_ms"] / 1000, 3)
+              for stage, stage_times in metrics.build_metrics.summary()["stages"].items()}
+    return {
+        "seconds": round(seconds, 3),
+        "docs_per_second": round(indexer.ingest_stats["files"] / seconds, 1),
+        "stage_seconds": stages,
+        "files": indexer.ingest_stats["files"],
+        "documents": indexer.file_count,
+        "duplicates": indexer.dedup_stats["url"] + indexer.dedup_stats["exact"] + indexer.dedup_stats["near"],
+        "tokens": len(indexer.combined_token_locs),
+        "partial_indices": len(indexer.partial_indices),
+        "index_mb": round(directory_size(".", skipped={"DEV"}) / (1024 * 1024), 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def latency_stats(latencies):
+    return {
+        "queries": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "max_ms": round(float(np.max(latencies)), 3),
+    }
+
+
+def run_queries(args):
+    """
+    replay the query log of work_dir through process_search on the index of work_dir repeat times, the latency of
+    a query is its fastest run and the queries per second are those of the fastest replay, so other processes
+    slowing down some runs don't show up as regressions
+    """
+    import indexer
+    import metrics
+    from searcher import Searcher
+
+    with open(os.path.join(args.work_dir, "queries.json"), "rb") as f:
+        queries = orjson.loads(f.read())
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        searcher = Searcher(args.work_dir, cache_size=0, scorer=args.scorer, min_match=args.min_match)
+        index = searcher.index
+
+        # warm up the page cache and the lazily loaded tables
+        for query in queries[:args.warmup]:
+            indexer.process_search(query, index.lexicon, index.url_list, index, args.k, args.min_match)
+
+        latencies = np.full(len(queries), np.inf)
+        seconds = np.inf
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            for query_number, query in enumerate(queries):
+                query_start_time = time.perf_counter()
+                indexer.process_search(query, index.lexicon, index.url_list, index, args.k, args.min_match)
+                latencies[query_number] = min(latencies[query_number],
+                                              (time.perf_counter() - query_start_time) * 1000)
+            seconds = min(seconds, time.perf_counter() - start_time)
+
+        # one more replay with the stage timers on for the mean time of every search stage
+        metrics.search_metrics.enabled = True
+        for query in queries:
+            indexer.process_search(query, index.lexicon, index.url_list, index, args.k, args.min_match)
+
+    results = latency_stats(latencies)
+    results["stage_ms"] = {stage: round(stage_times["total_ms"] / len(queries), 4)
+                           for stage, stage_times in metrics.search_metrics.summary()["stages"].items()}
+    results["qps"] = round(len(queries) / seconds, 1)
+    results["load_ms"] = searcher.load_time_ms
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def run_stage(stage, args):
+    """
+    run the build or the queries in a fresh process so each gets its own peak rss and module state
+    """
+    command = [sys.executable, "-m", "benchmarks.suite", "--stage", stage, "--work-dir", args.work_dir,
+               "--workers", str(args.workers), "--max-memory", args.max_memory, "--scorer", args.scorer,
+               "--k", str(args.k), "--repeat", str(args.repeat), "--warmup", str(args.warmup)]
+    if args.min_match is not None:
+        command += ["--min-match", str(args.min_match)]
+    repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(command, capture_output=True, text=True, check=True, cwd=repository_dir).stdout
+    return orjson.loads(output.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    """
+    numeric metrics of nested results as {"build.stage_seconds.merge": value}
+    """
+    metrics = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, prefix + name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[prefix + name] = value
+    return metrics
+
+
+def compare(results, baseline, threshold):
+    """
+    relative change of every build and query metric against a previous run, and the metrics that got worse
+    by more than threshold (a share like 0.1)
+    """
+    current_metrics = flatten({"build": results["build"], "query": results["query"]})
+    baseline_metrics = flatten({"build": baseline["build"], "query": baseline["query"]})
+    changes = {}
+    regressions = []
+    for name, value in current_metrics.items():
+        previous = baseline_metrics.get(name)
+        if not previous:
+            continue
+        change = (value - previous) / previous
+        changes[name] = round(change, 3)
+
+        metric = name.rsplit(".", 1)[-1]
+        if name.startswith("build.stage_seconds."):
+            metric = "seconds"
+        if metric == "seconds" and max(value, previous) < min_compared_seconds:
+            continue
+        if metric in higher_is_better and -change > threshold or metric in lower_is_better and change > threshold:
+            regressions.append(name)
+    return {"baseline_commit": baseline.get("commit"), "changes": changes, "regressions": regressions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--words", type=int, default=600, help="average words per page")
+    parser.add_argument("--query-count", type=int, default=500, help="queries of the synthetic query log")
+    parser.add_argument("--queries", help="file with one query per line replayed instead of the synthetic log")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="processes used to tokenize and stem the files")
+    parser.add_argument("--max-memory", default="8M",
+                        help="memory budget of the build, small enough to dump several partial indices (default: 8M)")
+    parser.add_argument("--scorer", default="tfidf", help="ranking function: tfidf, bm25 or cosine")
+    parser.add_argument("--min-match", type=float, help="share of the query words a result has to include")
+    parser.add_argument("--k", type=int, default=5, help="results per query")
+    parser.add_argument("--repeat", type=int, default=3, help="number of times the query log is replayed")
+    parser.add_argument("--warmup", type=int, default=50, help="queries run before the measured ones")
+    parser.add_argument("--work-dir", help="directory of the corpus and the index (default: a temporary one)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="share a time, rss or throughput metric can get worse by before it's a regression")
+    parser.add_argument("--stage", choices=["build", "query"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage == "build":
+        print(orjson.dumps(run_build(args)).decode())
+        return
+    if args.stage == "query":
+        print(orjson.dumps(run_queries(args)).decode())
+        return
+
+    temporary_dir = None
+    if args.work_dir is None:
+        temporary_dir = tempfile.mkdtemp(prefix="search-benchmark-")
+        args.work_dir = temporary_dir
+    args.work_dir = os.path.abspath(args.work_dir)
+    try:
+        start_time = time.perf_counter()
+        shutil.rmtree(os.path.join(args.work_dir, "DEV"), ignore_errors=True)
+        vocabulary, weights, sample_words = generate_corpus(os.path.join(args.work_dir, "DEV"), args.documents,
+                                                            args.vocabulary, args.words, args.seed)
+        if args.queries:
+            with open(args.queries, "r") as query_file:
+                queries = [line.strip() for line in query_file if line.strip()]
+        else:
+            queries = generate_queries(vocabulary, weights, sample_words, args.query_count, args.seed)
+        with open(os.path.join(args.work_dir, "queries.json"), "wb") as f:
+            f.write(orjson.dumps(queries))
+        corpus_seconds = time.perf_counter() - start_time
+
+        results = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "corpus": {"documents": args.documents, "vocabulary": args.vocabulary, "words": args.words,
+                       "seed": args.seed, "queries": len(queries), "mb": round(directory_size(
+                           os.path.join(args.work_dir, "DEV")) / (1024 * 1024), 1),
+                       "seconds": round(corpus_seconds, 3)},
+            "settings": {"workers": args.workers, "max_memory": args.max_memory, "scorer": args.scorer,
+                         "min_match": args.min_match, "k": args.k, "repeat": args.repeat},
+            "build": run_stage("build", args),
+            "query": run_stage("query", args),
+        }
+    finally:
+        if temporary_dir is not None and not args.keep:
+            shutil.rmtree(temporary_dir, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare, "rb") as f:
+            results["comparison"] = compare(results, orjson.loads(f.read()), args.threshold)
+
+    output = orjson.dumps(results, option=orjson.OPT_INDENT_2).decode()
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    if args.compare and results["comparison"]["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
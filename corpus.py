@@ -0,0 +1,256 @@
+import io
+import os
+import gzip
+import time
+import queue
+import tarfile
+import zipfile
+import threading
+from collections import namedtuple
+import metrics
+
+# a corpus is the collection of crawled pages the index is built from, every page is a JSON object with its url and
+# content. it can be a directory of JSON files (the DEV folder), a zip or tar archive of that directory or a JSON
+# lines bundle with a page per line (.jsonl, .jsonl.gz or .jsonl.zst, the zstandard package is needed for .zst).
+# the readers stream the pages in a fixed order, so a corpus always gets the same doc ids
+
+# a page of a corpus before its content is read: its name (the file path in a directory, archive:member in an
+# archive and bundle:line number in a bundle), its modification time in ns and its size in bytes
+PageEntry = namedtuple("PageEntry", ["name", "mtime", "size"])
+
+# number of pages read ahead of the page being processed
+read_ahead_pages = 64
+
+# size of the reads of compressed bundles
+bundle_buffer_size = 1024 * 1024
+
+tar_suffixes = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+bundle_suffixes = (".jsonl", ".jsonl.gz", ".jsonl.zst")
+
+# files of a directory or an archive that aren't pages
+skipped_files = {".DS_Store"}
+
+
+class DirectoryCorpus:
+    """
+    The JSON files of a directory and its subdirectories, in the order os.walk lists them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # files that were removed after they were listed, before they were read
+        self.missing_files = []
+
+    def paths(self, directory_path=None):
+        """
+        Recursively iterate through the directory and yield the path of every file, like os.walk a missing
+        directory has no files.
+        """
+        if directory_path is None:
+            directory_path = self.path
+        try:
+            with os.scandir(directory_path) as scanned:
+                dir_entries = list(scanned)
+        except OSError:
+            return
+        for dir_entry in dir_entries:
+            if dir_entry.name not in skipped_files and not dir_entry.is_dir():
+                yield dir_entry.path
+        for dir_entry in dir_entries:
+            if dir_entry.is_dir() and not dir_entry.is_symlink():
+                yield from self.paths(dir_entry.path)
+
+    def scan(self, accept, names=None):
+        """
+        Yield every file (or the files named in names) as a page entry with its content, or with None if accept
+        rejected the entry, which is checked before the file is opened. Files that are removed before they are read
+        are skipped and added to missing_files.
+        """
+        build_metrics = metrics.build_metrics
+        for path in (self.paths() if names is None else names):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.missing_files.append(path)
+                continue
+            entry = PageEntry(path, stat.st_mtime_ns, stat.st_size)
+            if not accept(entry):
+                yield entry, None
+                continue
+            try:
+                with build_metrics.timer("read"), open(path, "rb") as page_file:
+                    content = page_file.read()
+            except FileNotFoundError:
+                self.missing_files.append(path)
+                continue
+            yield entry, content
+
+
+class ZipCorpus:
+    """
+    The JSON files of a zip archive, in the order of its central directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def scan(self, accept, names=None):
+        """
+        Yield every member (or the members named in names) as a page entry with its content, or with None if accept
+        rejected the entry. The sizes and times come from the central directory, rejected members aren't
+        decompressed.
+        """
+        build_metrics = metrics.build_metrics
+        with zipfile.ZipFile(self.path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or os.path.basename(info.filename) in skipped_files:
+                    continue
+                name = self.path + ":" + info.filename
+                if names is not None and name not in names:
+                    continue
+                mtime = int(time.mktime(info.date_time + (0, 0, -1))) * 1000000000
+                entry = PageEntry(name, mtime, info.file_size)
+                if not accept(entry):
+                    yield entry, None
+                    continue
+                with build_metrics.timer("read"):
+                    content = archive.read(info)
+                yield entry, content
+
+
+class TarCorpus:
+    """
+    The JSON files of a tar archive (optionally gzip, bzip2 or xz compressed), read as a stream in archive order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def scan(self, accept, names=None):
+        """
+        Yield every member (or the members named in names) as a page entry with its content, or with None if accept
+        rejected the entry. The sizes and times come from the member headers, the stream skips over the content of
+        rejected members.
+        """
+        build_metrics = metrics.build_metrics
+        with tarfile.open(self.path, "r|*") as archive:
+            for member in archive:
+                if not member.isfile() or os.path.basename(member.name) in skipped_files:
+                    continue
+                name = self.path + ":" + member.name
+                if names is not None and name not in names:
+                    continue
+                entry = PageEntry(name, int(member.mtime) * 1000000000, member.size)
+                if not accept(entry):
+                    yield entry, None
+                    continue
+                with build_metrics.timer("read"):
+                    content = archive.extractfile(member).read()
+                yield entry, content
+
+
+class JsonLinesCorpus:
+    """
+    A bundle with a JSON page per line, plain, gzip or zstandard compressed. Every page has the modification time
+    of the bundle and the length of its line as its size.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def open(self):
+        """
+        Open the bundle as a buffered binary stream of its decompressed lines.
+        """
+        if self.path.lower().endswith(".gz"):
+            return gzip.open(self.path, "rb")
+        if self.path.lower().endswith(".zst"):
+            try:
+                import zstandard
+            except ImportError:
+                raise RuntimeError("reading " + self.path + " needs the zstandard package (pip install zstandard)")
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(self.path, "rb"),
+                                                                                closefd=True),
+                                     bundle_buffer_size)
+        return open(self.path, "rb", buffering=bundle_buffer_size)
+
+    def scan(self, accept, names=None):
+        """
+        Yield every line (or the lines named in names) as a page entry with its content, or with None if accept
+        rejected the entry. Empty lines aren't pages but they are counted, so a page keeps its name.
+        """
+        build_metrics = metrics.build_metrics
+        mtime = os.stat(self.path).st_mtime_ns
+        with self.open() as bundle:
+            lines = iter(bundle)
+            line_number = 0
+            while True:
+                with build_metrics.timer("read"):
+                    line = next(lines, None)
+                if line is None:
+                    break
+                line_number += 1
+                content = line.strip()
+                if not content:
+                    continue
+                name = self.path + ":" + str(line_number)
+                if names is not None and name not in names:
+                    continue
+                entry = PageEntry(name, mtime, len(content))
+                yield entry, content if accept(entry) else None
+
+
+def open_corpus(path):
+    """
+    Return the reader of the corpus at path, a zip or tar archive or a JSON lines bundle by its suffix and a
+    directory otherwise.
+    """
+    lower_path = path.lower()
+    if lower_path.endswith(".zip"):
+        return ZipCorpus(path)
+    if lower_path.endswith(tar_suffixes):
+        return TarCorpus(path)
+    if lower_path.endswith(bundle_suffixes):
+        return JsonLinesCorpus(path)
+    return DirectoryCorpus(path)
+
+
+def read_ahead(pages, count=read_ahead_pages):
+    """
+    Iterate over pages in a background thread that stays up to count pages ahead, so the files are read and
+    decompressed while the pages before them are processed. Errors of the background thread are raised here.
+    """
+    page_queue = queue.Queue(count)
+    stopped = threading.Event()
+
+    def read_pages():
+        try:
+            for page in pages:
+                page_queue.put((True, page))
+                if stopped.is_set():
+                    return
+            page_queue.put((False, None))
+        except BaseException as error:
+            page_queue.put((False, error))
+        finally:
+            if hasattr(pages, "close"):
+                pages.close()
+
+    thread = threading.Thread(target=read_pages, name="corpus-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            is_page, item = page_queue.get()
+            if not is_page:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        # let the reader finish the page it is putting if the pages weren't all used
+        stopped.set()
+        while thread.is_alive():
+            try:
+                page_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
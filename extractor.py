@@ -0,0 +1,154 @@
+import re
+import urllib.parse
+from html.parser import HTMLParser
+from html.entities import html5
+
+# field of the words of each tag, see postings.fields
+tag_fields = {"title": "title", "h1": "heading", "h2": "heading", "h3": "heading", "b": "bold", "strong": "bold",
+              "a": "anchor"}
+
+# tags whose text isn't part of the page text
+skipped_text_tags = {"script", "style", "template"}
+
+# tags without an end tag
+void_tags = {"area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta",
+             "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex",
+             "nextid", "spacer"}
+
+# entity name (with or without the semicolon) -> characters
+entity_characters = {name.rstrip(";"): characters for name, characters in html5.items()}
+
+# ports left out of canonical urls
+default_ports = {"http": ":80", "https": ":443"}
+
+
+def canonical_url(url: str) -> str:
+    """
+    Return the url of a page without its fragment, with a lowercase scheme and host, without the default port of
+    its scheme and with the path / if it has none, the same for every url that only differs in these parts.
+    """
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = parts.netloc.lower()
+    default_port = default_ports.get(scheme)
+    if default_port and host.endswith(default_port):
+        host = host[:-len(default_port)]
+    path = parts.path or ("/" if host else "")
+    return urllib.parse.urlunsplit((scheme, host, path, parts.query, ""))
+
+
+def split_tokens(text: str) -> list:
+    """
+    split lowercase text on non-alphanumeric characters and drop empty strings and single chars
+    """
+    return [token for token in re.split(r'[^a-zA-Z0-9]+', text.lower()) if len(token) > 1]
+
+
+class TextExtractor(HTMLParser):
+    """
+    Single pass over a page that collects its text and the text of every title, bold, heading and anchor tag.
+    Text is split the same way BeautifulSoup's get_text() joins it: strings of adjacent tags aren't separated
+    and script, style and template contents, comments and declarations are left out.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.text_parts = []
+        # open tags, each is [name, text parts of a boosted tag or None]
+        self.open_tags = []
+        # text parts of the closed and still open title, bold, heading and anchor tags in the order they
+        # started, as (name, parts)
+        self.tag_parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        self.push_tag(tag)
+        if tag in void_tags:
+            self.pop_tag(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.push_tag(tag)
+        self.pop_tag(tag)
+
+    def handle_endtag(self, tag):
+        self.pop_tag(tag)
+
+    def push_tag(self, tag):
+        parts = None
+        if tag in tag_fields:
+            parts = []
+            self.tag_parts.append((tag, parts))
+        self.open_tags.append((tag, parts))
+        if tag in skipped_text_tags:
+            self.skip_depth += 1
+
+    def pop_tag(self, tag):
+        # close the most recently opened tag with this name and every tag opened after it, like BeautifulSoup
+        for position in range(len(self.open_tags) - 1, -1, -1):
+            if self.open_tags[position][0] == tag:
+                for name, _ in self.open_tags[position:]:
+                    if name in skipped_text_tags:
+                        self.skip_depth -= 1
+                del self.open_tags[position:]
+                return
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.add_text(data)
+
+    def add_text(self, data):
+        self.text_parts.append(data)
+        for _, parts in self.open_tags:
+            if parts is not None:
+                parts.append(data)
+
+    def handle_charref(self, name):
+        try:
+            code_point = int(name[1:], 16) if name[0] in "xX" else int(name)
+            data = chr(code_point)
+        except (ValueError, OverflowError):
+            data = "\N{REPLACEMENT CHARACTER}"
+        self.handle_data(data)
+
+    def handle_entityref(self, name):
+        # unknown entities stay text without their semicolon, like BeautifulSoup
+        self.handle_data(entity_characters.get(name, "&" + name))
+
+    def unknown_decl(self, data):
+        # CDATA sections are text in BeautifulSoup, even inside a template
+        if data.startswith("CDATA["):
+            self.add_text(data[6:])
+
+
+def extract_text(content: str):
+    """
+    Return the text of a page and the (tag, text) of its title, bold, heading and anchor tags.
+    """
+    extractor = TextExtractor()
+    extractor.feed(content)
+    extractor.close()
+    return "".join(extractor.text_parts), [(tag, "".join(parts)) for tag, parts in extractor.tag_parts]
+
+
+def split_tag_tokens(text: str, tag_texts: list):
+    """
+    Return the tokens of a page's text and the (tag, tokens) of its tags, without the tag tokens that aren't
+    in the page text.
+    """
+    tokens = split_tokens(text)
+    token_set = set(tokens)
+    tag_tokens = [(tag, [token for token in split_tokens(tag_text) if token in token_set])
+                  for tag, tag_text in tag_texts]
+    return tokens, tag_tokens
+
+
+def split_fields(text: str, tag_texts: list):
+    """
+    Return the tokens of a page's text and the tokens of each of its fields (title, heading, bold, anchor)
+    from the text and tag texts of extract_text. Words of nested tags count once for every tag they are in.
+    """
+    tokens, tag_tokens = split_tag_tokens(text, tag_texts)
+    field_tokens = {field: [] for field in set(tag_fields.values())}
+    for tag, temps in tag_tokens:
+        field_tokens[tag_fields[tag]].extend(temps)
+    return tokens, field_tokens
@@ -0,0 +1,91 @@
+import hashlib
+import numpy as np
+
+# word -> 64-bit hash of the words hashed by this process, words aren't added once it's full
+word_hash_cache = {}
+max_cache_size = 2000000
+
+
+def content_hash(tokens: list) -> int:
+    """
+    64-bit hash of a page's tokens to detect exact duplicates.
+    """
+    return int.from_bytes(hashlib.blake2b("\0".join(tokens).encode(), digest_size=8).digest(), "little")
+
+
+def word_hash(word: str) -> int:
+    hash_value = word_hash_cache.get(word)
+    if hash_value is None:
+        hash_value = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+        if len(word_hash_cache) < max_cache_size:
+            word_hash_cache[word] = hash_value
+    return hash_value
+
+
+def simhash(page_dict: dict) -> int:
+    """
+    64-bit SimHash of a page, page_dict is every word on the page with its frequency.
+    Each bit is set if the words whose hash has that bit set outweigh the words whose hash doesn't.
+    """
+    if not page_dict:
+        return 0
+    hashes = np.array([word_hash(word) for word in page_dict], dtype="<u8")
+    weights = np.array(list(page_dict.values()), dtype=np.int64)
+
+    # bit i of every word hash at column i
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    bit_weights = weights @ (bits.astype(np.int64) * 2 - 1)
+    return int.from_bytes(np.packbits(bit_weights > 0, bitorder="little").tobytes(), "little")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class FingerprintIndex:
+    """
+    Finds fingerprints within a Hamming distance of a fingerprint without comparing it to every fingerprint.
+    The 64 bits are split into max_distance + 1 bands. Two fingerprints that differ in at most max_distance
+    bits agree on at least one whole band, so only fingerprints sharing a band value are compared.
+    """
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        band_count = max_distance + 1
+        # (shift, mask) of each band, the first bands get the extra bits
+        self.bands = []
+        shift = 0
+        for band in range(band_count):
+            width = 64 // band_count + (1 if band < 64 % band_count else 0)
+            self.bands.append((shift, (1 << width) - 1))
+            shift += width
+        # band value -> fingerprints with it, one dict per band
+        self.band_tables = [{} for _ in self.bands]
+        self.fingerprints = set()
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def add(self, fingerprint: int) -> None:
+        if fingerprint in self.fingerprints:
+            return
+        self.fingerprints.add(fingerprint)
+        for (shift, mask), band_table in zip(self.bands, self.band_tables):
+            band_table.setdefault((fingerprint >> shift) & mask, []).append(fingerprint)
+
+    def find_near(self, fingerprint: int):
+        """
+        Return a fingerprint within max_distance bits of fingerprint, or None.
+        """
+        if fingerprint in self.fingerprints:
+            return fingerprint
+        for (shift, mask), band_table in zip(self.bands, self.band_tables):
+            for candidate in band_table.get((fingerprint >> shift) & mask, ()):
+                if hamming_distance(candidate, fingerprint) <= self.max_distance:
+                    return candidate
+        return None
+
+    def clear(self):
+        self.fingerprints.clear()
+        for band_table in self.band_tables:
+            band_table.clear()
@@ -3,19 +3,71 @@ import sys
 import time
 import orjson
 import re
-from nltk.stem import PorterStemmer, SnowballStemmer
-from bs4 import BeautifulSoup
+import heapq
+import itertools
 import pandas as pd
+import numpy as np
 import math
-
-# dict where key is the file and the value is the doc id 
-file_id_dict = {}
-
-# dict where key is doc id and value is url
-url_dict = {}
-
-# keep track the length of each document
-file_wordcount_dict = {}
+import argparse
+import contextlib
+import threading
+import multiprocessing
+from collections import namedtuple, deque
+from array import array
+import shutil
+import hashlib
+import zlib
+import postings
+import segments
+import shards
+import stemming
+import extractor
+import fingerprints
+import scoring
+import spelling
+import metrics
+import corpus
+
+# directory the index files are written to, delta segments of incremental builds are written to their own directory
+index_dir = "."
+
+# the corpus the index is built from, the DEV folder, a zip or tar archive or a JSON lines bundle (see corpus.py),
+# set with --corpus
+corpus_path = "DEV"
+
+# doc ids of this build start after base_doc_id (delta segments continue the doc ids of the existing index)
+base_doc_id = 0
+
+# full builds are written to this directory and published as a new main segment directory once they are complete,
+# it's kept when a build stops so the build can be resumed
+build_staging_dir = os.path.join(segments.segments_dir, "build.tmp")
+
+# the state of a full build is written to the checkpoint file of the build directory after every dumped partial
+# index, with the document word counts, field lengths and norms in files starting with checkpoint_prefix
+checkpoint_file = "checkpoint.json"
+checkpoint_prefix = "checkpoint_"
+# only full builds write checkpoints, delta segments are small enough to build again
+write_checkpoints = False
+
+# stats of every listed file are appended to this file (one JSON line [file, mtime_ns, size, content hash] per file)
+files_file = "files.jsonl"
+files_writer = None
+
+# file -> [mtime_ns, size, content hash, doc id, checksum, fingerprint] of every file of the last build,
+# used by incremental builds to find new, changed and deleted files (doc id is 0 for files that aren't indexed,
+# the content hash is None for files that weren't read because of their size)
+manifest_file = "manifest.json"
+
+# the file, url, checksum and fingerprint of every indexed document are appended to this file (one JSON line
+# per doc id) instead of being kept in memory, file_id.json and url_dict.json are written from it at the end
+documents_file = "documents.jsonl"
+documents_writer = None
+
+# keep track the length, the number of words in each field (postings.fields) and the cosine norm of each
+# document, indexed by doc id - base_doc_id (doc ids start at base_doc_id + 1)
+doc_wordcounts = array("I", [0])
+doc_field_lengths = array("I", [0] * len(postings.fields))
+doc_norms = array("f", [0.0])
 
 # list of all partial indices
 partial_indices = []
@@ -23,12 +75,26 @@ partial_indices = []
 # current partial index dict
 partial_index = {}
 
-# set for all unique tokens
-word_set = set()
+# memory budget of the build in bytes, the partial index is dumped once its estimated size reaches
+# half of it so the rest is left for the interpreter, the run-wide tables and dumping the partial index
+max_memory = 1024 * 1024 * 1024
+
+# estimated size of the current partial index in bytes
+partial_index_bytes = 0
 
-# threshold for max tokens per partial index
-partial_index_threshold = 90000
-# partial_index_threshold = 6000
+# estimated bytes for a new token in the partial index (dict entry, str, tuple and four arrays),
+# for each posting (a doc id, a frequency and the packed field frequencies) and for each position
+token_overhead_bytes = 480
+posting_bytes = 12
+position_bytes = 4
+
+# store the positions of every token in the page text for phrase queries
+store_positions = True
+
+# the field frequencies of a posting are packed into one integer in the partial indices,
+# field_freq_bits bits per field in the order of postings.fields (larger frequencies are capped)
+field_freq_bits = 8
+max_field_freq = (1 << field_freq_bits) - 1
 
 # number of files processed
 file_count = 0
@@ -39,366 +105,770 @@ min_file_size = 1000
 large_files = []
 small_files = []
 
-token_locs = {}
+# files of the corpus folder that were removed between listing and reading them, they aren't indexed
+missing_files = []
 
 combined_token_locs = {}
 
-# variables to check for exact/near similarity
-checksum_set = set()
-fingerprint_set = set()
+# progress of the merge: tokens and postings merged and seconds spent so far
+merge_progress = {"tokens": 0, "postings": 0, "seconds": 0.0}
+# print the merge progress every n tokens
+merge_progress_interval = 50000
 
+# number of files sent to a worker process at a time in the parallel ingestion mode
+ingest_chunk_size = 16
 
-def checksum(tokens):
-    """
-    Calculate the checksum of each page
-    """
-    sum = 0
-    for token in tokens:
-        for char in token:
-            sum += ord(char)
-    return sum
+# chunks of pages per worker that are read but not yet indexed in the parallel ingestion mode, this bounds the memory
+# the page contents waiting for a worker use
+ingest_chunks_in_flight = 4
 
+# files processed, bytes of page content read, seconds spent and number of workers used by the last
+# iterateDirectory call
+ingest_stats = {"files": 0, "bytes": 0, "seconds": 0.0, "workers": 1}
 
-def hash_word(word):
-    hash_value = 0
-    for char in word:
-        hash_value += ord(char)
+# a file after tokenizing, fingerprinting and stemming, before duplicate checks (url is None for non-HTML content)
+# term_freqs maps each stemmed token of the file to its frequency in the page text and field_freqs to its packed
+# field frequencies (only for tokens in a field), term_positions maps each stemmed token to its positions in the
+# page text (empty unless positions are stored), field_lengths is the number of words in each field, norm is the
+# cosine norm and new_stems holds the words the analyzing process stemmed for the first time with their stems
+ParsedDocument = namedtuple("ParsedDocument", ["file", "url", "token_count", "checksum", "fingerprint", "term_freqs",
+                                               "field_freqs", "term_positions", "field_lengths", "norm", "new_stems"])
 
-    hash_value %= 65536
+# word -> stem of every word of the analyzed files, written as the stem table of the index
+stem_table = {}
 
-    bin_hash = bin(hash_value)[2:].zfill(16)
-    return bin_hash
+# variables to check for exact/near similarity, pages whose simhash fingerprints differ in at most
+# max_fingerprint_distance bits are near duplicates
+max_fingerprint_distance = 3
+checksum_set = set()
+fingerprint_index = fingerprints.FingerprintIndex(max_fingerprint_distance)
 
+# canonical urls of the indexed documents (see extractor.canonical_url), a page is indexed once even if it was
+# crawled under several urls that only differ by their fragment, host case or default port
+url_set = set()
 
-def simhash(page_dict: dict):
-    """
-    Detect similar documents. page_dict is every single word on a page with its frequency.
-    """
-    # Hash each word in the page_dict
-    word_hashes = {word: hash_word(word) for word in page_dict.keys()}
-    # Initialize fingerprint with 16 bits set to 0
-    fingerprint = [0] * 16   
+# documents dropped as too small, as another url of an indexed page, as exact or near duplicates and seconds spent
+# on the duplicate checks
+dedup_stats = {"small": 0, "url": 0, "exact": 0, "near": 0, "seconds": 0.0}
 
-    # Combine hashes using XOR
-    for word, hash_value in word_hashes.items():
-        for i in range(16):  # Iterate over each bit position
-            # Extract i-th bit from the hash value
-            bit = (int(hash_value) // (2 ** i)) % 2
-            # Update fingerprint using XOR
-            fingerprint[i] ^= bit * page_dict[word]
+# the stage timings and counters of the build (metrics.build_metrics) are written to this file when they are enabled
+build_metrics_file = "build_metrics.json"
 
-    # Convert fingerprint to binary string
-    fingerprint_str = ''.join(map(str, fingerprint))
+# file to write the cProfile stats of the build to, set with --profile
+profile_path = None
 
-    return fingerprint_str
+# quoted phrase with an optional proximity window
+phrase_pattern = re.compile(r'("[^"]*")(?:~(\d+))?')
 
+# number of top documents whose positions are checked for the quoted phrases of a query
+phrase_candidates = 100
 
-def tokenize(file: str) -> list:
-    global file_count
+# prefix word like comput*, it's expanded to the indexed tokens that start with it
+prefix_pattern = re.compile(r'([a-zA-Z0-9]+)\*')
+
+# number of tokens a prefix word is expanded to, the ones in the most documents
+max_prefix_expansions = 32
+
+
+def tokenize(file: str, file_content: bytes = None):
     """
-    Tokenize the text from a specified file.
+    Tokenize the text from a specified file, or from its content if the corpus reader already read it. Returns the
+    page's canonical url, the tokens of its text and the tokens of each of its fields, or None for non-HTML content.
+    This doesn't touch any module state apart from the build metrics so it can run in a worker process.
     """
+    build_metrics = metrics.build_metrics
     try:
         # open the file and read its contents
-        with open(file, "r") as input_file:
-            file_info = orjson.loads(input_file.read())
+        if file_content is None:
+            with build_metrics.timer("read"), open(file, "rb") as input_file:
+                file_content = input_file.read()
+        with build_metrics.timer("decode"):
+            file_info = orjson.loads(file_content)
          
         # check if the content is in HTML format
         if "</html>" not in file_info["content"].lower():
             # skip non-HTML content
-            return []
+            return None
 
-        # get tokens
-        content = file_info["content"]
-        
-        # create a bs obj to scrape the content
-        soup = BeautifulSoup(content, "html.parser")
-        
-        # remove extra whitespace
-        text = re.sub(r'\s+', ' ', soup.get_text())
-
-        # use regex to split on non-alphanumeric characters
-        tokens = re.split(r'[^a-zA-Z0-9]+', text.lower())
-
-        # remove empty strings and single chars from token list
-        tokens = [token for token in tokens if token and len(token) > 1]
-
-        # Find all bolded (<b>, <strong>) tags
-        bold_tags = soup.find_all(['b', 'strong'])
-        for tag in bold_tags:
-            text = re.sub(r'\s+', ' ', tag.get_text())
-            temps = re.split(r'[^a-zA-Z0-9]+', text.lower())
-            temps = [temp for temp in temps if temp and len(temp) > 1]
-            for temp in temps:
-                if temp in tokens:
-                    #print(tag.get_text().strip().lower())
-                    #tokens.append(tag.get_text().strip().lower())
-                    tokens.append(temp)
-
-        # Find all heading tags (<h1>, <h2>, <h3>), title, and anchors
-        title_header_anchor_tags = soup.find_all(['a', 'b', 'strong', 'h1', 'h2', 'h3'])
-        for tag in title_header_anchor_tags:
-            text = re.sub(r'\s+', ' ', tag.get_text())
-            temps = re.split(r'[^a-zA-Z0-9]+', text.lower())
-            temps = [temp for temp in temps if temp and len(temp) > 1]
-            for temp in temps:
-                if temp in tokens:
-                    #print(tag.get_text().strip().lower())
-                    #tokens.append(tag.get_text().strip().lower())
-                    tokens.append(temp)
-                    tokens.append(temp)
-
-        # dont process files with too little content
-        if len(tokens) < 100:
-            small_files.append(file)
-            return []
+        # get the page's text and its title, heading, bold and anchor text in a single parse, and their tokens
+        with build_metrics.timer("parse"):
+            text, tag_texts = extractor.extract_text(file_info["content"])
+        with build_metrics.timer("tokenize"):
+            tokens, field_tokens = extractor.split_fields(text, tag_texts)
 
-        # dont process files with exact similarity
-        sum = checksum(tokens)
-        if sum in checksum_set:
-            return []
-        checksum_set.add(sum)
+        return extractor.canonical_url(file_info["url"]), tokens, field_tokens
+    except FileNotFoundError as e:
+        return None
 
-        # create the doc's page_dict (key: token, value: freq) for simhash
-        page_dict = {}
-        for token in tokens:
-            if token in page_dict:  # if the key exists, increment its frequency
-                page_dict[token] += 1
-            else:  # if the key doesn't exist, add it to the dictionary and update its frequency
-                page_dict[token] = 1
 
-        # dont process files with near similarity
-        fingerprint = simhash(page_dict)
-        near_duplicate = False
-        if (fingerprint not in fingerprint_set):
-            for i in range(16):
-                # make a copy of the original fingerprint
-                new_fingerprint = list(fingerprint)
-                # flip 1 bit at a time to detect near similarity
-                if new_fingerprint[i] == "1":
-                    new_fingerprint[i] = "0"
-                else:
-                     new_fingerprint[i] = "1"
-                if "".join(new_fingerprint) in fingerprint_set:
-                    fingerprint_set.add(fingerprint)
-                    near_duplicate = True
-                    break
-  
-        # check if fingerprint already exists to detect exact similarity or if there is near similarity
-        if (fingerprint not in fingerprint_set) and not near_duplicate:        
-            # update variables
-            # increment file count
-            file_count += 1
-
-            # add the doc id and file to file_id dict
-            dict_length = len(file_id_dict)
-            doc_id = str(dict_length + 1)
-            file_id_dict[file] = doc_id
-
-            # add the url to the url dict
-            url = file_info["url"]
-            url_dict[doc_id] = url
-
-            # update the word count
-            file_wordcount_dict[doc_id] = len(tokens)
-
-            # add fingerprint to the set
-            fingerprint_set.add(fingerprint)
-            return tokens
-        return []
-    except FileNotFoundError as e:
-        return []
+def analyze_file(file: str, file_content: bytes = None) -> ParsedDocument:
+    """
+    Tokenize, fingerprint and stem a file. Runs in the worker processes of the parallel ingestion mode,
+    the duplicate checks and doc id assignment happen afterwards in add_document.
+    """
+    tokenized = tokenize(file, file_content)
+    if tokenized is None:
+        return ParsedDocument(file, None, 0, None, None, {}, {}, {}, [], 0.0, {})
+    url, tokens, field_tokens = tokenized
 
+    # dont fingerprint or stem files with too little content
+    if len(tokens) < 100:
+        return ParsedDocument(file, url, len(tokens), None, None, {}, {}, {}, [], 0.0, {})
 
-def stem_tokens(tokens: list) -> list:
+    build_metrics = metrics.build_metrics
+    start_time = time.perf_counter()
+
+    # create the doc's page_dict (key: token, value: freq) for simhash
+    page_dict = {}
+    for token in tokens:
+        if token in page_dict:  # if the key exists, increment its frequency
+            page_dict[token] += 1
+        else:  # if the key doesn't exist, add it to the dictionary and update its frequency
+            page_dict[token] = 1
+
+    # count the stemmed tokens once so the index gets a single posting per (token, doc),
+    # each distinct word is stemmed once
+    term_freqs = stemming.stem_counts(page_dict)
+
+    # positions of every stemmed token in the page text
+    term_positions = {}
+    if store_positions:
+        word_stems = {word: stemming.stem_word(word) for word in page_dict}
+        for position, token in enumerate(tokens):
+            stem = word_stems[token]
+            stem_positions = term_positions.get(stem)
+            if stem_positions is None:
+                stem_positions = array("I")
+                term_positions[stem] = stem_positions
+            stem_positions.append(position)
+
+    # pack the stemmed field frequencies of each token, and add them to the frequencies weighted with the
+    # default field weights for the cosine norm
+    field_freqs = {}
+    weighted_freqs = dict(term_freqs)
+    for field_number, (field, weight) in enumerate(zip(postings.fields, scoring.field_weight_vector())):
+        field_counts = {}
+        for token in field_tokens[field]:
+            field_counts[token] = field_counts.get(token, 0) + 1
+        shift = field_number * field_freq_bits
+        for token, freq in stemming.stem_counts(field_counts).items():
+            freq = min(freq, max_field_freq)
+            field_freqs[token] = field_freqs.get(token, 0) | freq << shift
+            weighted_freqs[token] += weight * freq
+    field_lengths = [len(field_tokens[field]) for field in postings.fields]
+    norm = scoring.document_norm(weighted_freqs.values())
+    build_metrics.add("stem", time.perf_counter() - start_time)
+
+    with build_metrics.timer("fingerprint"):
+        checksum = fingerprints.content_hash(tokens)
+        fingerprint = fingerprints.simhash(page_dict)
+
+    return ParsedDocument(file, url, len(tokens), checksum, fingerprint, term_freqs, field_freqs, term_positions,
+                          field_lengths, norm, stemming.take_new_stems())
+
+
+def analyze_page(page):
     """
-    Using the porter stemming technique to derive the root of words.
-    """ 
-    # stem plurals to singles
-    plural_stemmer = PorterStemmer()
-    tokens = [plural_stemmer.stem(token) for token in tokens]
+    Analyze a (name, content) page of the corpus in a worker process.
+    """
+    return analyze_file(*page)
 
-    # stem roots
-    snowball_stemmer = SnowballStemmer("english")
-    tokens = [snowball_stemmer.stem(token) for token in tokens]
-    return tokens
 
+def analyze_page_with_metrics(page):
+    """
+    Analyze a page in a worker process and return the document with the build metrics the worker collected for it,
+    so the process that indexes the documents can add them to its own.
+    """
+    document = analyze_file(*page)
+    return document, metrics.build_metrics.take()
 
-def process_tokens(file):
-    # similar_files = False
-            
-    # add the file to the file_id_dict dictionary for future reference
-    if file not in file_id_dict:
-        # get the alphanumeric tokens
-        tokens = tokenize(file)
-        # stem the tokens 
-        tokens = stem_tokens(tokens)
 
-        for token in tokens:
-            word_set.add(token)
-    return tokens
+def add_document(document: ParsedDocument) -> int:
+    """
+    Check a parsed document for exact and near duplicates and assign it the next doc id.
+    Returns the doc id, or 0 if the document isn't indexed.
+    Documents have to be added in the same order as the files are listed so doc ids stay deterministic.
+    """
+    global file_count
 
+    # skip non-HTML content
+    if document.url is None:
+        return 0
+
+    # dont process files with too little content
+    if document.token_count < 100:
+        small_files.append(document.file)
+        dedup_stats["small"] += 1
+        return 0
+
+    start_time = time.perf_counter()
+    try:
+        # dont process pages that are already indexed under the same canonical url
+        if document.url in url_set:
+            dedup_stats["url"] += 1
+            return 0
+
+        # dont process files with exact similarity
+        if document.checksum in checksum_set:
+            dedup_stats["exact"] += 1
+            return 0
+        checksum_set.add(document.checksum)
+
+        # dont process files with near similarity
+        fingerprint = document.fingerprint
+        if fingerprint_index.find_near(fingerprint) is not None:
+            dedup_stats["near"] += 1
+            return 0
+        fingerprint_index.add(fingerprint)
+        url_set.add(document.url)
+    finally:
+        dedup_seconds = time.perf_counter() - start_time
+        dedup_stats["seconds"] += dedup_seconds
+        metrics.build_metrics.add("dedup", dedup_seconds)
+
+    # increment file count
+    file_count += 1
+
+    # the doc id is the line of the document in the documents file
+    doc_id = base_doc_id + file_count
+    documents_writer.write(orjson.dumps([document.file, document.url, document.checksum, fingerprint]))
+    documents_writer.write(b"\n")
+
+    # update the word count, field lengths and norm
+    doc_wordcounts.append(document.token_count)
+    doc_field_lengths.extend(document.field_lengths)
+    doc_norms.append(document.norm)
+    return doc_id
 
-def process_file(file, tokens):
+
+def stem_tokens(tokens: list) -> list:
     """
-    add tokens to partial index
+    Using the porter stemming technique to derive the root of words.
+    """ 
+    return stemming.stem_tokens(tokens)
+
+
+def process_file(doc_id, term_freqs, field_freqs, term_positions=None):
     """
-    for token in tokens:
-        # if word exists in inverted_index -> increase frequency
-        if token in partial_index:
-            occurences = partial_index[token]
-            word_found_in_file = False
-            for occurence in occurences:
-                if occurence[0] == file_id_dict[file]:
-                    occurence[1] += 1
-                    word_found_in_file = True
-                    break
-            if word_found_in_file == False:
-                occurences.append([file_id_dict[file], 1])
-        # if not -> add to inverted_index (value = [(id, 1)])
-        else:
-            partial_index[token] = [[file_id_dict[file], 1]]
-        
+    add a posting for each of the document's tokens to the partial index
+    """
+    global partial_index_bytes
+
+    start_time = time.perf_counter()
+    for token, freq in term_freqs.items():
+        # the postings of a token are parallel doc id, frequency and packed field frequency arrays, and the
+        # positions of every posting one after the other
+        token_postings = partial_index.get(token)
+        if token_postings is None:
+            token_postings = (array("I"), array("I"), array("I"), array("I"))
+            partial_index[token] = token_postings
+            partial_index_bytes += token_overhead_bytes + len(token)
+        token_postings[0].append(doc_id)
+        token_postings[1].append(freq)
+        token_postings[2].append(field_freqs.get(token, 0))
+        if term_positions:
+            token_postings[3].extend(term_positions[token])
+            partial_index_bytes += position_bytes * freq
+
+    partial_index_bytes += posting_bytes * len(term_freqs)
+    metrics.build_metrics.add("insert", time.perf_counter() - start_time)
+    metrics.build_metrics.increment("postings", len(term_freqs))
+
 
 def dump_partial_index():
     """
-    Dump the partial index to a file in JSON format and merge with the existing merged index.
+    Dump the partial index to a file as a run of JSON lines sorted by token.
     """
-    global partial_index
+    global partial_index, partial_index_bytes
 
-    token_loc_dict = {}
+    start_time = time.perf_counter()
 
-    # write partial index to a JSON file
-    with open(f"{len(partial_indices)}.json", "w") as partial_index_file:
-        for token, freq in partial_index.items():
-            loc = partial_index_file.tell()
-            token_loc_dict[token] = loc
-            json_data = {token: freq}
+    # write partial index to a JSON file, sorted so the runs can be merged in a single pass
+    partial_index_path = index_path(f"{len(partial_indices)}.json")
+    with open(partial_index_path, "w") as partial_index_file:
+        for token in sorted(partial_index):
+            doc_ids, freqs, field_freqs, positions = partial_index[token]
+            json_data = {token: [doc_ids.tolist(), freqs.tolist(), field_freqs.tolist(), positions.tolist()]}
             partial_index_file.write(orjson.dumps(json_data).decode())
             # add a newline to separate records
             partial_index_file.write('\n')  
-
-    token_locs[f"{len(partial_indices)}.json"] = token_loc_dict
+        if write_checkpoints:
+            sync_file(partial_index_file)
 
     # clear the partial index dict
     partial_index.clear()
+    partial_index_bytes = 0
 
     # add the partial index to partial_indices
-    partial_indices.append(f"{len(partial_indices)}.json")
+    partial_indices.append(partial_index_path)
 
-    # update result file
-    write_result_to_file()
+    # results.txt is written once the partial indices are merged, the checkpoint records the progress
+    if write_checkpoints:
+        write_checkpoint()
+    metrics.build_metrics.add("flush", time.perf_counter() - start_time)
     print("dumped partial index", len(partial_indices))
 
 
+def sync_file(f):
+    """
+    flush a file to the disk, so a checkpoint never refers to data that was lost with the machine
+    """
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def write_checkpoint():
+    """
+    write the state of the build after a partial index was dumped: the partial indices, the doc id counter, the
+    sizes of the files and documents files, the small and large files, the dedup state and counters and the stem
+    table. the fingerprints and urls of the indexed documents are read back from the documents file. the checkpoint
+    file is replaced last, so a stopped build always has a complete checkpoint
+    """
+    for writer in (files_writer, documents_writer):
+        sync_file(writer)
+    for name, values in ((segments.doc_wordcounts_file, doc_wordcounts),
+                         (segments.doc_field_lengths_file, doc_field_lengths), (segments.doc_norms_file, doc_norms)):
+        with open(index_path(checkpoint_prefix + name), "wb") as f:
+            values.tofile(f)
+            sync_file(f)
+
+    checkpoint = {
+        "settings": checkpoint_settings(),
+        "partial_indices": [os.path.basename(partial_index_file) for partial_index_file in partial_indices],
+        "file_count": file_count,
+        "files_size": files_writer.tell(),
+        "documents_size": documents_writer.tell(),
+        "small_files": small_files,
+        "large_files": large_files,
+        "dedup_stats": dedup_stats,
+        "checksums": list(checksum_set),
+        "stem_table": stem_table,
+    }
+    with open(index_path(checkpoint_file) + ".tmp", "wb") as f:
+        f.write(orjson.dumps(checkpoint))
+        sync_file(f)
+    os.replace(index_path(checkpoint_file) + ".tmp", index_path(checkpoint_file))
+
+
+def checkpoint_settings():
+    """
+    the settings a resumed build has to share with the build it continues
+    """
+    return {"corpus": corpus_path, "positions": store_positions, "max_fingerprint_distance": max_fingerprint_distance}
+
+
+def resume_checkpoint():
+    """
+    restore the state of a stopped build from the checkpoint of the build directory and return the files it listed,
+    which are skipped, or None if there is no checkpoint. the files and documents files and the document tables
+    can have been written after the checkpoint, they are cut back to it
+    """
+    global file_count, partial_indices, doc_wordcounts, doc_field_lengths, doc_norms, small_files, large_files
+    global stem_table
+
+    try:
+        with open(index_path(checkpoint_file), "rb") as f:
+            checkpoint = orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
+    if checkpoint["settings"] != checkpoint_settings():
+        raise ValueError("the stopped build used other settings " + orjson.dumps(checkpoint["settings"]).decode() +
+                         ", resume it with the same settings or build the index again without --resume")
+
+    file_count = checkpoint["file_count"]
+    partial_indices = [index_path(name) for name in checkpoint["partial_indices"]]
+    small_files = checkpoint["small_files"]
+    large_files = checkpoint["large_files"]
+    dedup_stats.update(checkpoint["dedup_stats"])
+    checksum_set.clear()
+    checksum_set.update(checkpoint["checksums"])
+    stem_table = checkpoint["stem_table"]
+
+    doc_tables = []
+    for name, typecode, row_length in ((segments.doc_wordcounts_file, "I", 1),
+                                       (segments.doc_field_lengths_file, "I", len(postings.fields)),
+                                       (segments.doc_norms_file, "f", 1)):
+        values = array(typecode)
+        with open(index_path(checkpoint_prefix + name), "rb") as f:
+            values.frombytes(f.read())
+        del values[(file_count + 1) * row_length:]
+        doc_tables.append(values)
+    doc_wordcounts, doc_field_lengths, doc_norms = doc_tables
+
+    os.truncate(index_path(files_file), checkpoint["files_size"])
+    os.truncate(index_path(documents_file), checkpoint["documents_size"])
+    fingerprint_index.clear()
+    url_set.clear()
+    with open(index_path(documents_file), "rb") as documents:
+        for document_line in documents:
+            _, url, _, fingerprint = orjson.loads(document_line)
+            fingerprint_index.add(fingerprint)
+            url_set.add(url)
+    with open(index_path(files_file), "rb") as files:
+        return {orjson.loads(file_line)[0] for file_line in files}
+
+
+def remove_checkpoint():
+    """
+    remove the checkpoint and the partial indices of a finished build
+    """
+    for name in [checkpoint_file] + [checkpoint_prefix + name for name in (segments.doc_wordcounts_file,
+                                                                           segments.doc_field_lengths_file,
+                                                                           segments.doc_norms_file)]:
+        if os.path.exists(index_path(name)):
+            os.remove(index_path(name))
+    for partial_index_file in partial_indices:
+        os.remove(partial_index_file)
+
+
+def read_partial_index(partial_index_file):
+    """
+    stream the (token, [doc_ids, freqs, packed field freqs, positions]) records of a token-sorted partial index
+    """
+    with open(partial_index_file, "rb") as partial_file:
+        for token_line in partial_file:
+            data = orjson.loads(token_line)
+            for token, token_postings in data.items():
+                yield token, token_postings
+
+
 def merge_partial_indices():
     """
-    merge all partial indices
+    merge all partial indices with a k-way merge of the token-sorted runs
     """
     global partial_indices
 
-    with open("final_index.json", "w") as inverted_index_file:
-        # iterate through all words in the wordset
-        for token in word_set:
-            token_frequencies = []
-            
-            # iterate through each partial index
-            for partial_index_file in partial_indices:
-                # check if the token exists in the partial index
-                if token in token_locs[partial_index_file]:
-                    token_loc = token_locs[partial_index_file][token]
-                    with open(partial_index_file, "rb") as partial_file:
-                        partial_file.seek(token_loc)
-                        token_line = partial_file.readline()
-                        data = orjson.loads(token_line.decode())
-                        # extract the frequency
-                        token_frequencies.extend(data[token])
-            
-            # create a new list for token frequencies with scores
-            token_frequencies_scores = []
-
-            # iterate through the token's frequencies and add the tf-idf score for each doc
-            for token_freq in token_frequencies:
-                doc_id = token_freq[0]
-                file_freq = token_freq[1]
-                file_wordcount = file_wordcount_dict[str(doc_id)]
-                tf = file_freq / file_wordcount
-                idf = math.log(file_count / len(token_frequencies))
-                tf_idf = round(tf * idf, 5)
-                token_frequencies_scores.append([doc_id, file_freq, tf_idf])
-
-            # write the combined frequencies to final inverted index
-            file_loc = inverted_index_file.tell()
-            combined_token_locs[token] = file_loc
-            json_data = {token: token_frequencies_scores}
-            inverted_index_file.write(orjson.dumps(json_data).decode())
-            # add a newline to separate records
-            inverted_index_file.write('\n')  
-
+    # stream every partial index at once, heapq.merge keeps the run order for equal
+    # tokens so the postings of a token stay sorted by doc id
+    runs = [read_partial_index(partial_index_file) for partial_index_file in partial_indices]
+    merged_records = heapq.merge(*runs, key=lambda record: record[0])
+
+    merge_progress["tokens"] = 0
+    merge_progress["postings"] = 0
+    start_time = time.time()
+
+    # word count of every document indexed by doc id
+    doc_wordcount_values = np.frombuffer(doc_wordcounts, dtype=np.uint32).astype(np.float64)
+    field_shifts = np.arange(len(postings.fields), dtype=np.uint32) * field_freq_bits
+
+    # the positions are written to their own file next to the postings
+    positions_writer = postings.PositionsWriter(index_path(postings.positions_file)) if store_positions else None
+    build_metrics = metrics.build_metrics
+
+    with postings.PostingsWriter(index_path(postings.binary_index_file)) as postings_writer:
+        # iterate through the tokens in sorted order
+        for token, token_records in itertools.groupby(merged_records, key=lambda record: record[0]):
+            token_start_time = time.perf_counter()
+            doc_ids = array("I")
+            file_freqs = array("I")
+            packed_field_freqs = array("I")
+            positions = array("I")
+
+            # combine the token's postings from each partial index
+            for _, (run_doc_ids, run_freqs, run_field_freqs, run_positions) in token_records:
+                doc_ids.extend(run_doc_ids)
+                file_freqs.extend(run_freqs)
+                packed_field_freqs.extend(run_field_freqs)
+                positions.extend(run_positions)
+
+            # unpack the field frequencies into a column per field
+            doc_id_values = np.frombuffer(doc_ids, dtype=np.uint32)
+            field_freqs = np.frombuffer(packed_field_freqs, dtype=np.uint32)[:, None] >> field_shifts & max_field_freq
+
+            # write the combined frequencies to final inverted index, the word counts bound the scores of each block
+            with build_metrics.timer("encode_postings"):
+                postings_writer.write(token, doc_id_values, file_freqs, field_freqs,
+                                      doc_wordcount_values[doc_id_values - base_doc_id])
+            if positions_writer is not None:
+                with build_metrics.timer("encode_positions"):
+                    positions_writer.write(token, doc_id_values, file_freqs, positions)
+            build_metrics.add("merge_token", time.perf_counter() - token_start_time)
+
+            # update the merge progress
+            merge_progress["tokens"] += 1
+            merge_progress["postings"] += len(doc_ids)
+            merge_progress["seconds"] = time.time() - start_time
+            if merge_progress["tokens"] % merge_progress_interval == 0:
+                print_merge_progress()
+
+    combined_token_locs.update(postings_writer.token_locs)
+
+    # write the token locations of the positions, or remove the positions of a previous build
+    if positions_writer is not None:
+        positions_writer.close()
+        with open(index_path(postings.position_locations_file), "wb") as f:
+            f.write(orjson.dumps(positions_writer.token_locs))
+    else:
+        for name in (postings.positions_file, postings.position_locations_file):
+            if os.path.exists(index_path(name)):
+                os.remove(index_path(name))
+
+    metrics.build_metrics.add("merge", time.time() - start_time)
+    print_merge_progress()
     print("merged all partial indices")
 
 
-def iterateDirectory() -> None:
-    """
-    Recursively iterate through the DEV folder to process all the files.
-    """
-    global partial_index 
-     
-    directory_path = "DEV"
-
-    # iterate through each file of the directory
-    for root, dirs, files in os.walk(directory_path):
-        for file in files:
-            if file != ".DS_Store":
-                # similar_files = process_tokens(file)
-                # if not similar_files:
-                #     process_file(file)
-                file_path = os.path.join(root, file)
-                file_size = os.path.getsize(file_path)
-                # dont process too big or too small files
-                if file_size > max_file_size:
-                    large_files.append(file_path)
-                elif file_size < min_file_size:
-                    small_files.append(file_path)
-                else:
-                    tokens = process_tokens(file_path)
-                    process_file(file_path, tokens)
-
-                    # check if partial index needs to be dumped
-                    if len(partial_index) >= partial_index_threshold:
-                        dump_partial_index()
+def print_merge_progress():
+    """
+    print how many tokens and postings were merged and the merge throughput
+    """
+    seconds = max(merge_progress["seconds"], 1e-9)
+    print("merged", merge_progress["tokens"], "tokens,", merge_progress["postings"], "postings",
+          f"({merge_progress['tokens'] / seconds:.0f} tokens/s, {merge_progress['postings'] / seconds:.0f} postings/s)")
+
+
+def walk_directory():
+    """
+    Recursively iterate through the corpus directory (the DEV folder by default) and yield every file.
+    """
+    return corpus.DirectoryCorpus(corpus_path).paths()
+
+
+def indexable_size(entry):
+    """
+    dont process too big or too small files, checked from the size the corpus lists before a file is read
+    """
+    return min_file_size <= entry.size <= max_file_size
+
+
+def list_files(file_paths=None, skipped_files=None):
+    """
+    Yield the entry and content of the files (all files of the corpus by default), the content is None for files
+    that don't have a size that can be indexed. Files in skipped_files were listed by the build a resumed build
+    continues and aren't yielded. The files are read ahead by a background thread while the ones before them are
+    processed.
+    """
+    def accept(entry):
+        return indexable_size(entry) and (skipped_files is None or entry.name not in skipped_files)
+
+    corpus_reader = corpus.open_corpus(corpus_path)
+    for entry, file_content in corpus.read_ahead(corpus_reader.scan(accept, file_paths)):
+        if skipped_files is None or entry.name not in skipped_files:
+            yield entry, file_content
+    if isinstance(corpus_reader, corpus.DirectoryCorpus):
+        missing_files.extend(corpus_reader.missing_files)
+
+
+def record_file(entry, page_hash=None):
+    """
+    record the stats and the content hash (None if the file wasn't read) of a listed file in the files file and
+    the files that are too big or too small
+    """
+    files_writer.write(orjson.dumps([entry.name, entry.mtime, entry.size, page_hash]))
+    files_writer.write(b"\n")
+    if entry.size > max_file_size:
+        large_files.append(entry.name)
+    elif entry.size < min_file_size:
+        small_files.append(entry.name)
+
+
+def send_pages(files, listed_files, in_flight):
+    """
+    Yield the (name, content) pages of the files that can be indexed to the pool, once the in_flight semaphore
+    allows it. It's released for every indexed document, so the pool doesn't read the whole corpus ahead of the
+    workers. Every listed file is queued in listed_files with its content size and hash (None if it isn't indexed)
+    so the files are recorded in order as their documents come back.
+    """
+    for entry, file_content in files:
+        if file_content is None:
+            listed_files.append((entry, None, None))
+            continue
+        in_flight.acquire()
+        listed_files.append((entry, len(file_content), content_hash(file_content)))
+        yield entry.name, file_content
+
+
+def index_document(document: ParsedDocument) -> None:
+    """
+    Add an analyzed document to the partial index and dump the partial index when it uses half the memory budget.
+    """
+    stem_table.update(document.new_stems)
+
+    doc_id = add_document(document)
+    if not doc_id:
+        return
+
+    process_file(doc_id, document.term_freqs, document.field_freqs, document.term_positions)
+
+    # check if partial index needs to be dumped
+    if partial_index_bytes >= max_memory // 2:
+        dump_partial_index()
+
+
+def iterateDirectory(workers=1, file_paths=None, skipped_files=None) -> None:
+    """
+    Stream the files of the corpus (or only the given files) to process all the files.
+    With more than one worker the files are tokenized and stemmed in a process pool, which gets them in chunks
+    of ingest_chunk_size files, and the results are added to the index in file order by this process.
+    A resumed build passes the files it already listed as skipped_files and appends to the files and documents files.
+    """
+    global documents_writer, files_writer
+
+    start_time = time.time()
+    ingest_stats["files"] = 0
+    ingest_stats["bytes"] = 0
+    documents_writer = open(index_path(documents_file), "wb" if skipped_files is None else "ab")
+    files_writer = open(index_path(files_file), "wb" if skipped_files is None else "ab")
+
+    if workers > 1:
+        in_flight = threading.Semaphore(workers * ingest_chunk_size * ingest_chunks_in_flight)
+        listed_files = deque()
+        with multiprocessing.Pool(workers) as pool:
+            # imap returns the documents in the same order as the files, with the worker's metrics if they are enabled
+            analyze = analyze_page_with_metrics if metrics.build_metrics.enabled else analyze_page
+            try:
+                for document in pool.imap(analyze, send_pages(list_files(file_paths, skipped_files), listed_files,
+                                                              in_flight),
+                                          chunksize=ingest_chunk_size):
+                    in_flight.release()
+                    if metrics.build_metrics.enabled:
+                        document, worker_metrics = document
+                        metrics.build_metrics.merge(worker_metrics)
+                    # record the files listed up to the document's file, so a checkpoint covers them
+                    while True:
+                        entry, content_size, page_hash = listed_files.popleft()
+                        record_file(entry, page_hash)
+                        if content_size is not None:
+                            break
+                    ingest_stats["bytes"] += content_size
+                    index_document(document)
+                    ingest_stats["files"] += 1
+            finally:
+                # unblock the pool's task thread if the build stopped early
+                in_flight.release(workers * ingest_chunk_size * ingest_chunks_in_flight)
+        for entry, _, _ in listed_files:
+            record_file(entry)
+    else:
+        for entry, file_content in list_files(file_paths, skipped_files):
+            if file_content is None:
+                record_file(entry)
+                continue
+            record_file(entry, content_hash(file_content))
+            ingest_stats["bytes"] += len(file_content)
+            index_document(analyze_file(entry.name, file_content))
+            ingest_stats["files"] += 1
+
     # dump one last time with current partial index
     if (len(partial_index) > 0):
         dump_partial_index()
+    documents_writer.close()
+    files_writer.close()
+
+    ingest_stats["workers"] = workers
+    ingest_stats["seconds"] = time.time() - start_time
+    docs_per_second = ingest_stats["files"] / max(ingest_stats["seconds"], 1e-9)
+    megabytes = ingest_stats["bytes"] / (1024 * 1024)
+    print("processed", ingest_stats["files"], "files", f"({megabytes:.1f} MB) in", round(ingest_stats["seconds"], 1),
+          "s", f"({docs_per_second:.1f} docs/s, {megabytes / max(ingest_stats['seconds'], 1e-9):.1f} MB/s with "
+               f"{workers} worker{'s' if workers > 1 else ''})")
+    print("dropped", dedup_stats["small"], "small,", dedup_stats["url"], "duplicate url,", dedup_stats["exact"],
+          "exact duplicate and", dedup_stats["near"], "near duplicate documents, the duplicate checks took",
+          round(dedup_stats["seconds"], 3), "s")
+
+
+def rank_binary_postings(index_file, token_locs):
+    """
+    intersect the binary postings lists of the query tokens and return the common doc ids sorted by summed score
+    """
+    common_doc_ids, common_docs_scores = index_file.intersect(token_locs)
 
+    # sort the doc ids based on scores descending
+    order = np.argsort(-common_docs_scores, kind="stable")
+    return common_doc_ids[order].tolist()
 
-def get_common_docs(nested_lists, query_word_count):
-    # create a dictionary to store frequencies for each element
-    freq_dict = {}
-    
-    # iterate over each sublist in the nested list
-    for lst in nested_lists:
-        for doc in lst:
-            doc_id = doc[0]
-            if doc_id in freq_dict:
-                freq_count = freq_dict[doc_id][0] + 1
-                score = freq_dict[doc_id][1] + doc[2]
-                freq_dict[doc_id] = [freq_count, score]
-            else:
-                freq_count = 1
-                score = doc[2] 
-                freq_dict[doc_id] = [freq_count, score]
-    
-    common_docs_dict = {key: value for key, value in freq_dict.items() if value[0] == query_word_count}
-    return common_docs_dict
 
+def rank_phrases(index_file, token_locs, tokens, phrases, k=None, min_matches=None, return_scores=False,
+                 token_groups=None):
+    """
+    rank the docs that contain every token (or at least min_matches of them) and boost the scores of the top
+    phrase_candidates docs that contain the quoted phrases, the positions of the other docs are never read.
+    with return_scores the number of tokens and the boosted score of every doc are returned too
+    """
+    candidate_count = max(k or 0, phrase_candidates)
+    if min_matches is not None:
+        ranked_doc_ids, ranked_matches, ranked_scores = index_file.top_k_any(
+            token_locs, candidate_count if k is not None else None, min_matches, return_scores=True,
+            token_groups=token_groups)
+        doc_ids = ranked_doc_ids[:candidate_count]
+        matches = ranked_matches[:candidate_count]
+        scores = ranked_scores[:candidate_count]
+        remaining_doc_ids = ranked_doc_ids[candidate_count:]
+        remaining_matches = ranked_matches[candidate_count:]
+        remaining_scores = ranked_scores[candidate_count:]
+    elif k is not None:
+        doc_ids, scores = index_file.top_k(token_locs, candidate_count, return_scores=True)
+        matches = [len(tokens)] * len(doc_ids)
+        remaining_doc_ids = remaining_matches = remaining_scores = []
+    else:
+        common_doc_ids, common_docs_scores = index_file.intersect(token_locs)
+        order = np.lexsort((common_doc_ids, -common_docs_scores))
+        doc_ids = common_doc_ids[order[:candidate_count]].tolist()
+        scores = common_docs_scores[order[:candidate_count]].tolist()
+        matches = [len(tokens)] * len(doc_ids)
+        remaining_doc_ids = common_doc_ids[order[candidate_count:]].tolist()
+        remaining_matches = [len(tokens)] * len(remaining_doc_ids)
+        remaining_scores = common_docs_scores[order[candidate_count:]].tolist()
+
+    # sort the candidates based on their number of tokens and boosted scores descending
+    boosted_scores = np.array(scores) * index_file.phrase_factors(doc_ids, tokens, phrases)
+    order = np.lexsort((doc_ids, -boosted_scores, -np.array(matches))).tolist()
+    ranked_doc_ids = ([doc_ids[i] for i in order] + remaining_doc_ids)[:k]
+    if return_scores:
+        ranked_matches = ([matches[i] for i in order] + list(remaining_matches))[:k]
+        ranked_scores = ([float(boosted_scores[i]) for i in order] + list(remaining_scores))[:k]
+        return ranked_doc_ids, ranked_matches, ranked_scores
+    return ranked_doc_ids
+
+
+def rank_shards(sharded_index, tokens, query_phrases, k=None, min_matches=None, token_groups=None):
+    """
+    rank the docs of every shard concurrently and merge the top k docs of the shards by their number of tokens and
+    their score, the shards score with the stats of the whole index so their scores can be compared.
+    the docs are returned as (shard number, doc id) pairs
+    """
+    def rank_shard(shard_number, index):
+        # a shard without some of the tokens can still have docs with min_matches of them
+        shard_token_numbers = [token_number for token_number, token in enumerate(tokens) if token in index.lexicon]
+        shard_tokens = [tokens[token_number] for token_number in shard_token_numbers]
+        shard_groups = None if token_groups is None else \
+            [token_groups[token_number] for token_number in shard_token_numbers]
+        # query words are counted like the matches of a doc: every token (words can share a stem), or every
+        # group of the tokens of a prefix word
+        shard_words = len(shard_tokens) if shard_groups is None else len(set(shard_groups))
+        query_words = len(tokens) if token_groups is None else len(set(token_groups))
+        if shard_words < (min_matches or query_words):
+            return []
+        token_locs = [index.lexicon[token] for token in shard_tokens]
+        phrases = [([shard_tokens.index(token) for token in phrase_tokens], window)
+                   for phrase_tokens, window in query_phrases
+                   if all(token in shard_tokens for token in phrase_tokens)]
+        if phrases:
+            doc_ids, matches, scores = rank_phrases(index, token_locs, shard_tokens, phrases, k, min_matches,
+                                                    return_scores=True, token_groups=shard_groups)
+        elif min_matches is not None:
+            doc_ids, matches, scores = index.top_k_any(token_locs, k, min_matches, return_scores=True,
+                                                       token_groups=shard_groups)
+        elif k is not None:
+            doc_ids, scores = index.top_k(token_locs, k, return_scores=True)
+            matches = [len(tokens)] * len(doc_ids)
+        else:
+            common_doc_ids, common_docs_scores = index.intersect(token_locs)
+            doc_ids, scores = common_doc_ids.tolist(), common_docs_scores.tolist()
+            matches = [len(tokens)] * len(doc_ids)
+        return [(-doc_matches, -score, shard_number, doc_id)
+                for doc_id, doc_matches, score in zip(doc_ids, matches, scores)]
+
+    ranked_docs = sorted(doc for shard_docs in sharded_index.scatter(rank_shard) for doc in shard_docs)
+    return [(shard_number, doc_id) for _, _, shard_number, doc_id in ranked_docs[:k]]
 
-def process_user_query(query, token_loc_dict):
+
+def parse_query(query):
     """
-    process the user's query and return a list of documents that include the user's query words
-    """ 
-    # set the exact query bool to true
-    exact_query = True
+    Split the user's query into its lowercase words and their stems.
+    """
+    # drop the windows of proximity phrases and the prefix words (see parse_prefixes)
+    query = phrase_pattern.sub(lambda match: match.group(1), query)
+    query = prefix_pattern.sub(" ", query)
 
     # tokenize the query:
     search_tokens = re.split(r'[^a-zA-Z0-9]+', query.lower())
@@ -406,81 +876,335 @@ def process_user_query(query, token_loc_dict):
 
     # stem the query:
     query_tokens = stem_tokens(search_tokens)
+    return search_tokens, query_tokens
 
-    query_tokens_dict = {k: v for k, v in zip(query_tokens, search_tokens)}
 
-    # access the scores for each token in the query
-    query_tokens_lines = []
+def parse_phrases(query):
+    """
+    Return the stems of every quoted phrase of the query with its window: None for an exact phrase like
+    "machine learning", or the number of words the phrase's words have to fit in for a proximity phrase
+    like "machine learning"~5.
+    """
+    phrases = []
+    for match in phrase_pattern.finditer(query):
+        _, phrase_query = parse_query(match.group(1))
+        window = int(match.group(2)) if match.group(2) else None
+        if len(phrase_query) > 1:
+            phrases.append((phrase_query, window))
+    return phrases
+
+
+def parse_prefixes(query):
+    """
+    Return the lowercase prefixes of the prefix words of the query, like comput for comput*. They aren't stemmed,
+    the tokens of the index that start with them are searched instead (see expand_prefixes).
+    """
+    return [prefix.lower() for prefix in prefix_pattern.findall(query) if len(prefix) > 1]
+
+
+def expand_prefixes(prefixes, query_tokens, result_query, exact_query, token_loc_dict):
+    """
+    Add the tokens every prefix is expanded to (the max_prefix_expansions tokens of the index that start with it
+    and are in the most documents) to the query tokens of match_query_tokens and the prefix words to its query.
+    Returns the tokens, the group of every token (the tokens of a prefix are one group, a document matches it by
+    including any of them, the other tokens are groups of their own) or None if no prefix was expanded, the query
+    and if every prefix was expanded.
+    """
+    tokens = list(query_tokens)
+    token_groups = list(range(len(tokens)))
+    expanded_prefixes = []
+    for prefix in prefixes:
+        expansions = [token for token in token_loc_dict.prefix_tokens(prefix, max_prefix_expansions)
+                      if token not in tokens]
+        if expansions:
+            group = len(query_tokens) + len(expanded_prefixes)
+            tokens.extend(expansions)
+            token_groups.extend([group] * len(expansions))
+            expanded_prefixes.append(prefix)
+    if not expanded_prefixes:
+        return tokens, None, result_query, False
+    result_words = [result_query] if result_query else []
+    result_query = " ".join(result_words + [prefix + "*" for prefix in expanded_prefixes])
+    return tokens, token_groups, result_query, exact_query and len(expanded_prefixes) == len(prefixes)
+
+
+def match_query_tokens(search_tokens, query_tokens, token_loc_dict, correct_spelling=None):
+    """
+    Return the query stems that exist in the index, the query made of their words and if every stem exists.
+    correct_spelling returns the indexed word that replaces a word whose stem doesn't exist, or None to
+    drop the word.
+    """
+    # set the exact query bool to true
+    exact_query = True
+
+    query_tokens_dict = {k: v for k, v in zip(query_tokens, search_tokens)}
 
     accepted_query_tokens = []
 
     # check if the word exists in inverted index
     for word in query_tokens:
-        try:
-            word_loc = token_loc_dict[word]
+        if word in token_loc_dict:
             accepted_query_tokens.append(word)
-        except KeyError:
+        else:
             # set exact query to false
             exact_query = False
-    
+
+            # replace a misspelled word with the closest indexed word
+            corrected_word = correct_spelling(query_tokens_dict[word]) if correct_spelling else None
+            if corrected_word is not None:
+                corrected_token = stemming.stem_word(corrected_word)
+                if corrected_token in token_loc_dict:
+                    query_tokens_dict.setdefault(corrected_token, corrected_word)
+                    accepted_query_tokens.append(corrected_token)
+
+    # offer alternative search for nonnexistent words
+    result_words = [query_tokens_dict[word] for word in accepted_query_tokens]
+    result_query = " ".join(result_words)
+    return accepted_query_tokens, result_query, exact_query
+
+
+def process_user_query(query, token_loc_dict, index_file, k=None, min_match=None):
+    """
+    process the user's query and return a list of documents that include the user's query words.
+    only the k highest scoring documents are returned if k is given.
+    index_file is a segments.SegmentedIndex or a shards.ShardedIndex (token_loc_dict is its lexicon) ranked with
+    its scorer.
+    documents have to include every query word, or with min_match (a share of the query words like 0.5) at least
+    that many of them and then they are ranked by the number of query words they include first.
+    misspelled words are replaced by the closest indexed word and prefix words like comput* are searched.
+    """ 
+    search_metrics = metrics.search_metrics
+    with search_metrics.timer("parse"):
+        search_tokens, query_tokens = parse_query(query)
+    with search_metrics.timer("lexicon"):
+        accepted_query_tokens, result_query, exact_query = match_query_tokens(search_tokens, query_tokens,
+                                                                              token_loc_dict,
+                                                                              index_file.correct_spelling)
+
+        # a document has to include one of the tokens of every prefix word
+        token_groups = None
+        prefixes = parse_prefixes(query)
+        if prefixes:
+            accepted_query_tokens, token_groups, result_query, exact_query = expand_prefixes(
+                prefixes, accepted_query_tokens, result_query, exact_query, token_loc_dict)
+
     # return empty result if no query tokens exist
     if len(accepted_query_tokens) == 0:
         return [], "", False
-    
-    # offer alternative search for nonnexistent words
-    result_words = [query_tokens_dict[word] for word in accepted_query_tokens if word in accepted_query_tokens]
-    result_query = " ".join(result_words)
-    
-    # get all postings of tokens in the accepted query tokens
-    for word in accepted_query_tokens:
-        with open("final_index.json", "rb") as index_file:
-            word_loc = token_loc_dict[word]
-            index_file.seek(word_loc)
-            token_line = index_file.readline()
-            token_data = orjson.loads(token_line.decode())
-            query_tokens_lines.append(token_data)
-
-    # extract the common documents that have all the words
-    all_doc_ids = [set([item[0] for item in list(line.values())[0]]) for line in query_tokens_lines]
-    common_doc_ids = set.intersection(*all_doc_ids)
-
-    # dict to store the total sum of third values for each common document
-    common_docs_scores = {}
-
-    # iterate through the lines and sum up the third values for common documents    
-    for line in query_tokens_lines:
-        for word, postings in line.items():
-            for item in postings:
-                doc_id = item[0]
-                if doc_id in common_doc_ids:
-                    common_docs_scores.setdefault(doc_id, 0)
-                    common_docs_scores[doc_id] += item[2]
-    
-    # sort the elements based on scores descending
-    sorted_doc_sum = sorted(common_docs_scores.items(), key=lambda x: x[1], reverse=True)
 
-    # return the top doc ids
-    common_doc_ids_list = [item[0] for item in sorted_doc_sum] if sorted_doc_sum else []
-    
-    # return common docs sorted
-    return common_doc_ids_list, result_query, exact_query
+    # number of query words a document has to include, None if it has to include all of them.
+    # the token groups of prefix words are only counted by the ranked OR
+    word_count = len(accepted_query_tokens) if token_groups is None else max(token_groups) + 1
+    min_matches = None
+    if min_match is not None:
+        min_matches = min(max(math.ceil(min_match * word_count), 1), word_count)
+    if token_groups is not None:
+        min_matches = min_matches or word_count
+    elif min_matches == word_count:
+        min_matches = None
+
+    # rank every shard of a sharded index and merge their top docs
+    if isinstance(index_file, shards.ShardedIndex):
+        return rank_shards(index_file, accepted_query_tokens, parse_phrases(query), k, min_matches,
+                           token_groups), result_query, exact_query
+
+    # read the binary postings of the accepted query tokens and rank them
+    token_locs = [token_loc_dict[word] for word in accepted_query_tokens]
+
+    # quoted phrases whose words are all in the index, as numbers of the accepted query tokens
+    phrases = [([accepted_query_tokens.index(token) for token in phrase_tokens], window)
+               for phrase_tokens, window in parse_phrases(query)
+               if all(token in accepted_query_tokens for token in phrase_tokens)]
+    if phrases:
+        return rank_phrases(index_file, token_locs, accepted_query_tokens, phrases, k, min_matches,
+                            token_groups=token_groups), result_query, exact_query
+
+    if min_matches is not None:
+        return index_file.top_k_any(token_locs, k, min_matches, token_groups=token_groups), \
+            result_query, exact_query
+    if k is not None:
+        return index_file.top_k(token_locs, k), result_query, exact_query
+    return rank_binary_postings(index_file, token_locs), result_query, exact_query
 
     
 def write_result_to_file():
     """
     write the results to a file
     """
-    result_file = "results.txt"
+    result_file = index_path("results.txt")
     with open(result_file, "w") as output_result_file:
         output_result_file.write("number of documents processed: " + str(file_count) + "\n")
-        output_result_file.write("number of unique words: " + str(len(word_set)) + "\n")
+        output_result_file.write("number of unique words: " + str(len(combined_token_locs)) + "\n")
         output_result_file.write("number of files too large: " + str(len(large_files)) + "\n")
         output_result_file.write("number of files too small: " + str(len(small_files)) + "\n")
+        output_result_file.write("number of missing files: " + str(len(missing_files)) + "\n")
+        output_result_file.write("number of duplicate urls: " + str(dedup_stats["url"]) + "\n")
+        output_result_file.write("number of exact duplicates: " + str(dedup_stats["exact"]) + "\n")
+        output_result_file.write("number of near duplicates: " + str(dedup_stats["near"]) + "\n")
 
 
-def create_inverted_index():
-    # iterate through the files and process the tokens
-    iterateDirectory()
+def write_document_tables():
+    """
+    stream the documents file into file_id.json (file -> doc id) and url_dict.json (doc id -> url),
+    and write the document word counts and the segment's doc id range
+    """
+    with open(index_path(documents_file), "rb") as documents, open(index_path("file_id.json"), "wb") as file_id_file, \
+            open(index_path("url_dict.json"), "wb") as url_file:
+        file_id_file.write(b"{")
+        url_file.write(b"{")
+        for doc_id, document_line in enumerate(documents, start=base_doc_id + 1):
+            file, url, _, _ = orjson.loads(document_line)
+            separator = b"," if doc_id > base_doc_id + 1 else b""
+            file_id_file.write(separator + orjson.dumps(file) + b":" + orjson.dumps(str(doc_id)))
+            url_file.write(separator + orjson.dumps(str(doc_id)) + b":" + orjson.dumps(url))
+        file_id_file.write(b"}")
+        url_file.write(b"}")
+
+    with open(index_path(segments.doc_wordcounts_file), "wb") as f:
+        doc_wordcounts.tofile(f)
+    with open(index_path(segments.doc_field_lengths_file), "wb") as f:
+        doc_field_lengths.tofile(f)
+    with open(index_path(segments.doc_norms_file), "wb") as f:
+        doc_norms.tofile(f)
+
+    with open(index_path(segments.segment_meta_file), "wb") as f:
+        f.write(orjson.dumps({"base_doc_id": base_doc_id, "doc_count": file_count}))
+
+    # searchers stem the query words found in the stem table without loading nltk
+    stemming.write_stem_table(index_dir, stem_table)
+
+
+def write_spelling_index():
+    """
+    write the spelling index of the words whose stems are in enough of the segment's documents, the words
+    misspelled query words can be corrected to
+    """
+    words = []
+    if combined_token_locs:
+        postings_reader = postings.PostingsReader(index_path(postings.binary_index_file))
+        words = [word for word, stem in stem_table.items()
+                 if spelling.is_suggestable(word) and stem in combined_token_locs and
+                 postings_reader.count(combined_token_locs[stem]) >= spelling.min_doc_freq]
+        postings_reader.close()
+    spelling.write_spelling_index(index_dir, words)
+
+
+def write_build_metrics():
+    """
+    write the stage timings and counters of the build with the file and duplicate counts to the build metrics file
+    and print them
+    """
+    summary = metrics.build_metrics.summary()
+    summary["counters"].update({
+        "files": ingest_stats["files"],
+        "bytes": ingest_stats["bytes"],
+        "documents": file_count,
+        "small_files": len(small_files),
+        "large_files": len(large_files),
+        "missing_files": len(missing_files),
+        "url_duplicates": dedup_stats["url"],
+        "exact_duplicates": dedup_stats["exact"],
+        "near_duplicates": dedup_stats["near"],
+        "partial_indices": len(partial_indices),
+        "tokens": merge_progress["tokens"],
+        "merged_postings": merge_progress["postings"],
+        "workers": ingest_stats["workers"],
+    })
+    with open(index_path(build_metrics_file), "wb") as f:
+        f.write(orjson.dumps(summary))
+    print(orjson.dumps(summary, option=orjson.OPT_INDENT_2).decode())
+
+
+def index_path(name):
+    """
+    path of an index file in the directory the index is written to
+    """
+    return os.path.join(index_dir, name)
+
+
+def content_hash(file_content):
+    """
+    hash the contents of a file to check if a file with a new modification time really changed
+    """
+    return hashlib.blake2b(file_content, digest_size=16).hexdigest()
+
+
+def file_hash(file_path):
+    """
+    hash the contents of a file of the corpus folder
+    """
+    with open(file_path, "rb") as f:
+        return content_hash(f.read())
+
+
+def build_manifest(manifest=None):
+    """
+    add the files listed by the last build to the manifest with their content hashes, doc ids, checksums and
+    fingerprints
+    """
+    if manifest is None:
+        manifest = {}
+
+    with open(index_path(files_file), "rb") as files:
+        for file_line in files:
+            file, mtime, size, page_hash = orjson.loads(file_line)
+            manifest[file] = [mtime, size, page_hash, 0, None, None]
+
+    with open(index_path(documents_file), "rb") as documents:
+        for doc_id, document_line in enumerate(documents, start=base_doc_id + 1):
+            file, _, document_checksum, fingerprint = orjson.loads(document_line)
+            manifest[file][3:] = [doc_id, document_checksum, fingerprint]
+    return manifest
+
+
+def write_manifest(manifest):
+    """
+    write the manifest next to the segment list
+    """
+    with open(index_path(manifest_file) + ".tmp", "wb") as f:
+        f.write(orjson.dumps(manifest))
+    os.replace(index_path(manifest_file) + ".tmp", index_path(manifest_file))
+
+
+def read_manifest():
+    with open(index_path(manifest_file), "rb") as f:
+        return orjson.loads(f.read())
+
+
+def parse_memory_size(size: str) -> int:
+    """
+    parse a memory size like 512M or 2G into bytes
+    """
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    size = size.strip().upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def create_inverted_index(export_json=False, workers=1, file_paths=None, resume=False):
+    """
+    build the index of the corpus (or only the given files) in the build directory, checkpointed after every
+    partial index. with resume the build continues from the checkpoint of a build that stopped. the finished
+    index is moved to a new main segment directory and published as the only segment, so a searcher never sees
+    a partial index and switches to the new one on its next search
+    """
+    global index_dir, write_checkpoints
+
+    root_dir = index_dir
+    index_dir = os.path.join(root_dir, build_staging_dir)
+    listed_files = resume_checkpoint() if resume else None
+    if listed_files is None:
+        if resume:
+            print("no checkpoint to resume from, building the index from the start")
+        shutil.rmtree(index_dir, ignore_errors=True)
+        os.makedirs(index_dir)
+    else:
+        print("resuming the build after", len(listed_files), "files and", file_count, "documents")
+    write_checkpoints = True
+
+    # iterate through the files (all files of the corpus by default) and process the tokens
+    iterateDirectory(workers, file_paths, listed_files)
 
     # merge the partial indices
     merge_partial_indices()
@@ -489,53 +1213,237 @@ def create_inverted_index():
     # write the final results to a file
     write_result_to_file()
 
-    # write the token locations to a file
-    with open("token_locations.json", "w") as f:
-        f.write(orjson.dumps(token_locs).decode())
-
-    # write the combined token locations to a file
-    with open("combined_token_locations.json", "w") as f:
+    # write the combined token locations of the binary index to a file
+    with open(index_path(postings.binary_token_locations_file), "w") as f:
         f.write(orjson.dumps(combined_token_locs).decode())
 
-    # write the file id dict to a file
-    with open("file_id.json", "w") as f:
-        f.write(orjson.dumps(file_id_dict).decode())
+    # export the binary index to the JSON-lines format
+    if export_json:
+        postings.export_json(combined_token_locs, np.frombuffer(doc_wordcounts, dtype=np.uint32),
+                             np.frombuffer(doc_field_lengths, dtype=np.uint32).reshape(-1, len(postings.fields)),
+                             scoring.field_weight_vector(), file_count, index_path(postings.binary_index_file),
+                             index_path("final_index.json"), index_path("combined_token_locations.json"))
+
+    # write the file id dict and url dict to files
+    start_time = time.perf_counter()
+    write_document_tables()
+    write_spelling_index()
+    segments.write_segment_tables(index_dir)
+    metrics.build_metrics.add("write", time.perf_counter() - start_time)
+    manifest = build_manifest()
+    write_checkpoints = False
+    remove_checkpoint()
+
+    # move the finished index to its segment directory, and publish it as the only segment once the manifest with
+    # the stats of every file for incremental builds is written
+    segment_name = segments.new_segment_name("main", root_dir)
+    os.rename(index_dir, os.path.join(root_dir, segment_name))
+    index_dir = root_dir
+    write_manifest(manifest)
+    segments.publish_segment_list({"main": segment_name, "deltas": [], "max_doc_id": base_doc_id + file_count},
+                                  index_dir)
+    print("published the index as", segment_name)
 
-    with open("url_dict.json", "w") as f:
-        f.write(orjson.dumps(url_dict).decode())   
+    write_result_to_file()
 
-    with open("small_files.json", "w") as f:
+    with open(index_path("small_files.json"), "w") as f:
         f.write(orjson.dumps(small_files).decode())   
 
-    with open("large_files.json", "w") as f:
+    with open(index_path("large_files.json"), "w") as f:
         f.write(orjson.dumps(large_files).decode())   
 
+    if metrics.build_metrics.enabled:
+        write_build_metrics()
+
+
+def shard_of(file_path, shard_count):
+    """
+    shard of a file, files keep their shard from build to build
+    """
+    return zlib.crc32(file_path.encode()) % shard_count
+
+
+def build_shard(shard_dir, file_paths, workers=1):
+    """
+    build the index of a shard's files in the shard directory, run in a process of its own
+    """
+    global index_dir
+    index_dir = shard_dir
+    os.makedirs(shard_dir)
+    with open(index_path("build.log"), "w") as log_file, contextlib.redirect_stdout(log_file):
+        create_inverted_index(workers=workers, file_paths=file_paths)
+
+
+def create_sharded_index(shard_count, workers=1):
+    """
+    split the files of the DEV folder between shard_count shards by the hash of their path and build the shards
+    in parallel, each in its own process with workers processes to tokenize and stem its files and an equal part
+    of the memory budget. then write the global stats of every shard and publish the shard list.
+    the shards are built in a new shard set directory, so the published shards keep serving until the new ones are
+    complete and a failed build leaves them in place. duplicates are only found within a shard.
+    """
+    global max_memory
+    start_time = time.time()
+    shard_files = [[] for _ in range(shard_count)]
+    for file_path in walk_directory():
+        shard_files[shard_of(file_path, shard_count)].append(file_path)
+
+    shard_set_name = shards.new_shard_set_name()
+    build_dir = shard_set_name + ".tmp"
+    shutil.rmtree(build_dir, ignore_errors=True)
+    shard_dirs = [os.path.join(build_dir, f"shard-{shard_number}") for shard_number in range(shard_count)]
+    max_memory //= shard_count
+    processes = [multiprocessing.Process(target=build_shard, args=(shard_dir, file_paths, workers))
+                 for shard_dir, file_paths in zip(shard_dirs, shard_files)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    failed_shards = [shard_dir for shard_dir, process in zip(shard_dirs, processes) if process.exitcode != 0]
+    if failed_shards:
+        raise RuntimeError("failed to build " + ", ".join(failed_shards) + ", see their build.log")
+
+    doc_count = shards.write_global_stats(shard_dirs)
+    os.rename(build_dir, shard_set_name)
+    shards.publish_shard_list([os.path.join(shard_set_name, f"shard-{shard_number}")
+                               for shard_number in range(shard_count)])
+    print("built", shard_count, "shards with", doc_count, "documents in", round(time.time() - start_time, 1), "s")
+
+
+def find_changed_files(manifest):
+    """
+    compare the DEV folder with the manifest of the last build and return the new, changed and deleted files
+    """
+    new_files = []
+    changed_files = []
+    listed_files = set()
+
+    for file_path in walk_directory():
+        listed_files.add(file_path)
+        entry = manifest.get(file_path)
+        if entry is None:
+            new_files.append(file_path)
+            continue
+
+        # only hash files whose modification time or size changed
+        file_stat = os.stat(file_path)
+        if (file_stat.st_mtime_ns, file_stat.st_size) == (entry[0], entry[1]):
+            continue
+        if file_hash(file_path) == entry[2]:
+            entry[0:2] = [file_stat.st_mtime_ns, file_stat.st_size]
+            continue
+        changed_files.append(file_path)
+
+    deleted_files = [file_path for file_path in manifest if file_path not in listed_files]
+    return new_files, changed_files, deleted_files
+
+
+def update_inverted_index(workers=1):
+    """
+    Index only the new and changed files of the DEV folder into a delta segment and mark the documents of
+    changed and deleted files as deleted. The searcher merges the delta segments with the main segment.
+    """
+    global index_dir, base_doc_id, file_count, partial_indices, doc_wordcounts, doc_field_lengths, doc_norms
+    global combined_token_locs
+    global small_files, large_files, missing_files, stem_table
+
+    manifest = read_manifest()
+    new_files, changed_files, deleted_files = find_changed_files(manifest)
+    print(len(new_files), "new,", len(changed_files), "changed and", len(deleted_files), "deleted files")
+    if not new_files and not changed_files and not deleted_files:
+        write_manifest(manifest)
+        return
+
+    # the documents of changed and deleted files are replaced or removed
+    deleted_doc_ids = sorted(manifest[file_path][3] for file_path in changed_files + deleted_files
+                             if manifest[file_path][3])
+    for file_path in changed_files + deleted_files:
+        del manifest[file_path]
+
+    # check new documents for duplicates against the documents that are still indexed
+    checksum_set.clear()
+    fingerprint_index.clear()
+    url_set.clear()
+    url_list = segments.SegmentedIndex().url_list
+    for entry in manifest.values():
+        if entry[3]:
+            checksum_set.add(entry[4])
+            fingerprint_index.add(entry[5])
+            url = url_list[entry[3]]
+            if url is not None:
+                url_set.add(extractor.canonical_url(url))
+
+    # build the delta segment in a temporary directory with doc ids after the existing ones
+    segment_list = segments.read_segment_list()
+    segment_name = segments.new_segment_name("delta")
+    index_dir = segment_name + ".tmp"
+    os.makedirs(index_dir)
+    base_doc_id = segment_list["max_doc_id"]
+    file_count = 0
+    partial_indices = []
+    doc_wordcounts = array("I", [0])
+    doc_field_lengths = array("I", [0] * len(postings.fields))
+    doc_norms = array("f", [0.0])
+    combined_token_locs = {}
+    small_files = []
+    large_files = []
+    missing_files = []
+    stem_table = {}
+
+    iterateDirectory(workers, sorted(new_files + changed_files))
+    merge_partial_indices()
+    write_result_to_file()
+    with open(index_path(postings.binary_token_locations_file), "wb") as f:
+        f.write(orjson.dumps(combined_token_locs))
+    start_time = time.perf_counter()
+    write_document_tables()
+    write_spelling_index()
+    segments.write_segment_tables(index_dir)
+    metrics.build_metrics.add("write", time.perf_counter() - start_time)
+    with open(index_path(segments.deleted_docs_file), "wb") as f:
+        f.write(orjson.dumps(deleted_doc_ids))
+    manifest = build_manifest(manifest)
+    for partial_index_file in partial_indices:
+        os.remove(partial_index_file)
+    if metrics.build_metrics.enabled:
+        write_build_metrics()
+
+    # publish the delta segment
+    os.rename(index_dir, segment_name)
+    index_dir = "."
+    segment_list["deltas"].append(segment_name)
+    segment_list["max_doc_id"] = base_doc_id + file_count
+    segments.publish_segment_list(segment_list)
+    write_manifest(manifest)
+    print("added delta segment", segment_name, "with", file_count, "documents and", len(deleted_doc_ids),
+          "deleted documents")
+
+
+def compact_index():
+    """
+    merge the main and delta segments into a new main segment
+    """
+    manifest = read_manifest()
+    file_ids = {file_path: str(entry[3]) for file_path, entry in manifest.items() if entry[3]}
+    segments.compact(".", file_ids)
+
  
 
-def process_search(query, loaded_token_loc_dict, loaded_url_dict):    
+def process_search(query, loaded_token_loc_dict, loaded_url_dict, index_file, k=5, min_match=None):    
     # start the timer in ms
     start_time = time.time_ns() // 1000000   
+    search_metrics = metrics.search_metrics
+    search_start_time = time.perf_counter()
 
-    # get the top 5 docs
-    common_docs, result_query, exact_query = process_user_query(query, loaded_token_loc_dict)
-
-    urls_list = []
+    # get the top k docs, every page has a single doc id under its canonical url (see extractor.canonical_url)
+    common_docs, result_query, exact_query = process_user_query(query, loaded_token_loc_dict, index_file, k,
+                                                                min_match)
+    with search_metrics.timer("urls"):
+        urls_list = [loaded_url_dict[common_doc] for common_doc in common_docs]
 
     if common_docs == [] or not exact_query:
         print('No results for "' + query + '"')
     if common_docs != []:
-        urls_list = []
-
-        # remove the fragments from common docs
-        while (len(urls_list) < 5 and len(common_docs) > 0):
-            # print the urls in the common docs
-            common_doc = common_docs[0]
-            doc_url = loaded_url_dict[common_doc]
-            url_without_fragment = doc_url.split("#")[0]
-            if url_without_fragment not in urls_list:
-                urls_list.append(url_without_fragment)
-            common_docs = common_docs[1:]
-
         # print the results
         print('Showing results for "' + result_query + '"')
         for num, url in enumerate(urls_list):
@@ -547,13 +1455,83 @@ def process_search(query, loaded_token_loc_dict, loaded_url_dict):
     # calculate execution time
     execution_time = end_time - start_time
     print("Search time:", execution_time, "ms")
+    search_metrics.add("search", time.perf_counter() - search_start_time)
+    search_metrics.increment("queries")
+    search_metrics.increment("results", len(urls_list))
+    if not exact_query:
+        search_metrics.increment("inexact_queries")
 
     return urls_list, result_query, exact_query
 
 
 def main():
-    # create inverted index
-    create_inverted_index()
+    global max_memory, max_fingerprint_distance, fingerprint_index, store_positions, profile_path, corpus_path
+
+    parser = argparse.ArgumentParser(description="Build the inverted index of the DEV folder.")
+    parser.add_argument("--corpus", default=corpus_path, metavar="PATH",
+                        help="folder, zip or tar archive (.tar, .tar.gz, .tgz, .tar.bz2, .tar.xz) or JSON lines bundle "
+                             "(.jsonl, .jsonl.gz, .jsonl.zst) of the pages to index (default: DEV)")
+    parser.add_argument("--export-json", action="store_true",
+                        help="also write final_index.json and combined_token_locations.json")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to tokenize and stem the files")
+    parser.add_argument("--max-memory", type=parse_memory_size, default=max_memory,
+                        help="memory budget of the build, like 512M or 2G (default: 1G)")
+    parser.add_argument("--max-fingerprint-distance", type=int, default=max_fingerprint_distance,
+                        help="pages whose fingerprints differ in at most this many of 64 bits are near duplicates "
+                             "(default: 3)")
+    parser.add_argument("--no-positions", action="store_true",
+                        help="don't store token positions, quoted phrases in queries are then ranked like other words")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only index new and changed files into a delta segment")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue a build that stopped from its last checkpoint, the files it already indexed "
+                             "are skipped")
+    parser.add_argument("--compact", action="store_true",
+                        help="merge the delta segments into the main segment")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="split the documents between this many shards built in parallel (each with --workers "
+                             "processes), searched with scatter-gather")
+    parser.add_argument("--metrics", action="store_true",
+                        help="time every stage of the build and write the timings and counters to build_metrics.json")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="profile the build with cProfile and write the stats to PATH (worker processes "
+                             "aren't profiled)")
+    args = parser.parse_args()
+    max_memory = args.max_memory
+    max_fingerprint_distance = args.max_fingerprint_distance
+    fingerprint_index = fingerprints.FingerprintIndex(max_fingerprint_distance)
+    store_positions = not args.no_positions
+    metrics.build_metrics.enabled = args.metrics
+    profile_path = args.profile
+    corpus_path = args.corpus
+
+    profiler = metrics.Profiler(profile_path) if profile_path else None
+    if args.shards > 1 and (args.compact or args.incremental or args.export_json):
+        parser.error("--shards can't be combined with --incremental, --compact or --export-json")
+    if args.resume and (args.compact or args.incremental or args.shards > 1):
+        parser.error("--resume only continues full builds, it can't be combined with --incremental, --compact or "
+                     "--shards")
+    if (args.compact or args.incremental) and shards.read_shard_list() is not None:
+        parser.error("the index is sharded, rebuild it with --shards instead of --incremental or --compact")
+    if (args.incremental or args.shards > 1) and not isinstance(corpus.open_corpus(corpus_path),
+                                                                 corpus.DirectoryCorpus):
+        parser.error("--incremental and --shards need a corpus folder, not an archive or bundle")
+
+    with profiler.profile_block() if profiler else contextlib.nullcontext():
+        if args.compact:
+            compact_index()
+        elif args.incremental:
+            update_inverted_index(workers=args.workers)
+        elif args.shards > 1:
+            create_sharded_index(args.shards, workers=args.workers)
+        else:
+            # create inverted index
+            create_inverted_index(export_json=args.export_json, workers=args.workers, resume=args.resume)
+            shards.remove_shard_list()
+    if profiler:
+        profiler.dump()
+        print("wrote the profile of the build to", profile_path)
 
     # # load the token locations file
     # with open("combined_token_locations.json", "r") as token_loc_file:
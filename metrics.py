@@ -0,0 +1,183 @@
+import io
+import time
+import pstats
+import cProfile
+import threading
+
+# stage timings and counters of the build and of the searches, nothing is collected unless they are enabled
+# (indexer.py --metrics, SEARCH_METRICS=1 for the search interface)
+
+
+class Timer:
+    """
+    Adds the time spent in a with block to a stage.
+    """
+
+    __slots__ = ("metrics", "stage", "start_time")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add(self.stage, time.perf_counter() - self.start_time)
+        return False
+
+
+class NullTimer:
+    """
+    Timer of disabled metrics, entering and leaving it does nothing.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+null_timer = NullTimer()
+
+
+class Metrics:
+    """
+    Number of calls, total and longest time of every stage and counters, in the order the stages first ran.
+    The stage timers and counters are shared by the threads of the process.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        # stage -> [calls, seconds, longest call in seconds]
+        self.stages = {}
+        self.counters = {}
+        self.start_time = time.time()
+
+    def timer(self, stage):
+        """
+        Time a with block as a stage.
+        """
+        return Timer(self, stage) if self.enabled else null_timer
+
+    def add(self, stage, seconds, calls=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            stage_times = self.stages.get(stage)
+            if stage_times is None:
+                self.stages[stage] = [calls, seconds, seconds]
+            else:
+                stage_times[0] += calls
+                stage_times[1] += seconds
+                stage_times[2] = max(stage_times[2], seconds)
+
+    def increment(self, counter, count=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + count
+
+    def take(self):
+        """
+        Return the stages and counters collected so far and start over, used to send the metrics of a worker
+        process to the process that merges them.
+        """
+        with self.lock:
+            stages, counters = self.stages, self.counters
+            self.stages, self.counters = {}, {}
+        return stages, counters
+
+    def merge(self, taken):
+        """
+        Add the stages and counters taken from another process.
+        """
+        stages, counters = taken
+        with self.lock:
+            for stage, (calls, seconds, longest) in stages.items():
+                stage_times = self.stages.setdefault(stage, [0, 0.0, 0.0])
+                stage_times[0] += calls
+                stage_times[1] += seconds
+                stage_times[2] = max(stage_times[2], longest)
+            for counter, count in counters.items():
+                self.counters[counter] = self.counters.get(counter, 0) + count
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+            self.start_time = time.time()
+
+    def summary(self) -> dict:
+        with self.lock:
+            stages = {stage: {"calls": calls, "total_ms": round(seconds * 1000, 3),
+                              "mean_ms": round(seconds * 1000 / calls, 4), "max_ms": round(longest * 1000, 3)}
+                      for stage, (calls, seconds, longest) in self.stages.items()}
+            return {"enabled": self.enabled, "seconds": round(time.time() - self.start_time, 3), "stages": stages,
+                    "counters": dict(self.counters)}
+
+
+class Profiler:
+    """
+    cProfile of the code run in profile_block() blocks, accumulated over every block. Blocks of different threads
+    run one at a time since a profile can only be active in one of them.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.profile = cProfile.Profile()
+        self.lock = threading.Lock()
+        self.runs = 0
+
+    def profile_block(self):
+        return ProfiledBlock(self)
+
+    def dump(self):
+        """
+        Write the stats to the profiler's file, they can be read with pstats or snakeviz.
+        """
+        with self.lock:
+            if self.path is not None:
+                self.profile.dump_stats(self.path)
+
+    def report(self, limit=30, sort="cumulative") -> str:
+        """
+        The functions that took the most time as text.
+        """
+        output = io.StringIO()
+        with self.lock:
+            if self.runs:
+                pstats.Stats(self.profile, stream=output).sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+class ProfiledBlock:
+    """
+    Profiles a with block with a Profiler.
+    """
+
+    __slots__ = ("profiler",)
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.profiler.lock.acquire()
+        self.profiler.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.profile.disable()
+        self.profiler.runs += 1
+        self.profiler.lock.release()
+        return False
+
+
+# metrics of the build of this process and of the searches of this process
+build_metrics = Metrics()
+search_metrics = Metrics()
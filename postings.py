@@ -0,0 +1,671 @@
+import mmap
+import math
+import struct
+import itertools
+from collections import namedtuple
+import numpy as np
+import orjson
+import tables
+
+# binary final index and its token locations
+binary_index_file = "final_index.bin"
+binary_token_locations_file = "binary_token_locations.json"
+
+# optional positions of every posting's token in the page text and their token locations, kept apart from the
+# postings so queries without phrases never read them
+positions_file = "positions.bin"
+position_locations_file = "position_locations.json"
+
+# fields with their own frequencies next to the frequency of a token in the page text
+fields = ("title", "heading", "bold", "anchor")
+
+# every postings record starts with the number of postings (the token's document frequency), the number
+# of skip blocks, the byte size of the doc id, frequency and field frequency sections, the highest tf
+# (frequency / document word count) and the highest frequency of the token, followed by:
+#   - the skip table, for every block of block_size postings: the last doc id, the doc id, frequency and
+#     field frequency section offsets, the highest frequency and the highest frequency of every field as uint32
+#     arrays, and the highest tf and highest field tf (field frequency / document word count) as float32 arrays
+#   - the doc id gaps as varints (first gap is the first doc id)
+#   - the frequencies as varints
+#   - a byte per posting with a bit for every field the token appears in
+#   - the non-zero field frequencies of every posting as varints
+# scores aren't stored, they are computed at query time from the frequencies and the document statistics
+record_header = struct.Struct("<IIIIIfI")
+
+# uint32 and float32 columns of the skip table
+skip_uint_columns = 5 + len(fields)
+skip_float_columns = 1 + len(fields)
+
+# bytes of the skip table per block
+skip_entry_size = 4 * (skip_uint_columns + skip_float_columns)
+
+# number of postings per skip block
+block_size = 128
+
+# the uint32 and float32 columns of a skip table with a single block
+single_skip_entry = struct.Struct(f"<{skip_uint_columns}I{skip_float_columns}f")
+float32_value = struct.Struct("<f")
+uint32_value = struct.Struct("<I")
+
+# every positions record starts with the number of postings, the number of blocks and the byte size of the
+# positions, followed by the byte offset of every block of block_size postings (the same blocks as the
+# postings record) as uint32 and the positions of every posting in doc id order as varint gaps (the first
+# gap of every posting is its first position)
+positions_header = struct.Struct("<III")
+
+# decode the whole postings list instead of single blocks once this share of the blocks is needed
+full_decode_ratio = 0.25
+
+# field_freqs has a row per posting and a column per field
+Postings = namedtuple("Postings", ["doc_ids", "freqs", "field_freqs"])
+
+# the header and skip table of a postings record, with the start of each section in the buffer
+# (block_max_field_freqs and block_max_field_tfs have a row per field and a column per block)
+SkipTable = namedtuple("SkipTable", ["count", "block_count", "doc_bytes", "freq_bytes", "field_bytes", "max_tf",
+                                     "max_freq", "last_doc_ids", "doc_offsets", "freq_offsets", "field_offsets",
+                                     "block_max_freqs", "block_max_field_freqs", "block_max_tfs",
+                                     "block_max_field_tfs", "doc_start", "freq_start", "mask_start", "field_start"])
+
+# bit of each field in the field masks
+field_bits = np.array([1 << field_number for field_number in range(len(fields))], dtype=np.uint8)
+
+
+def as_list(values) -> list:
+    """
+    The values of a numpy array, array.array or sequence as a python list.
+    """
+    return values.tolist() if hasattr(values, "tolist") else list(values)
+
+
+def encode_varint_list(values) -> bytes:
+    """
+    encode_varints for a few python ints, a loop over them is faster than setting up the numpy arrays.
+    """
+    encoded = bytearray()
+    for value in values:
+        while value >= 0x80:
+            encoded.append(value & 0x7f | 0x80)
+            value >>= 7
+        encoded.append(value)
+    return bytes(encoded)
+
+
+def encode_varints(values) -> bytes:
+    """
+    Encode non-negative integers as LEB128 varints (7 bits per byte, high bit set on all but the last byte).
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = varint_sizes(values)
+    if (sizes == 1).all():
+        # small gaps and frequencies are single bytes
+        return values.astype(np.uint8).tobytes()
+    ends = np.cumsum(sizes)
+    encoded = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+
+    # write the n-th byte of every varint that has at least n + 1 bytes
+    starts = ends - sizes
+    for byte_number in range(int(sizes.max()) if len(sizes) else 0):
+        has_byte = sizes > byte_number
+        shifted = values[has_byte] >> np.uint64(7 * byte_number)
+        continuation = (sizes[has_byte] > byte_number + 1).astype(np.uint8) << 7
+        encoded[starts[has_byte] + byte_number] = (shifted & np.uint64(0x7f)).astype(np.uint8) | continuation
+    return encoded.tobytes()
+
+
+def decode_varints(buffer) -> np.ndarray:
+    """
+    Decode a block of varints into a uint64 array without a python loop per value.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    # most blocks (small gaps and frequencies) only hold one byte values
+    continuation = data >= 0x80
+    if not continuation.any():
+        return data.astype(np.uint64)
+
+    # the last byte of every varint has the high bit cleared
+    ends = np.flatnonzero(~continuation)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    # shift each byte by its position inside its varint and sum them per varint
+    varint_index = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = ((np.arange(len(data)) - starts[varint_index]) * 7).astype(np.uint64)
+    values = (data & 0x7f).astype(np.uint64) << shifts
+    return np.add.reduceat(values, starts)
+
+
+def varint_sizes(values) -> np.ndarray:
+    """
+    Number of bytes of each value when encoded as a varint.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    if len(values) == 0:
+        return sizes
+    max_value = int(values.max())
+    for shift in range(7, 64, 7):
+        if max_value < (1 << shift):
+            break
+        sizes += values >= np.uint64(1 << shift)
+    return sizes
+
+
+def block_offsets(sizes, count) -> np.ndarray:
+    """
+    Byte offset of the first varint of every block.
+    """
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    return offsets[0:count:block_size]
+
+
+def round_up_float32(values) -> np.ndarray:
+    """
+    Convert maxima to float32, rounded up so they stay upper bounds.
+    """
+    return np.nextafter(values.astype("<f4"), np.float32(np.inf)).astype("<f4")
+
+
+def round_up_float32_value(value: float) -> float:
+    """
+    round_up_float32 for a single positive finite value: the next float32 after the value rounded to float32.
+    """
+    return float32_value.unpack(uint32_value.pack(uint32_value.unpack(float32_value.pack(value))[0] + 1))[0]
+
+
+def doc_order(doc_ids) -> list:
+    """
+    The stable order of a list of doc ids, None if they are already sorted.
+    """
+    if all(doc_id <= next_doc_id for doc_id, next_doc_id in zip(doc_ids, doc_ids[1:])):
+        return None
+    return sorted(range(len(doc_ids)), key=doc_ids.__getitem__)
+
+
+def encode_single_block_postings(doc_ids, freqs, field_freqs, doc_lengths) -> bytes:
+    """
+    encode_postings for a postings list with a single skip block, written with python lists. Most tokens are
+    in a few documents, and their postings are encoded several times faster than with numpy.
+    """
+    order = doc_order(doc_ids)
+    if order is not None:
+        doc_ids = [doc_ids[index] for index in order]
+        freqs = [freqs[index] for index in order]
+        field_freqs = [field_freqs[index] for index in order]
+        doc_lengths = [doc_lengths[index] for index in order]
+
+    doc_gaps = [doc_ids[0]] + [doc_id - previous_doc_id for previous_doc_id, doc_id in zip(doc_ids, doc_ids[1:])]
+    field_masks = bytearray()
+    field_values = []
+    for posting_field_freqs in field_freqs:
+        field_mask = 0
+        for field_number, field_freq in enumerate(posting_field_freqs):
+            if field_freq:
+                field_mask |= 1 << field_number
+                field_values.append(field_freq)
+        field_masks.append(field_mask)
+    doc_block = encode_varint_list(doc_gaps)
+    freq_block = encode_varint_list(freqs)
+    field_block = encode_varint_list(field_values)
+
+    # the block starts at the beginning of every section
+    field_columns = list(zip(*field_freqs))
+    max_freq = max(freqs)
+    max_tf = round_up_float32_value(max(freq / doc_length for freq, doc_length in zip(freqs, doc_lengths)))
+    skip_entry = single_skip_entry.pack(
+        doc_ids[-1], 0, 0, 0, max_freq, *[max(field_column) for field_column in field_columns], max_tf,
+        *[round_up_float32_value(max(field_freq / doc_length for field_freq, doc_length in
+                                     zip(field_column, doc_lengths)))
+          for field_column in field_columns])
+
+    header = record_header.pack(len(doc_ids), 1, len(doc_block), len(freq_block), len(field_block), max_tf, max_freq)
+    return header + skip_entry + doc_block + freq_block + bytes(field_masks) + field_block
+
+
+def encode_postings(doc_ids, freqs, field_freqs, doc_lengths) -> bytes:
+    """
+    Encode one postings list, doc ids are sorted and stored as gaps with a skip table over blocks of postings.
+    doc_lengths (the word count of each posting's document) are only used for the tf maxima of every block,
+    which bound the scores of a block.
+    """
+    # a document without words in its text makes a tf infinite, which only the numpy path rounds up
+    if 0 < len(doc_ids) <= block_size:
+        doc_lengths = as_list(doc_lengths)
+        if min(doc_lengths) > 0:
+            return encode_single_block_postings(as_list(doc_ids), as_list(freqs),
+                                                np.asarray(field_freqs).reshape(-1, len(fields)).tolist(),
+                                                doc_lengths)
+    return encode_array_postings(doc_ids, freqs, field_freqs, doc_lengths)
+
+
+def encode_array_postings(doc_ids, freqs, field_freqs, doc_lengths) -> bytes:
+    """
+    encode_postings with numpy arrays, for postings lists of any size.
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    freqs = np.asarray(freqs, dtype=np.int64)
+    field_freqs = np.asarray(field_freqs, dtype=np.int64).reshape(-1, len(fields))
+    doc_lengths = np.asarray(doc_lengths, dtype=np.float64)
+
+    # sort the postings by doc id
+    order = np.argsort(doc_ids, kind="stable")
+    doc_ids = doc_ids[order]
+    freqs = freqs[order]
+    field_freqs = field_freqs[order]
+    doc_lengths = doc_lengths[order]
+
+    doc_gaps = np.diff(doc_ids, prepend=0)
+    doc_block = encode_varints(doc_gaps)
+    freq_block = encode_varints(freqs)
+
+    # most postings have no field frequencies and only take their mask byte
+    in_fields = field_freqs > 0
+    field_masks = (in_fields.astype(np.uint8) * field_bits).sum(axis=1, dtype=np.uint8)
+    field_values = field_freqs[in_fields]
+    field_block = encode_varints(field_values)
+    field_value_sizes = np.zeros(field_freqs.shape, dtype=np.int64)
+    field_value_sizes[in_fields] = varint_sizes(field_values)
+
+    # the last doc id of every block, where each block starts in the sections and the maxima of every block
+    count = len(doc_ids)
+    last_doc_ids = doc_ids[np.minimum(np.arange(block_size, count + block_size, block_size), count) - 1]
+    block_starts = np.arange(0, count, block_size)
+    block_max_freqs = np.maximum.reduceat(freqs, block_starts)
+    block_max_field_freqs = np.maximum.reduceat(field_freqs, block_starts, axis=0).T
+    skip_columns = np.concatenate((last_doc_ids, block_offsets(varint_sizes(doc_gaps), count),
+                                   block_offsets(varint_sizes(freqs), count),
+                                   block_offsets(field_value_sizes.sum(axis=1), count), block_max_freqs,
+                                   block_max_field_freqs.ravel())).astype("<u4")
+    block_max_tfs = round_up_float32(np.maximum.reduceat(freqs / doc_lengths, block_starts))
+    block_max_field_tfs = round_up_float32(np.maximum.reduceat(field_freqs / doc_lengths[:, None], block_starts,
+                                                               axis=0).T)
+
+    header = record_header.pack(count, len(last_doc_ids), len(doc_block), len(freq_block), len(field_block),
+                                float(block_max_tfs.max()), int(block_max_freqs.max()))
+    return header + skip_columns.tobytes() + block_max_tfs.tobytes() + block_max_field_tfs.tobytes() + doc_block + \
+        freq_block + field_masks.tobytes() + field_block
+
+
+def read_skip_table(buffer, offset=0) -> SkipTable:
+    """
+    Read the header and skip table of the postings record that starts at offset.
+    """
+    count, block_count, doc_bytes, freq_bytes, field_bytes, max_tf, max_freq = \
+        record_header.unpack_from(buffer, offset)
+    skip_start = offset + record_header.size
+    float_start = skip_start + 4 * skip_uint_columns * block_count
+    uint_columns = np.frombuffer(buffer[skip_start:float_start], dtype="<u4").reshape(skip_uint_columns, block_count)
+    float_columns = np.frombuffer(buffer[float_start:float_start + 4 * skip_float_columns * block_count],
+                                  dtype="<f4").reshape(skip_float_columns, block_count)
+    doc_start = skip_start + skip_entry_size * block_count
+    freq_start = doc_start + doc_bytes
+    mask_start = freq_start + freq_bytes
+    return SkipTable(count, block_count, doc_bytes, freq_bytes, field_bytes, max_tf, max_freq, uint_columns[0],
+                     uint_columns[1].astype(np.int64), uint_columns[2].astype(np.int64),
+                     uint_columns[3].astype(np.int64), uint_columns[4], uint_columns[5:], float_columns[0],
+                     float_columns[1:], doc_start, freq_start, mask_start, mask_start + count)
+
+
+def decode_field_freqs(field_masks, field_values) -> np.ndarray:
+    """
+    Expand the field masks and the non-zero field frequencies into a row of frequencies per posting.
+    """
+    in_fields = (field_masks[:, None] & field_bits) > 0
+    field_freqs = np.zeros(in_fields.shape, dtype=np.uint32)
+    field_freqs[in_fields] = field_values
+    return field_freqs
+
+
+def decode_postings(buffer, offset=0) -> Postings:
+    """
+    Decode the postings record that starts at offset into numpy arrays.
+    """
+    skip_table = read_skip_table(buffer, offset)
+    doc_ids = np.cumsum(decode_varints(buffer[skip_table.doc_start:skip_table.freq_start])).astype(np.uint32)
+    freqs = decode_varints(buffer[skip_table.freq_start:skip_table.mask_start]).astype(np.uint32)
+    field_masks = np.frombuffer(buffer[skip_table.mask_start:skip_table.field_start], dtype=np.uint8)
+    field_values = decode_varints(buffer[skip_table.field_start:skip_table.field_start + skip_table.field_bytes])
+    return Postings(doc_ids, freqs, decode_field_freqs(field_masks, field_values))
+
+
+def concatenate_ranges(buffer, starts, ends) -> bytes:
+    """
+    Concatenate the byte ranges [starts[i], ends[i]) of a buffer.
+    """
+    return b"".join(buffer[start:end] for start, end in zip(starts.tolist(), ends.tolist()))
+
+
+def decode_blocks(buffer, skip_table, blocks) -> Postings:
+    """
+    Decode the postings of some blocks (sorted block numbers) of a record.
+    """
+    count, block_count = skip_table.count, skip_table.block_count
+    last_doc_ids, doc_offsets, freq_offsets = skip_table.last_doc_ids, skip_table.doc_offsets, skip_table.freq_offsets
+
+    # decode the gaps of the blocks, the first gap of a block continues from the last doc id of the previous block
+    next_blocks = np.minimum(blocks + 1, block_count - 1)
+    has_next = blocks + 1 < block_count
+    doc_ends = np.where(has_next, doc_offsets[next_blocks], skip_table.doc_bytes)
+    freq_ends = np.where(has_next, freq_offsets[next_blocks], skip_table.freq_bytes)
+    field_ends = np.where(has_next, skip_table.field_offsets[next_blocks], skip_table.field_bytes)
+    gaps = decode_varints(concatenate_ranges(buffer, skip_table.doc_start + doc_offsets[blocks],
+                                             skip_table.doc_start + doc_ends))
+    freqs = decode_varints(concatenate_ranges(buffer, skip_table.freq_start + freq_offsets[blocks],
+                                              skip_table.freq_start + freq_ends)).astype(np.uint32)
+
+    # postings in each block and where each block starts in the decoded arrays
+    block_counts = np.minimum((blocks + 1) * block_size, count) - blocks * block_size
+
+    mask_starts = skip_table.mask_start + blocks * block_size
+    field_masks = np.frombuffer(concatenate_ranges(buffer, mask_starts, mask_starts + block_counts), dtype=np.uint8)
+    field_values = decode_varints(concatenate_ranges(buffer, skip_table.field_start + skip_table.field_offsets[blocks],
+                                                     skip_table.field_start + field_ends))
+    block_starts = np.concatenate(([0], np.cumsum(block_counts)[:-1])).astype(np.int64)
+    previous_last_doc_ids = np.where(blocks > 0, last_doc_ids[np.maximum(blocks - 1, 0)], 0).astype(np.uint64)
+    gaps[block_starts] += previous_last_doc_ids
+
+    # cumulative sum restarted at every block
+    running_sum = np.cumsum(gaps)
+    doc_ids = (running_sum - np.repeat(running_sum[block_starts] - gaps[block_starts], block_counts)).astype(np.uint32)
+    return Postings(doc_ids, freqs, decode_field_freqs(field_masks, field_values))
+
+
+def lookup_postings(buffer, offset, doc_ids):
+    """
+    Find sorted doc ids in the postings record that starts at offset, only decoding the blocks that can
+    contain them. Returns a mask of the doc ids that were found and their frequencies and field frequencies.
+    """
+    skip_table = read_skip_table(buffer, offset)
+
+    # the block that could contain each doc id is the first one whose last doc id isn't smaller
+    doc_blocks = np.searchsorted(skip_table.last_doc_ids, doc_ids)
+    blocks = np.unique(doc_blocks[doc_blocks < skip_table.block_count])
+
+    if len(blocks) == 0:
+        found = np.zeros(len(doc_ids), dtype=bool)
+        return found, np.zeros(0, dtype=np.uint32), np.zeros((0, len(fields)), dtype=np.uint32)
+
+    if len(blocks) > full_decode_ratio * skip_table.block_count:
+        # most blocks are needed, decoding everything at once is cheaper
+        block_doc_ids, block_freqs, block_field_freqs = decode_postings(buffer, offset)
+    else:
+        block_doc_ids, block_freqs, block_field_freqs = decode_blocks(buffer, skip_table, blocks)
+
+    # match the doc ids against the decoded postings
+    positions = np.searchsorted(block_doc_ids, doc_ids)
+    positions_in_range = np.minimum(positions, len(block_doc_ids) - 1)
+    found = block_doc_ids[positions_in_range] == doc_ids
+    return found, block_freqs[positions_in_range[found]], block_field_freqs[positions_in_range[found]]
+
+
+def intersect_postings(buffer, offsets):
+    """
+    Document-at-a-time intersection of the postings records at offsets. Starts from the rarest token and only
+    looks up the remaining candidates in the longer lists through their skip tables.
+    Returns the common doc ids and, for every token in the order of offsets, their frequencies and field
+    frequencies.
+    """
+    counts = [record_header.unpack_from(buffer, offset)[0] for offset in offsets]
+    order = sorted(range(len(offsets)), key=lambda token_number: counts[token_number])
+
+    rarest = decode_postings(buffer, offsets[order[0]])
+    doc_ids = rarest.doc_ids
+    freqs = {order[0]: rarest.freqs}
+    field_freqs = {order[0]: rarest.field_freqs}
+
+    for token_number in order[1:]:
+        found, token_freqs, token_field_freqs = lookup_postings(buffer, offsets[token_number], doc_ids)
+        # drop the candidates that aren't in this postings list
+        doc_ids = doc_ids[found]
+        for previous_token in freqs:
+            freqs[previous_token] = freqs[previous_token][found]
+            field_freqs[previous_token] = field_freqs[previous_token][found]
+        freqs[token_number] = token_freqs
+        field_freqs[token_number] = token_field_freqs
+
+    return doc_ids, [freqs[token_number] for token_number in range(len(offsets))], \
+        [field_freqs[token_number] for token_number in range(len(offsets))]
+
+
+def encode_single_block_positions(doc_ids, freqs, positions) -> bytes:
+    """
+    encode_positions for the positions of a postings list with a single block, written with python lists.
+    """
+    starts = list(itertools.accumulate(freqs, initial=0))
+    order = doc_order(doc_ids)
+    gaps = []
+    for index in (range(len(doc_ids)) if order is None else order):
+        previous_position = 0
+        for position in positions[starts[index]:starts[index + 1]]:
+            gaps.append(position - previous_position)
+            previous_position = position
+    data = encode_varint_list(gaps)
+    return positions_header.pack(len(doc_ids), 1, len(data)) + uint32_value.pack(0) + data
+
+
+def encode_positions(doc_ids, freqs, positions) -> bytes:
+    """
+    Encode the positions of one postings list, positions holds the freqs[i] positions of every posting i
+    in the order of doc_ids.
+    """
+    if 0 < len(doc_ids) <= block_size:
+        return encode_single_block_positions(as_list(doc_ids), as_list(freqs), as_list(positions))
+    return encode_array_positions(doc_ids, freqs, positions)
+
+
+def encode_array_positions(doc_ids, freqs, positions) -> bytes:
+    """
+    encode_positions with numpy arrays, for postings lists of any size.
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    freqs = np.asarray(freqs, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(freqs)[:-1])).astype(np.int64)
+
+    # put the positions in the same doc id order as the postings
+    order = np.argsort(doc_ids, kind="stable")
+    if (np.diff(order) != 1).any():
+        positions = np.concatenate([positions[starts[i]:starts[i] + freqs[i]] for i in order.tolist()])
+        freqs = freqs[order]
+        starts = np.concatenate(([0], np.cumsum(freqs)[:-1])).astype(np.int64)
+
+    # gaps restart at every posting
+    gaps = np.diff(positions, prepend=0)
+    gaps[starts[freqs > 0]] = positions[starts[freqs > 0]]
+    cumulative_sizes = np.concatenate(([0], np.cumsum(varint_sizes(gaps))))
+    posting_sizes = cumulative_sizes[starts + freqs] - cumulative_sizes[starts]
+    offsets = block_offsets(posting_sizes, len(freqs)).astype("<u4")
+    data = encode_varints(gaps)
+    return positions_header.pack(len(freqs), len(offsets), len(data)) + offsets.tobytes() + data
+
+
+def decode_position_ranges(values, freqs) -> np.ndarray:
+    """
+    Turn the position gaps of consecutive postings with freqs positions each into positions.
+    """
+    starts = np.concatenate(([0], np.cumsum(freqs)[:-1])).astype(np.int64)[freqs > 0]
+    running_sum = np.cumsum(values)
+    return (running_sum - np.repeat(running_sum[starts] - values[starts], freqs[freqs > 0])).astype(np.uint32)
+
+
+def decode_positions(buffer, offset, freqs) -> np.ndarray:
+    """
+    Decode all the positions of the positions record that starts at offset, freqs are the frequencies of
+    its postings.
+    """
+    count, block_count, data_bytes = positions_header.unpack_from(buffer, offset)
+    data_start = offset + positions_header.size + 4 * block_count
+    values = decode_varints(buffer[data_start:data_start + data_bytes])
+    return decode_position_ranges(values, np.asarray(freqs, dtype=np.int64))
+
+
+def lookup_positions(postings_buffer, postings_offset, positions_buffer, positions_offset, doc_ids):
+    """
+    Find the positions of sorted doc ids that are in a token's postings, only decoding the postings and
+    positions of the blocks that can contain them. Returns a list with the positions of every doc id.
+    """
+    skip_table = read_skip_table(postings_buffer, postings_offset)
+    doc_blocks = np.searchsorted(skip_table.last_doc_ids, doc_ids)
+    blocks = np.unique(doc_blocks[doc_blocks < skip_table.block_count])
+    if len(blocks) == 0:
+        return [np.zeros(0, dtype=np.uint32) for _ in doc_ids]
+    block_postings = decode_blocks(postings_buffer, skip_table, blocks)
+
+    # decode the positions of the same blocks
+    count, block_count, data_bytes = positions_header.unpack_from(positions_buffer, positions_offset)
+    offsets = np.frombuffer(positions_buffer[positions_offset + positions_header.size:
+                                             positions_offset + positions_header.size + 4 * block_count],
+                            dtype="<u4").astype(np.int64)
+    data_start = positions_offset + positions_header.size + 4 * block_count
+    ends = np.where(blocks + 1 < block_count, offsets[np.minimum(blocks + 1, block_count - 1)], data_bytes)
+    values = decode_varints(concatenate_ranges(positions_buffer, data_start + offsets[blocks], data_start + ends))
+    freqs = block_postings.freqs.astype(np.int64)
+    positions = decode_position_ranges(values, freqs)
+    position_starts = np.concatenate(([0], np.cumsum(freqs)))
+
+    # match the doc ids against the decoded postings
+    indices = np.searchsorted(block_postings.doc_ids, doc_ids)
+    doc_positions = []
+    for doc_id, index in zip(doc_ids.tolist(), indices.tolist()):
+        if index < len(block_postings.doc_ids) and block_postings.doc_ids[index] == doc_id:
+            doc_positions.append(positions[position_starts[index]:position_starts[index + 1]])
+        else:
+            doc_positions.append(np.zeros(0, dtype=np.uint32))
+    return doc_positions
+
+
+class PostingsWriter:
+    """
+    Append postings records to a binary index and remember where each token starts.
+    """
+
+    def __init__(self, path=binary_index_file):
+        self.index_file = open(path, "wb")
+        self.token_locs = {}
+
+    def write(self, token, doc_ids, freqs, field_freqs, doc_lengths):
+        self.token_locs[token] = self.index_file.tell()
+        self.index_file.write(encode_postings(doc_ids, freqs, field_freqs, doc_lengths))
+
+    def close(self):
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PositionsWriter:
+    """
+    Append positions records to a positions file and remember where each token starts.
+    """
+
+    def __init__(self, path=positions_file):
+        self.positions_file = open(path, "wb")
+        self.token_locs = {}
+
+    def write(self, token, doc_ids, freqs, positions):
+        self.token_locs[token] = self.positions_file.tell()
+        self.positions_file.write(encode_positions(doc_ids, freqs, positions))
+
+    def close(self):
+        self.positions_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PostingsReader:
+    """
+    Memory-mapped reader for the binary index, the index of a segment without documents is empty.
+    """
+
+    def __init__(self, path=binary_index_file):
+        self.index_map = tables.map_file(path)
+
+    def read(self, token_loc) -> Postings:
+        return decode_postings(self.index_map, token_loc)
+
+    def count(self, token_loc) -> int:
+        """
+        Number of postings of a token, read from the record header only.
+        """
+        return record_header.unpack_from(self.index_map, token_loc)[0]
+
+    def skip_table(self, token_loc) -> SkipTable:
+        return read_skip_table(self.index_map, token_loc)
+
+    def read_blocks(self, skip_table, blocks) -> Postings:
+        return decode_blocks(self.index_map, skip_table, blocks)
+
+    def lookup(self, token_loc, doc_ids):
+        return lookup_postings(self.index_map, token_loc, doc_ids)
+
+    def intersect(self, token_locs):
+        return intersect_postings(self.index_map, token_locs)
+
+    def close(self):
+        if isinstance(self.index_map, mmap.mmap):
+            self.index_map.close()
+
+
+class PositionsReader:
+    """
+    Memory-mapped reader for a positions file, it is opened on the first phrase query.
+    token_locs maps every token to the location of its positions record.
+    """
+
+    def __init__(self, path=positions_file, token_locs=None):
+        if token_locs is None:
+            with open(position_locations_file, "rb") as f:
+                token_locs = orjson.loads(f.read())
+        self.token_locs = token_locs
+        self.positions_map = tables.map_file(path)
+
+    def read(self, token, freqs) -> np.ndarray:
+        return decode_positions(self.positions_map, self.token_locs[token], freqs)
+
+    def lookup(self, token, postings_reader, token_loc, doc_ids):
+        return lookup_positions(postings_reader.index_map, token_loc, self.positions_map, self.token_locs[token],
+                                doc_ids)
+
+    def close(self):
+        if isinstance(self.positions_map, mmap.mmap):
+            self.positions_map.close()
+
+
+def export_json(token_locs, doc_wordcounts, doc_field_lengths, field_weights, doc_count,
+                index_path=binary_index_file, json_path="final_index.json",
+                json_locations_path="combined_token_locations.json"):
+    """
+    Export the binary index to the JSON-lines format ({token: [[doc_id, freq, tf_idf], ...]} per line).
+    doc_wordcounts and doc_field_lengths hold the word count and the field word counts of every doc id, the
+    frequencies and word counts are exported with the fields weighted by field_weights (in the order of fields)
+    and the tf-idf scores are computed from them and doc_count.
+    """
+    doc_lengths = doc_wordcounts + doc_field_lengths @ field_weights
+    reader = PostingsReader(index_path)
+    combined_token_locs = {}
+    with open(json_path, "wb") as json_index_file:
+        for token, token_loc in token_locs.items():
+            postings = reader.read(token_loc)
+            freqs = postings.freqs + postings.field_freqs @ field_weights
+            scores = freqs / doc_lengths[postings.doc_ids] * math.log(doc_count / len(postings.doc_ids))
+            token_postings = [[str(doc_id), round(float(freq), 5), round(float(score), 5)]
+                              for doc_id, freq, score in zip(postings.doc_ids, freqs, scores)]
+            combined_token_locs[token] = json_index_file.tell()
+            json_index_file.write(orjson.dumps({token: token_postings}))
+            json_index_file.write(b"\n")
+    reader.close()
+
+    with open(json_locations_path, "wb") as f:
+        f.write(orjson.dumps(combined_token_locs))
+    return combined_token_locs
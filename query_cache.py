@@ -0,0 +1,117 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+import orjson
+
+
+class QueryCache:
+    """
+    Cache of search results keyed on the stemmed query and the number of results.
+    Entries live in an in-process LRU dict and, if shared_path is given, in a sqlite file shared by every
+    worker process of a deployment. Every entry is stored with the version of the index it was computed on
+    and is ignored once another index version is searched, so a rebuilt index never serves stale results.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=300, shared_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared_path = shared_path
+        # key -> (time stored, value) of the current index version, least recently used first
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connection_pid = None
+        self.counters = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                         "invalidations": 0}
+
+    def get_connection(self):
+        """
+        Open the shared sqlite cache, once per process since connections can't be shared across a fork.
+        """
+        if self.connection is None or self.connection_pid != os.getpid():
+            self.connection = sqlite3.connect(self.shared_path, timeout=5, check_same_thread=False,
+                                              isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results "
+                                    "(key TEXT PRIMARY KEY, version TEXT, stored REAL, value BLOB)")
+            self.connection_pid = os.getpid()
+        return self.connection
+
+    def set_version(self, version):
+        """
+        Drop the entries of other index versions, called with the lock held.
+        """
+        if version == self.version:
+            return
+        if self.entries:
+            self.counters["invalidations"] += len(self.entries)
+            self.entries.clear()
+        if self.shared_path is not None:
+            self.get_connection().execute("DELETE FROM results WHERE version != ?", (version,))
+        self.version = version
+
+    def get(self, key, version):
+        """
+        Return the cached value of the key for this index version, or None.
+        """
+        now = time.time()
+        with self.lock:
+            self.set_version(version)
+            entry = self.entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl_seconds:
+                    self.entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return entry[1]
+                del self.entries[key]
+                self.counters["expirations"] += 1
+
+            if self.shared_path is not None:
+                row = self.get_connection().execute(
+                    "SELECT stored, value FROM results WHERE key = ? AND version = ? AND stored >= ?",
+                    (key, version, now - self.ttl_seconds)).fetchone()
+                if row is not None:
+                    value = orjson.loads(row[1])
+                    self.store(key, row[0], value)
+                    self.counters["shared_hits"] += 1
+                    return value
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, version, value):
+        """
+        Cache the value of the key for this index version.
+        """
+        now = time.time()
+        with self.lock:
+            self.set_version(version)
+            self.store(key, now, value)
+            if self.shared_path is not None:
+                self.get_connection().execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                              (key, version, now, orjson.dumps(value)))
+
+    def store(self, key, stored, value):
+        """
+        Put an entry in the in-process cache and evict the least recently used ones, called with the lock held.
+        """
+        self.entries[key] = (stored, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.shared_path is not None:
+                self.get_connection().execute("DELETE FROM results")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["shared_hits"] + self.counters["misses"]
+            return dict(self.counters, entries=len(self.entries),
+                        hit_rate=(lookups - self.counters["misses"]) / lookups if lookups else 0.0)
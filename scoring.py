@@ -0,0 +1,181 @@
+import math
+import numpy as np
+import postings
+
+# BM25 parameters
+bm25_k1 = 1.2
+bm25_b = 0.75
+
+# weight of a token's frequency in each field added to its frequency in the page text, the defaults give the
+# frequencies of the extra token copies the index used to store for bold, heading and anchor words.
+# weights can't be negative since the block bounds of top-k retrieval assume frequencies only grow with them
+default_field_weights = {"title": 0.0, "heading": 2.0, "bold": 3.0, "anchor": 2.0}
+
+
+# score multipliers of the top candidates of a query with quoted phrases: a document with the exact phrase
+# gets phrase_boost more, a document with the words of a proximity phrase ("words"~window) within a window of
+# that many words gets up to proximity_boost more, the closer the words the larger the boost
+phrase_boost = 1.0
+proximity_boost = 0.5
+
+
+def field_weight_vector(field_weights=None) -> np.ndarray:
+    """
+    Weights in the order of postings.fields, fields that aren't given keep their default weight.
+    """
+    field_weights = dict(default_field_weights, **(field_weights or {}))
+    unknown_fields = set(field_weights) - set(postings.fields)
+    if unknown_fields:
+        raise ValueError(f"unknown fields {', '.join(sorted(unknown_fields))}, expected {', '.join(postings.fields)}")
+    weights = np.array([field_weights[field] for field in postings.fields], dtype=np.float64)
+    if (weights < 0).any():
+        raise ValueError("field weights can't be negative")
+    return weights
+
+
+def document_norm(freqs) -> float:
+    """
+    Length of a document's log-weighted term frequency vector, used by cosine scoring.
+    """
+    weights = 1 + np.log(np.fromiter(freqs, dtype=np.float64))
+    return float(np.sqrt(np.dot(weights, weights)))
+
+
+def contains_phrase(token_positions) -> bool:
+    """
+    Check if the tokens appear one after the other, token_positions holds the positions of every token
+    of the phrase in order.
+    """
+    # positions lists of a document are short, sets are faster than numpy here
+    starts = set(token_positions[0].tolist())
+    for offset, positions in enumerate(token_positions[1:], 1):
+        starts.intersection_update(position - offset for position in positions.tolist())
+    return len(starts) > 0
+
+
+def shortest_window(token_positions) -> int:
+    """
+    Number of words of the shortest window that contains every token, 0 if a token is missing.
+    """
+    if any(len(positions) == 0 for positions in token_positions):
+        return 0
+    positions = np.concatenate(token_positions).tolist()
+    token_numbers = np.repeat(np.arange(len(token_positions)), [len(p) for p in token_positions]).tolist()
+    occurrences = sorted(zip(positions, token_numbers))
+
+    # slide the window start forward while the window still holds every token
+    counts = [0] * len(token_positions)
+    missing = len(token_positions)
+    shortest = 0
+    first = 0
+    for position, token_number in occurrences:
+        if counts[token_number] == 0:
+            missing -= 1
+        counts[token_number] += 1
+        while not missing:
+            first_position, first_token = occurrences[first]
+            window = position - first_position + 1
+            if not shortest or window < shortest:
+                shortest = window
+            counts[first_token] -= 1
+            if counts[first_token] == 0:
+                missing += 1
+            first += 1
+    return shortest
+
+
+def phrase_factor(token_positions, phrases) -> float:
+    """
+    Score multiplier of a document for the quoted phrases of a query. token_positions holds the positions of
+    every query token in the document and every phrase is (token numbers, window), the window is None for
+    an exact phrase.
+    """
+    factor = 1.0
+    for token_numbers, window in phrases:
+        phrase_positions = [token_positions[token_number] for token_number in token_numbers]
+        if window is None:
+            if contains_phrase(phrase_positions):
+                factor *= 1 + phrase_boost
+        else:
+            distinct_positions = [token_positions[token_number] for token_number in dict.fromkeys(token_numbers)]
+            shortest = shortest_window(distinct_positions)
+            if shortest and shortest <= window:
+                factor *= 1 + proximity_boost * len(distinct_positions) / shortest
+    return factor
+
+
+class TfIdfScorer:
+    """
+    Sum of tf (frequency / document word count) times idf (log of live documents over document frequency).
+    """
+
+    name = "tfidf"
+
+    def query_weights(self, doc_freqs, stats):
+        return [math.log(stats.live_doc_count / doc_freq) if doc_freq else 0.0 for doc_freq in doc_freqs]
+
+    def score(self, freqs, doc_ids, weight, stats):
+        return freqs / stats.doc_wordcounts[doc_ids] * weight
+
+    def block_bounds(self, block_max_freqs, block_max_tfs, weight, stats):
+        return block_max_tfs.astype(np.float64) * weight
+
+
+class BM25Scorer:
+    """
+    Okapi BM25 with the document word counts as document lengths.
+    """
+
+    name = "bm25"
+
+    def __init__(self, k1=bm25_k1, b=bm25_b):
+        self.k1 = k1
+        self.b = b
+
+    def query_weights(self, doc_freqs, stats):
+        return [math.log(1 + (stats.live_doc_count - doc_freq + 0.5) / (doc_freq + 0.5)) if doc_freq else 0.0
+                for doc_freq in doc_freqs]
+
+    def score(self, freqs, doc_ids, weight, stats):
+        length_norms = self.k1 * (1 - self.b + self.b * stats.doc_wordcounts[doc_ids] / stats.avg_doc_length)
+        return weight * freqs * (self.k1 + 1) / (freqs + length_norms)
+
+    def block_bounds(self, block_max_freqs, block_max_tfs, weight, stats):
+        # a document with frequency f has at least f / max tf words, the score grows with f for that length
+        max_freqs = block_max_freqs.astype(np.float64)
+        min_lengths = max_freqs / block_max_tfs.astype(np.float64)
+        length_norms = self.k1 * (1 - self.b + self.b * min_lengths / stats.avg_doc_length)
+        return weight * max_freqs * (self.k1 + 1) / (max_freqs + length_norms)
+
+
+class CosineScorer:
+    """
+    Cosine similarity of log-weighted document vectors and idf-weighted query vectors (lnc.ltc).
+    """
+
+    name = "cosine"
+
+    def query_weights(self, doc_freqs, stats):
+        idfs = [math.log(stats.live_doc_count / doc_freq) if doc_freq else 0.0 for doc_freq in doc_freqs]
+        query_norm = math.sqrt(sum(idf * idf for idf in idfs))
+        return [idf / query_norm if query_norm else 0.0 for idf in idfs]
+
+    def score(self, freqs, doc_ids, weight, stats):
+        # the norms are computed with the default field weights, with other weights a token's document weight
+        # is capped at 1 like it is with the default ones
+        doc_weights = 1 + np.log(freqs)
+        return doc_weights / np.maximum(stats.doc_norms[doc_ids], doc_weights) * weight
+
+    def block_bounds(self, block_max_freqs, block_max_tfs, weight, stats):
+        # a token's document weight is at most 1
+        return np.full(len(block_max_freqs), weight, dtype=np.float64)
+
+
+scorers = {scorer.name: scorer for scorer in (TfIdfScorer, BM25Scorer, CosineScorer)}
+
+
+def get_scorer(name="tfidf"):
+    try:
+        return scorers[name]()
+    except KeyError:
+        raise ValueError(f"unknown scorer {name!r}, expected one of {', '.join(scorers)}") from None
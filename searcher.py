@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import resource
+import threading
+import indexer
+import postings
+import segments
+import shards
+import stemming
+import metrics
+from query_cache import QueryCache
+
+def get_rss_bytes():
+    """
+    Return the resident memory of the current process in bytes.
+    """
+    try:
+        with open("/proc/self/statm", "r") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # fall back to the peak rss (reported in kB on linux, bytes on macos)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+class IndexNotBuiltError(FileNotFoundError):
+    """
+    Raised when the index directory has neither a segment list nor a shard list.
+    """
+
+
+class Searcher:
+    """
+    Long-lived searcher that opens the segments once, their lexicons, url tables and postings stay memory-mapped.
+    The index is the main segment plus the delta segments of incremental builds, or the shards of a sharded build.
+    Results are cached per stemmed query (cache_size 0 disables the cache), cache_path is a sqlite file
+    that shares the cache between the worker processes of a deployment. scorer is the ranking function
+    (tfidf, bm25 or cosine) and field_weights the weights of the title, heading, bold and anchor frequencies
+    ({field: weight}, fields that aren't given keep their default weight). With min_match (a share of the query
+    words like 0.5) results only have to include that many of the query words instead of all of them.
+    With collect_metrics the time of every search stage is added to metrics.search_metrics, and with profile_path
+    every search is profiled with cProfile (searches then run one at a time) and the stats are written to that file
+    by profile_report.
+    """
+
+    def __init__(self, index_dir=".", cache_size=1024, cache_ttl=300, cache_path=None, scorer="tfidf",
+                 field_weights=None, min_match=None, collect_metrics=False, profile_path=None):
+        self.index_dir = index_dir
+        self.scorer = scorer
+        self.field_weights = field_weights
+        self.min_match = min_match
+        self.cache = QueryCache(cache_size, cache_ttl, cache_path) if cache_size > 0 else None
+        self.profiler = metrics.Profiler(profile_path) if profile_path else None
+        if collect_metrics:
+            metrics.search_metrics.enabled = True
+        self.index = None
+        self.index_signature = None
+        self.load_time_ms = 0
+        self.rss_bytes = 0
+        self.reload_count = 0
+        self.lock = threading.Lock()
+        self.load()
+
+    def get_index_signature(self):
+        """
+        Identify the published index by the modification time and size of its shard list or segment list,
+        which is replaced last whenever a full or sharded build, delta segment or compaction is published.
+        Raises IndexNotBuiltError if neither exists.
+        """
+        for list_file in (shards.shards_file, segments.segments_file):
+            try:
+                stat = os.stat(os.path.join(self.index_dir, list_file))
+                return (list_file, stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                pass
+        raise IndexNotBuiltError("no index in " + os.path.abspath(self.index_dir) +
+                                 ", build it with python indexer.py first")
+
+    def load(self):
+        """
+        Load the segments of the index.
+        """
+        start_time = time.time_ns()
+        signature = self.get_index_signature()
+        if signature[0] == shards.shards_file:
+            index = shards.ShardedIndex(self.index_dir, self.scorer, self.field_weights)
+        else:
+            index = segments.SegmentedIndex(self.index_dir, self.scorer, self.field_weights)
+        stemming.load_stem_tables([segment.path for segment in index.segments])
+
+        # swap in the new index only once everything is loaded, the old postings maps are
+        # released when the last in-flight query holding them finishes
+        with self.lock:
+            if self.index is not None:
+                self.reload_count += 1
+            self.index = index
+            self.index_signature = signature
+
+        self.load_time_ms = (time.time_ns() - start_time) // 1000000
+        self.rss_bytes = get_rss_bytes()
+        print("loaded index in", self.load_time_ms, "ms, rss:", self.rss_bytes // (1024 * 1024), "MB")
+
+    def reload_if_changed(self):
+        """
+        Reload the index if a new one was published since the last load.
+        """
+        try:
+            signature = self.get_index_signature()
+        except FileNotFoundError:
+            # an index is being written, keep serving the current one
+            return False
+        if signature == self.index_signature:
+            return False
+        self.load()
+        return True
+
+    def search(self, query, k=5):
+        """
+        Search the loaded index and return the top k urls, the query that was used and if it was an exact match.
+        """
+        if self.profiler is None:
+            return self.run_search(query, k)
+        with self.profiler.profile_block():
+            return self.run_search(query, k)
+
+    def run_search(self, query, k):
+        self.reload_if_changed()
+        with self.lock:
+            index = self.index
+            signature = self.index_signature
+        if self.cache is None:
+            return indexer.process_search(query, index.lexicon, index.url_list, index, k, self.min_match)
+
+        # queries with the same stems, phrases and prefixes share their urls, the shown query is rebuilt from the
+        # words of this one
+        search_tokens, query_tokens = indexer.parse_query(query)
+        prefixes = indexer.parse_prefixes(query)
+        cache_key = str(k) + ":" + " ".join(query_tokens)
+        for phrase_tokens, window in indexer.parse_phrases(query):
+            cache_key += ' "' + " ".join(phrase_tokens) + '"' + (f"~{window}" if window is not None else "")
+        for prefix in prefixes:
+            cache_key += " " + prefix + "*"
+        cache_version = str(signature[1]) + "-" + str(signature[2]) + "-" + self.scorer + "-" + \
+            ",".join(str(weight) for weight in index.field_weights.tolist()) + "-" + str(self.min_match)
+        url_results = self.cache.get(cache_key, cache_version)
+        if url_results is not None:
+            metrics.search_metrics.increment("cache_hits")
+            accepted_query_tokens, result_query, exact_query = indexer.match_query_tokens(search_tokens, query_tokens,
+                                                                                         index.lexicon,
+                                                                                         index.correct_spelling)
+            if prefixes:
+                accepted_query_tokens, _, result_query, exact_query = indexer.expand_prefixes(
+                    prefixes, accepted_query_tokens, result_query, exact_query, index.lexicon)
+            if not accepted_query_tokens:
+                result_query, exact_query = "", False
+            return url_results, result_query, exact_query
+
+        url_results, result_query, exact_query = indexer.process_search(query, index.lexicon, index.url_list, index, k,
+                                                                        self.min_match)
+        self.cache.put(cache_key, cache_version, url_results)
+        return url_results, result_query, exact_query
+
+    def stats(self):
+        return {
+            "load_time_ms": self.load_time_ms,
+            "rss_bytes": self.rss_bytes,
+            "tokens": len(self.index.lexicon),
+            "documents": self.index.live_doc_count,
+            "segments": len(self.index.segments),
+            "scorer": self.scorer,
+            "min_match": self.min_match,
+            "field_weights": dict(zip(postings.fields, self.index.field_weights.tolist())),
+            "reloads": self.reload_count,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+    def metrics_summary(self):
+        """
+        Stage timings and counters of the searches of this process.
+        """
+        return dict(metrics.search_metrics.summary(), pid=os.getpid())
+
+    def profile_report(self, limit=30):
+        """
+        Write the profile of the searches so far to the profile file and return the slowest functions as text.
+        """
+        if self.profiler is None:
+            return None
+        self.profiler.dump()
+        return self.profiler.report(limit)
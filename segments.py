@@ -0,0 +1,928 @@
+import os
+import heapq
+import bisect
+import shutil
+import orjson
+import numpy as np
+import postings
+import stemming
+import scoring
+import spelling
+import metrics
+import tables
+
+# list of the live segments of an index: {"main": dir, "deltas": [dir, ...], "max_doc_id": n}
+# the directories are relative to the index directory
+segments_file = "segments.json"
+
+# the main segments of full builds and compactions and the delta segments are created in this directory, every
+# build in a new directory that is only published once it's complete. directories ending in .tmp are being built
+segments_dir = "segments"
+
+# per segment files: doc id range and count, word count, field word counts (a row per doc id and a column
+# per field of postings.fields) and cosine norm of each doc id and doc ids deleted from older segments
+segment_meta_file = "segment.json"
+doc_wordcounts_file = "doc_wordcounts.bin"
+doc_field_lengths_file = "doc_field_lengths.bin"
+doc_norms_file = "doc_norms.bin"
+deleted_docs_file = "deleted.json"
+
+# global stats sidecar of a shard of a sharded index (see shards.py): the live document count and summed word and
+# field word counts of the whole index, and the document frequency in the whole index of every token of the shard
+# as (postings location in the shard, document frequency) entries sorted by location
+global_stats_file = "global_stats.json"
+global_doc_freqs_file = "global_doc_freqs.bin"
+global_doc_freq_entry = np.dtype([("loc", "<u8"), ("doc_freq", "<u8")])
+
+
+def read_segment_list(index_dir="."):
+    """
+    Read the live segments of an index, an index without a segment list only has its main segment.
+    """
+    try:
+        with open(os.path.join(index_dir, segments_file), "rb") as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return {"main": ".", "deltas": [], "max_doc_id": 0}
+
+
+def write_segment_list(segment_list, index_dir="."):
+    """
+    Publish a new list of live segments. The file is replaced atomically so a searcher
+    either sees the old or the new segments.
+    """
+    path = os.path.join(index_dir, segments_file)
+    with open(path + ".tmp", "wb") as f:
+        f.write(orjson.dumps(segment_list))
+    os.replace(path + ".tmp", path)
+
+
+def publish_segment_list(segment_list, index_dir="."):
+    """
+    Publish a new list of live segments and remove the segments that are in neither the new nor the previous list.
+    The previous segments are kept until the next publish for the searches that started before this one, a searcher
+    loads the new segments on its next search.
+    """
+    previous_list = read_segment_list(index_dir)
+    write_segment_list(segment_list, index_dir)
+    kept_dirs = {os.path.normpath(segment_dir) for segment_dir in [segment_list["main"], previous_list["main"]] +
+                 segment_list["deltas"] + previous_list["deltas"]}
+    try:
+        names = os.listdir(os.path.join(index_dir, segments_dir))
+    except FileNotFoundError:
+        return
+    for name in names:
+        segment_dir = os.path.join(segments_dir, name)
+        if segment_dir not in kept_dirs and not name.endswith(".tmp"):
+            shutil.rmtree(os.path.join(index_dir, segment_dir), ignore_errors=True)
+
+
+def new_segment_name(prefix, index_dir="."):
+    """
+    Return the next free segment directory name like segments/delta-3.
+    """
+    os.makedirs(os.path.join(index_dir, segments_dir), exist_ok=True)
+    numbers = [int(name.rsplit("-", 1)[1]) for name in os.listdir(os.path.join(index_dir, segments_dir))
+               if name.startswith(prefix + "-") and name.rsplit("-", 1)[1].isdigit()]
+    return os.path.join(segments_dir, f"{prefix}-{max(numbers, default=0) + 1}")
+
+
+def write_segment_tables(path):
+    """
+    Write the memory-mapped tables of a segment (see tables.py) from its lexicon, urls, positions and stem table.
+    The front-coded lexicon is written last, a segment only reads the other tables once it exists.
+    """
+    with open(os.path.join(path, postings.binary_token_locations_file), "rb") as f:
+        token_locs = orjson.loads(f.read())
+    tokens = sorted(token_locs)
+    tables.write_uint_table(os.path.join(path, tables.token_locations_file), [token_locs[token] for token in tokens])
+    postings_reader = postings.PostingsReader(os.path.join(path, postings.binary_index_file))
+    tables.write_uint_table(os.path.join(path, tables.token_doc_freqs_file),
+                            [postings_reader.count(token_locs[token]) for token in tokens])
+    postings_reader.close()
+
+    # the positions record of every token of the lexicon in the same order
+    try:
+        with open(os.path.join(path, postings.position_locations_file), "rb") as f:
+            position_locs = orjson.loads(f.read())
+        tables.write_uint_table(os.path.join(path, tables.position_locations_file),
+                                [position_locs[token] for token in tokens])
+    except FileNotFoundError:
+        if os.path.exists(os.path.join(path, tables.position_locations_file)):
+            os.remove(os.path.join(path, tables.position_locations_file))
+
+    with open(os.path.join(path, segment_meta_file), "rb") as f:
+        base_doc_id = orjson.loads(f.read())["base_doc_id"]
+    doc_id_count = os.path.getsize(os.path.join(path, doc_wordcounts_file)) // 4 - 1
+    with open(os.path.join(path, "url_dict.json"), "rb") as f:
+        url_dict = orjson.loads(f.read())
+    tables.write_string_table(os.path.join(path, tables.urls_file),
+                              [url_dict.get(str(doc_id)) or "" for doc_id in
+                               range(base_doc_id + 1, base_doc_id + 1 + doc_id_count)])
+
+    try:
+        with open(os.path.join(path, stemming.stem_table_file), "rb") as f:
+            stem_table = orjson.loads(f.read())
+        tables.write_table_dict(os.path.join(path, tables.stem_words_file), os.path.join(path, tables.stems_file),
+                                stem_table, string_values=True)
+    except FileNotFoundError:
+        pass
+
+    tables.write_front_coded_table(os.path.join(path, tables.lexicon_file), tokens)
+
+
+class Segment:
+    """
+    One immutable part of the index: its lexicon, postings, urls and document word counts.
+    The lexicon and the urls are memory-mapped tables (see tables.py) shared by every process that searches the
+    segment.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(os.path.join(path, segment_meta_file), "rb") as f:
+            segment_meta = orjson.loads(f.read())
+        self.base_doc_id = segment_meta["base_doc_id"]
+        self.doc_count = segment_meta["doc_count"]
+
+        # word count, field word counts and norm of doc id base_doc_id + i at position i
+        self.doc_wordcounts = np.fromfile(os.path.join(path, doc_wordcounts_file), dtype=np.uint32)
+        self.doc_field_lengths = np.fromfile(os.path.join(path, doc_field_lengths_file),
+                                             dtype=np.uint32).reshape(-1, len(postings.fields))
+        self.doc_norms = np.fromfile(os.path.join(path, doc_norms_file), dtype=np.float32)
+
+        # token -> postings location, the number of postings of every token of the lexicon in its order and the
+        # url of doc id base_doc_id + 1 + i at position i ("" if it has none)
+        self.lexicon_table = tables.FrontCodedTable(os.path.join(path, tables.lexicon_file))
+        self.token_locs = tables.TableDict(self.lexicon_table, tables.read_uint_table(
+            os.path.join(path, tables.token_locations_file)))
+        self.token_doc_freqs = tables.read_uint_table(os.path.join(path, tables.token_doc_freqs_file))
+        self.urls = tables.StringTable(os.path.join(path, tables.urls_file))
+
+        try:
+            with open(os.path.join(path, deleted_docs_file), "rb") as f:
+                self.deleted_doc_ids = np.array(orjson.loads(f.read()), dtype=np.uint32)
+        except FileNotFoundError:
+            self.deleted_doc_ids = np.zeros(0, dtype=np.uint32)
+
+        self.postings_reader = postings.PostingsReader(os.path.join(path, postings.binary_index_file))
+
+        # the positions and the spelling index are only opened by the first query that needs them,
+        # False once they turned out to be missing
+        self.positions_reader = None
+        self.spelling_index = None
+
+    def prefix_tokens(self, prefix):
+        """
+        The tokens of the segment that start with a prefix with their number of postings, a range of the
+        front-coded lexicon.
+        """
+        first, end = self.lexicon_table.prefix_range(prefix)
+        return [(token, self.token_doc_freqs[number])
+                for number, token in enumerate(self.lexicon_table.iterate(first, end), first)]
+
+    def get_positions_reader(self):
+        """
+        Open the positions of the segment, or return None if it was built without them.
+        """
+        if self.positions_reader is None:
+            try:
+                position_locs = tables.TableDict(self.lexicon_table, tables.read_uint_table(
+                    os.path.join(self.path, tables.position_locations_file)))
+                self.positions_reader = postings.PositionsReader(os.path.join(self.path, postings.positions_file),
+                                                                 position_locs)
+            except FileNotFoundError:
+                self.positions_reader = False
+        return self.positions_reader or None
+
+    def get_spelling_index(self):
+        """
+        Load the spelling index of the segment, or return None if it was built without one.
+        """
+        if self.spelling_index is None:
+            try:
+                self.spelling_index = spelling.SpellingIndex(self.path)
+            except FileNotFoundError:
+                self.spelling_index = False
+        return self.spelling_index or None
+
+    @property
+    def max_doc_id(self):
+        return self.base_doc_id + len(self.doc_wordcounts) - 1
+
+
+class MergedLexicon:
+    """
+    Lexicon over all segments, maps a token to the (segment number, location) pairs of its postings.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.token_count = None
+
+    def __contains__(self, token):
+        return any(token in segment.token_locs for segment in self.segments)
+
+    def __getitem__(self, token):
+        segment_locs = tuple((segment_number, token_loc) for segment_number, token_loc in
+                             enumerate(segment.token_locs.get(token) for segment in self.segments)
+                             if token_loc is not None)
+        if not segment_locs:
+            raise KeyError(token)
+        return segment_locs
+
+    def __iter__(self):
+        return iter(sorted(set().union(*(segment.token_locs for segment in self.segments))))
+
+    def __len__(self):
+        if self.token_count is None:
+            if len(self.segments) == 1:
+                self.token_count = len(self.segments[0].token_locs)
+            else:
+                self.token_count = len(set().union(*(segment.token_locs for segment in self.segments)))
+        return self.token_count
+
+    def prefix_tokens(self, prefix, limit=None):
+        """
+        The tokens that start with a prefix, the limit ones with the most postings over all segments first.
+        """
+        token_doc_freqs = {}
+        for segment in self.segments:
+            for token, doc_freq in segment.prefix_tokens(prefix):
+                token_doc_freqs[token] = token_doc_freqs.get(token, 0) + doc_freq
+        return sorted(token_doc_freqs, key=lambda token: (-token_doc_freqs[token], token))[:limit]
+
+
+class DocUrls:
+    """
+    Url of every doc id across the segments, None for doc ids without one. The urls stay in the segments' tables.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.first_doc_ids = [segment.base_doc_id + 1 for segment in segments]
+        self.doc_id_count = max(segment.max_doc_id for segment in segments) + 1
+
+    def __len__(self):
+        return self.doc_id_count
+
+    def __getitem__(self, doc_id):
+        if not 0 <= doc_id < self.doc_id_count:
+            raise IndexError(doc_id)
+        segment_number = bisect.bisect_right(self.first_doc_ids, doc_id) - 1
+        if segment_number < 0 or doc_id > self.segments[segment_number].max_doc_id:
+            return None
+        segment = self.segments[segment_number]
+        return segment.urls[doc_id - segment.base_doc_id - 1] or None
+
+
+class SegmentedIndex:
+    """
+    The main segment plus the delta segments of incremental builds, searched as one index.
+    Scores are computed at query time by the scorer (tfidf, bm25 or cosine, see scoring.py) from the frequencies,
+    the document statistics and the live document count and document frequencies, so they stay correct when
+    documents are added or deleted by delta segments and the ranking can change without rebuilding the index.
+    A token's frequency in a document is its frequency in the page text plus its frequency in each field times
+    the field's weight (see scoring.field_weight_vector), and document lengths are weighted the same way.
+    An index of a single segment with a global stats sidecar is a shard of a sharded index, its live document count,
+    average document length and document frequencies are those of the whole index so the scores of every shard
+    can be compared.
+    """
+
+    def __init__(self, index_dir=".", scorer="tfidf", field_weights=None):
+        self.index_dir = index_dir
+        self.scorer = scoring.get_scorer(scorer)
+        self.field_weights = scoring.field_weight_vector(field_weights)
+        self.segment_list = read_segment_list(index_dir)
+        segment_dirs = [self.segment_list["main"]] + self.segment_list["deltas"]
+        self.segments = [Segment(os.path.join(index_dir, segment_dir)) for segment_dir in segment_dirs]
+        self.lexicon = MergedLexicon(self.segments)
+
+        # word counts, field word counts, norms and urls of every doc id across the segments
+        self.max_doc_id = max(segment.max_doc_id for segment in self.segments)
+        self.doc_body_lengths = np.ones(self.max_doc_id + 1, dtype=np.float64)
+        self.doc_field_lengths = np.zeros((self.max_doc_id + 1, len(postings.fields)), dtype=np.float64)
+        self.doc_norms = np.ones(self.max_doc_id + 1, dtype=np.float64)
+        self.url_list = DocUrls(self.segments)
+        for segment in self.segments:
+            segment_doc_ids = slice(segment.base_doc_id + 1, segment.max_doc_id + 1)
+            self.doc_body_lengths[segment_doc_ids] = segment.doc_wordcounts[1:]
+            self.doc_field_lengths[segment_doc_ids] = segment.doc_field_lengths[1:]
+            self.doc_norms[segment_doc_ids] = segment.doc_norms[1:]
+
+        # documents deleted or replaced by later segments
+        self.deleted_doc_ids = np.unique(np.concatenate([segment.deleted_doc_ids for segment in self.segments]))
+        self.live_doc_count = sum(segment.doc_count for segment in self.segments) - len(self.deleted_doc_ids)
+
+        # weighted word counts and their average over the live documents, doc ids that aren't indexed have
+        # a word count of 0
+        self.doc_wordcounts = self.doc_body_lengths + self.doc_field_lengths @ self.field_weights
+        body_length, field_lengths = self.live_lengths()
+        self.avg_doc_length = (body_length + field_lengths @ self.field_weights) / max(self.live_doc_count, 1)
+
+        # statistics of the whole index if this is a shard
+        self.global_token_locs = None
+        self.global_doc_freqs = None
+        if len(self.segments) == 1 and os.path.exists(os.path.join(self.segments[0].path, global_stats_file)):
+            self.load_global_stats(self.segments[0].path)
+
+        # deleted doc ids that fall in the doc id range of each segment
+        self.segment_deleted_doc_ids = []
+        for segment in self.segments:
+            in_segment = (self.deleted_doc_ids > segment.base_doc_id) & (self.deleted_doc_ids <= segment.max_doc_id)
+            self.segment_deleted_doc_ids.append(self.deleted_doc_ids[in_segment])
+
+    def live_lengths(self):
+        """
+        Summed word count and field word counts (one per field) of the live documents.
+        """
+        body_length = sum(int(segment.doc_wordcounts.sum(dtype=np.int64)) for segment in self.segments) - \
+            float(self.doc_body_lengths[self.deleted_doc_ids].sum())
+        field_lengths = sum(segment.doc_field_lengths.sum(axis=0, dtype=np.int64) for segment in self.segments) - \
+            self.doc_field_lengths[self.deleted_doc_ids].sum(axis=0)
+        return float(body_length), field_lengths.astype(np.float64)
+
+    def load_global_stats(self, path):
+        """
+        Score with the live document count, document lengths and document frequencies of the whole sharded index.
+        """
+        with open(os.path.join(path, global_stats_file), "rb") as f:
+            global_stats = orjson.loads(f.read())
+        self.live_doc_count = global_stats["doc_count"]
+        field_lengths = np.array(global_stats["field_lengths"], dtype=np.float64)
+        self.avg_doc_length = (global_stats["body_length"] + field_lengths @ self.field_weights) / \
+            max(self.live_doc_count, 1)
+        entries = np.frombuffer(tables.map_file(os.path.join(path, global_doc_freqs_file)),
+                                dtype=global_doc_freq_entry)
+        self.global_token_locs = entries["loc"]
+        self.global_doc_freqs = entries["doc_freq"]
+
+    def doc_freq(self, segment_locs) -> int:
+        """
+        Number of live documents that contain a token, deleted documents are found through the skip tables
+        instead of decoding the whole postings lists. A shard returns the token's frequency in the whole index.
+        """
+        if self.global_doc_freqs is not None:
+            ((_, token_loc),) = segment_locs
+            return int(self.global_doc_freqs[np.searchsorted(self.global_token_locs, token_loc)])
+        doc_freq = 0
+        for segment_number, token_loc in segment_locs:
+            postings_reader = self.segments[segment_number].postings_reader
+            doc_freq += postings_reader.count(token_loc)
+            deleted_doc_ids = self.segment_deleted_doc_ids[segment_number]
+            if len(deleted_doc_ids):
+                doc_freq -= int(postings_reader.lookup(token_loc, deleted_doc_ids)[0].sum())
+        return doc_freq
+
+    def query_weights(self, query_segment_locs):
+        """
+        Weight of every query token for the scorer, computed from the live document frequencies.
+        """
+        with metrics.search_metrics.timer("weights"):
+            return self.scorer.query_weights([self.doc_freq(segment_locs) for segment_locs in query_segment_locs],
+                                             self)
+
+    def effective_freqs(self, freqs, field_freqs):
+        """
+        Frequencies with the weighted field frequencies added.
+        """
+        return freqs + field_freqs @ self.field_weights
+
+    def score(self, doc_ids, token_freqs, token_field_freqs, weights):
+        """
+        Sum the scores of the tokens in token order so every path ranks documents the same.
+        """
+        with metrics.search_metrics.timer("score"):
+            scores = np.zeros(len(doc_ids), dtype=np.float64)
+            for freqs, field_freqs, weight in zip(token_freqs, token_field_freqs, weights):
+                scores += self.scorer.score(self.effective_freqs(freqs, field_freqs), doc_ids, weight, self)
+            return scores
+
+    def intersect(self, query_segment_locs):
+        """
+        Return the live doc ids that contain every token and their summed scores. Every segment holds
+        its own doc id range, so the tokens are intersected segment by segment.
+        """
+        weights = self.query_weights(query_segment_locs)
+        segment_doc_ids = []
+        segment_scores = []
+
+        for segment_number, segment, token_locs in self.segment_token_locs(query_segment_locs):
+            with metrics.search_metrics.timer("intersect"):
+                doc_ids, token_freqs, token_field_freqs = segment.postings_reader.intersect(token_locs)
+            deleted_doc_ids = self.segment_deleted_doc_ids[segment_number]
+            if len(deleted_doc_ids):
+                live = ~np.isin(doc_ids, deleted_doc_ids, assume_unique=True)
+                doc_ids = doc_ids[live]
+                token_freqs = [freqs[live] for freqs in token_freqs]
+                token_field_freqs = [field_freqs[live] for field_freqs in token_field_freqs]
+            scores = self.score(doc_ids, token_freqs, token_field_freqs, weights)
+            segment_doc_ids.append(doc_ids)
+            segment_scores.append(scores)
+
+        if not segment_doc_ids:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.float64)
+        return np.concatenate(segment_doc_ids), np.concatenate(segment_scores)
+
+    def segment_token_locs(self, query_segment_locs):
+        """
+        Yield every segment that contains all the tokens with the tokens' locations in it.
+        """
+        for segment_number, segment in enumerate(self.segments):
+            token_locs = []
+            for segment_locs in query_segment_locs:
+                token_loc = next((loc for number, loc in segment_locs if number == segment_number), None)
+                if token_loc is None:
+                    break
+                token_locs.append(token_loc)
+            else:
+                yield segment_number, segment, token_locs
+
+    def block_bounds(self, skip_tables, weights, rarest):
+        """
+        Upper bound of the summed score of the docs in each block of the rarest token: its block bound plus,
+        for every other token, the highest block bound among the blocks overlapping the same doc id range.
+        The scorer bounds every block from its highest frequency and tf. The weighted field maxima are added to
+        them, the tf maxima are relative to the unweighted word counts so they stay upper bounds for any
+        non-negative field weights.
+        """
+        token_bounds = []
+        for skip_table, weight in zip(skip_tables, weights):
+            block_max_freqs = skip_table.block_max_freqs + self.field_weights @ skip_table.block_max_field_freqs
+            block_max_tfs = skip_table.block_max_tfs + self.field_weights @ skip_table.block_max_field_tfs
+            token_bounds.append(self.scorer.block_bounds(block_max_freqs, block_max_tfs, weight, self))
+        rarest_table = skip_tables[rarest]
+        block_lasts = rarest_table.last_doc_ids.astype(np.int64)
+        block_firsts = np.concatenate(([0], block_lasts[:-1] + 1))
+        bounds = token_bounds[rarest]
+
+        for token_number, skip_table in enumerate(skip_tables):
+            if token_number == rarest:
+                continue
+            # blocks of this token that overlap each block of the rarest token
+            first_blocks = np.searchsorted(skip_table.last_doc_ids, block_firsts)
+            last_blocks = np.minimum(np.searchsorted(skip_table.last_doc_ids, block_lasts), skip_table.block_count - 1)
+            overlapping = first_blocks < skip_table.block_count
+            first_blocks = np.minimum(first_blocks, skip_table.block_count - 1)
+
+            # maximum over each range of blocks, the odd results of reduceat are the gaps between ranges
+            block_bounds = np.append(token_bounds[token_number], 0.0)
+            range_bounds = np.empty(2 * len(first_blocks), dtype=np.int64)
+            range_bounds[0::2] = first_blocks
+            range_bounds[1::2] = np.maximum(last_blocks, first_blocks) + 1
+            range_max_bounds = np.maximum.reduceat(block_bounds, range_bounds)[0::2]
+
+            bounds = np.where(overlapping, bounds + range_max_bounds, -np.inf)
+
+        # leave room for rounding so a bound is never below the score computed for a doc of the block
+        return bounds * (1 + 1e-9)
+
+    def score_blocks(self, segment_number, blocks, rarest, token_locs, skip_tables, weights):
+        """
+        Score the live docs of some blocks of the rarest token that contain every other token.
+        """
+        postings_reader = self.segments[segment_number].postings_reader
+        with metrics.search_metrics.timer("decode"):
+            rarest_postings = postings_reader.read_blocks(skip_tables[rarest], blocks)
+        doc_ids = rarest_postings.doc_ids
+        token_freqs = {rarest: (rarest_postings.freqs, rarest_postings.field_freqs)}
+
+        # look up the blocks' doc ids in the other tokens
+        with metrics.search_metrics.timer("intersect"):
+            for token_number, token_loc in enumerate(token_locs):
+                if token_number == rarest or len(doc_ids) == 0:
+                    continue
+                found, freqs, field_freqs = postings_reader.lookup(token_loc, doc_ids)
+                doc_ids = doc_ids[found]
+                token_freqs = {previous_token: (previous_freqs[found], previous_field_freqs[found])
+                               for previous_token, (previous_freqs, previous_field_freqs) in token_freqs.items()}
+                token_freqs[token_number] = (freqs, field_freqs)
+        if len(doc_ids) == 0:
+            return doc_ids, np.zeros(0, dtype=np.float64)
+
+        deleted_doc_ids = self.segment_deleted_doc_ids[segment_number]
+        if len(deleted_doc_ids):
+            live = ~np.isin(doc_ids, deleted_doc_ids, assume_unique=True)
+            doc_ids = doc_ids[live]
+            token_freqs = {token_number: (freqs[live], field_freqs[live])
+                           for token_number, (freqs, field_freqs) in token_freqs.items()}
+
+        ordered_freqs = [token_freqs[token_number] for token_number in range(len(token_locs))]
+        return doc_ids, self.score(doc_ids, [freqs for freqs, _ in ordered_freqs],
+                                   [field_freqs for _, field_freqs in ordered_freqs], weights)
+
+    def top_k(self, query_segment_locs, k, return_scores=False):
+        """
+        Return the k live doc ids that contain every token with the highest summed score, highest first,
+        and their scores if return_scores is set.
+        The blocks of the rarest token are scored in order of their upper bound, in batches that double in size,
+        and the search stops once no remaining block can beat the k-th best score, so broad queries only decode
+        a few blocks.
+        """
+        weights = self.query_weights(query_segment_locs)
+
+        # candidate blocks of every segment with their upper bounds
+        candidate_blocks = []
+        segment_queries = {}
+        with metrics.search_metrics.timer("bounds"):
+            for segment_number, segment, token_locs in self.segment_token_locs(query_segment_locs):
+                skip_tables = [segment.postings_reader.skip_table(token_loc) for token_loc in token_locs]
+                rarest = min(range(len(skip_tables)), key=lambda token_number: skip_tables[token_number].count)
+                segment_queries[segment_number] = (rarest, token_locs, skip_tables)
+                bounds = self.block_bounds(skip_tables, weights, rarest)
+                for block in np.flatnonzero(bounds > -np.inf).tolist():
+                    candidate_blocks.append((bounds[block], segment_number, block))
+            candidate_blocks.sort(key=lambda candidate: -candidate[0])
+
+        # min-heap of (score, -doc_id) so ties keep the lower doc id like the full ranking
+        top_docs = []
+        position = 0
+        batch_size = 32
+        while position < len(candidate_blocks):
+            threshold = top_docs[0][0] if len(top_docs) == k else -np.inf
+            if candidate_blocks[position][0] < threshold:
+                break
+
+            # take the next blocks that can still beat the k-th best score
+            batch = {}
+            batch_end = min(position + batch_size, len(candidate_blocks))
+            while position < batch_end and candidate_blocks[position][0] >= threshold:
+                _, segment_number, block = candidate_blocks[position]
+                batch.setdefault(segment_number, []).append(block)
+                position += 1
+            batch_size *= 2
+
+            for segment_number, blocks in batch.items():
+                rarest, token_locs, skip_tables = segment_queries[segment_number]
+                doc_ids, scores = self.score_blocks(segment_number, np.array(sorted(blocks)), rarest, token_locs,
+                                                    skip_tables, weights)
+
+                # only the best k docs of the batch that can enter the heap are pushed
+                order = np.lexsort((doc_ids, -scores))[:k]
+                for score, doc_id in zip(scores[order].tolist(), doc_ids[order].tolist()):
+                    if len(top_docs) < k:
+                        heapq.heappush(top_docs, (score, -doc_id))
+                    elif (score, -doc_id) > top_docs[0]:
+                        heapq.heapreplace(top_docs, (score, -doc_id))
+                    else:
+                        break
+
+        top_docs.sort(reverse=True)
+        if return_scores:
+            return [-doc_id for _, doc_id in top_docs], [score for score, _ in top_docs]
+        return [-doc_id for _, doc_id in top_docs]
+
+    def range_bounds(self, skip_tables, weights, groups):
+        """
+        Split the doc ids of a segment into ranges at the end of every block of every token, so each range lies
+        in a single block of each token. Returns the last doc id of every range, the block of every token that
+        holds each range (block_count if none does), and for every range an upper bound of the number of token
+        groups a doc of the range matches and of its summed score.
+        """
+        range_lasts = np.unique(np.concatenate([skip_table.last_doc_ids for skip_table in skip_tables]))
+        token_blocks = []
+        group_matches = {}
+        bounds = np.zeros(len(range_lasts), dtype=np.float64)
+        for skip_table, weight, group in zip(skip_tables, weights, groups):
+            block_max_freqs = skip_table.block_max_freqs + self.field_weights @ skip_table.block_max_field_freqs
+            block_max_tfs = skip_table.block_max_tfs + self.field_weights @ skip_table.block_max_field_tfs
+            block_bounds = np.append(self.scorer.block_bounds(block_max_freqs, block_max_tfs, weight, self), 0.0)
+            blocks = np.searchsorted(skip_table.last_doc_ids, range_lasts)
+            token_blocks.append(blocks)
+            group_matches[group] = group_matches.get(group, False) | (blocks < skip_table.block_count)
+            bounds += block_bounds[blocks]
+        max_matches = np.sum(list(group_matches.values()), axis=0, dtype=np.int64)
+
+        # leave room for rounding so a bound is never below the score computed for a doc of the range
+        return range_lasts, token_blocks, max_matches, bounds * (1 + 1e-9)
+
+    @staticmethod
+    def read_cached_blocks(postings_reader, skip_table, blocks, decoded_blocks):
+        """
+        Decode some blocks (sorted block numbers) of a token, the blocks in decoded_blocks (block -> postings of
+        the block) aren't decoded again and the new ones are added to it.
+        """
+        new_blocks = np.array([block for block in blocks.tolist() if block not in decoded_blocks], dtype=np.int64)
+        if len(new_blocks):
+            new_postings = postings_reader.read_blocks(skip_table, new_blocks)
+            block_counts = np.minimum((new_blocks + 1) * postings.block_size, skip_table.count) - \
+                new_blocks * postings.block_size
+            splits = np.cumsum(block_counts)[:-1]
+            for block, doc_ids, freqs, field_freqs in zip(new_blocks.tolist(), np.split(new_postings.doc_ids, splits),
+                                                          np.split(new_postings.freqs, splits),
+                                                          np.split(new_postings.field_freqs, splits)):
+                decoded_blocks[block] = postings.Postings(doc_ids, freqs, field_freqs)
+        block_postings = [decoded_blocks[block] for block in blocks.tolist()]
+        return postings.Postings(*(np.concatenate(arrays) for arrays in zip(*block_postings)))
+
+    def score_ranges(self, segment_number, ranges, token_locs, token_numbers, skip_tables, range_lasts,
+                     token_blocks, token_decoded_blocks, weights, min_matches, token_groups=None):
+        """
+        Score the live docs of some ranges (sorted range numbers) that match at least min_matches token groups.
+        Only the blocks of every token that hold the ranges are decoded, once per query. Returns the doc ids
+        with the number of token groups they match and their summed score.
+        """
+        postings_reader = self.segments[segment_number].postings_reader
+        range_doc_ids = []
+        range_scores = []
+        range_groups = []
+
+        # scores of every token in the order of the query, so the sums match the other paths
+        for token_number, skip_table, blocks, decoded_blocks in zip(token_numbers, skip_tables, token_blocks,
+                                                                    token_decoded_blocks):
+            token_blocks_needed = np.unique(blocks[ranges])
+            token_blocks_needed = token_blocks_needed[token_blocks_needed < skip_table.block_count]
+            if len(token_blocks_needed) == 0:
+                continue
+            with metrics.search_metrics.timer("decode"):
+                token_postings = self.read_cached_blocks(postings_reader, skip_table, token_blocks_needed,
+                                                         decoded_blocks)
+            in_ranges = np.isin(np.searchsorted(range_lasts, token_postings.doc_ids), ranges)
+            doc_ids = token_postings.doc_ids[in_ranges]
+            with metrics.search_metrics.timer("score"):
+                freqs = self.effective_freqs(token_postings.freqs[in_ranges], token_postings.field_freqs[in_ranges])
+                range_scores.append(self.scorer.score(freqs, doc_ids, weights[token_number], self))
+            range_doc_ids.append(doc_ids)
+            if token_groups is not None:
+                range_groups.append(np.full(len(doc_ids), token_groups[token_number], dtype=np.int64))
+
+        if not range_doc_ids:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+        # sum the scores and count the tokens (or the token groups) of every doc
+        with metrics.search_metrics.timer("intersect"):
+            doc_ids, doc_numbers = np.unique(np.concatenate(range_doc_ids), return_inverse=True)
+            if token_groups is None:
+                matches = np.bincount(doc_numbers, minlength=len(doc_ids))
+            else:
+                group_count = max(token_groups) + 1
+                doc_groups = np.unique(doc_numbers * group_count + np.concatenate(range_groups))
+                matches = np.bincount(doc_groups // group_count, minlength=len(doc_ids))
+            scores = np.bincount(doc_numbers, weights=np.concatenate(range_scores), minlength=len(doc_ids))
+
+        keep = matches >= min_matches
+        deleted_doc_ids = self.segment_deleted_doc_ids[segment_number]
+        if len(deleted_doc_ids):
+            keep &= ~np.isin(doc_ids, deleted_doc_ids, assume_unique=True)
+        return doc_ids[keep], matches[keep], scores[keep]
+
+    def top_k_any(self, query_segment_locs, k=None, min_matches=1, return_scores=False, token_groups=None):
+        """
+        Ranked OR: return the live doc ids that contain at least min_matches of the tokens, ranked by the number
+        of tokens they contain and then by their summed score, highest first (the k best ones if k is given),
+        and their match counts and scores if return_scores is set. Docs that contain every token rank the same
+        as with top_k.
+        token_groups numbers the group of every token, the tokens of a group (like the expansions of a prefix
+        word) count as one match that a doc makes by containing any of them. The scores of all of them are summed.
+        The doc ids of every segment are split into ranges that lie in a single block of each token, and the
+        ranges are scored in order of their bounds in batches that double in size, until no remaining range
+        can beat the k-th best doc. Only a batch of ranges and a heap of k docs are held at once.
+        """
+        weights = self.query_weights(query_segment_locs)
+
+        # candidate ranges of every segment with their bounds
+        candidate_ranges = []
+        segment_queries = {}
+        with metrics.search_metrics.timer("bounds"):
+            for segment_number in range(len(self.segments)):
+                token_numbers = []
+                token_locs = []
+                for token_number, segment_locs in enumerate(query_segment_locs):
+                    token_loc = next((loc for number, loc in segment_locs if number == segment_number), None)
+                    if token_loc is not None:
+                        token_numbers.append(token_number)
+                        token_locs.append(token_loc)
+                groups = token_numbers if token_groups is None else \
+                    [token_groups[token_number] for token_number in token_numbers]
+                if len(set(groups)) < min_matches:
+                    continue
+                postings_reader = self.segments[segment_number].postings_reader
+                skip_tables = [postings_reader.skip_table(token_loc) for token_loc in token_locs]
+                range_lasts, token_blocks, max_matches, bounds = self.range_bounds(
+                    skip_tables, [weights[token_number] for token_number in token_numbers], groups)
+                segment_queries[segment_number] = (token_locs, token_numbers, skip_tables, range_lasts, token_blocks,
+                                                   [{} for _ in token_locs])
+                for range_number in np.flatnonzero(max_matches >= min_matches).tolist():
+                    candidate_ranges.append((int(max_matches[range_number]), bounds[range_number], segment_number,
+                                             range_number))
+            candidate_ranges.sort(key=lambda candidate: (-candidate[0], -candidate[1]))
+
+        # min-heap of (matches, score, -doc_id) so ties keep the lower doc id
+        top_docs = []
+        position = 0
+        batch_size = 32
+        while position < len(candidate_ranges):
+            threshold = top_docs[0][:2] if k is not None and len(top_docs) == k else (0, -np.inf)
+            if candidate_ranges[position][:2] < threshold:
+                break
+
+            # take the next ranges that can still beat the k-th best doc
+            batch = {}
+            batch_end = min(position + batch_size, len(candidate_ranges)) if k is not None else len(candidate_ranges)
+            while position < batch_end and candidate_ranges[position][:2] >= threshold:
+                _, _, segment_number, range_number = candidate_ranges[position]
+                batch.setdefault(segment_number, []).append(range_number)
+                position += 1
+            batch_size *= 2
+
+            for segment_number, ranges in batch.items():
+                doc_ids, matches, scores = self.score_ranges(segment_number, np.array(sorted(ranges)),
+                                                             *segment_queries[segment_number], weights, min_matches,
+                                                             token_groups)
+                order = np.lexsort((doc_ids, -scores, -matches))
+                if k is not None:
+                    order = order[:k]
+                for doc_matches, score, doc_id in zip(matches[order].tolist(), scores[order].tolist(),
+                                                      doc_ids[order].tolist()):
+                    if k is None or len(top_docs) < k:
+                        heapq.heappush(top_docs, (doc_matches, score, -doc_id))
+                    elif (doc_matches, score, -doc_id) > top_docs[0]:
+                        heapq.heapreplace(top_docs, (doc_matches, score, -doc_id))
+                    else:
+                        break
+
+        top_docs.sort(reverse=True)
+        doc_ids = [-doc_id for _, _, doc_id in top_docs]
+        if return_scores:
+            return doc_ids, [doc_matches for doc_matches, _, _ in top_docs], [score for _, score, _ in top_docs]
+        return doc_ids
+
+    def word_doc_freq(self, word) -> int:
+        """
+        Number of live documents that contain the stem of a word.
+        """
+        stem = stemming.stem_word(word)
+        return self.doc_freq(self.lexicon[stem]) if stem in self.lexicon else 0
+
+    def correct_spelling(self, word):
+        """
+        Return the indexed word closest to a word that isn't in the index, or None (see spelling.suggest).
+        """
+        with metrics.search_metrics.timer("spelling"):
+            if not spelling.is_suggestable(word):
+                return None
+            candidates = set()
+            for segment in self.segments:
+                spelling_index = segment.get_spelling_index()
+                if spelling_index is not None:
+                    candidates.update(spelling_index.candidates(word))
+            return spelling.suggest(word, candidates, self.word_doc_freq)
+
+    def phrase_factors(self, doc_ids, tokens, phrases):
+        """
+        Score multipliers of some docs that contain every token for the quoted phrases of a query
+        (see scoring.phrase_factor). Only the positions of these docs are decoded, docs of segments
+        without positions keep a multiplier of 1.
+        """
+        with metrics.search_metrics.timer("phrases"):
+            doc_ids = np.asarray(doc_ids, dtype=np.uint32)
+            factors = np.ones(len(doc_ids), dtype=np.float64)
+            phrase_tokens = sorted({token_number for token_numbers, _ in phrases for token_number in token_numbers})
+
+            for segment in self.segments:
+                in_segment = np.flatnonzero((doc_ids > segment.base_doc_id) & (doc_ids <= segment.max_doc_id))
+                if len(in_segment) == 0:
+                    continue
+                positions_reader = segment.get_positions_reader()
+                if positions_reader is None:
+                    continue
+
+                # positions of every phrase token in the docs of the segment, in doc id order
+                in_segment = in_segment[np.argsort(doc_ids[in_segment])]
+                segment_doc_ids = doc_ids[in_segment]
+                token_positions = {}
+                for token_number in phrase_tokens:
+                    token = tokens[token_number]
+                    if token in segment.token_locs:
+                        token_positions[token_number] = positions_reader.lookup(
+                            token, segment.postings_reader, segment.token_locs[token], segment_doc_ids)
+                    else:
+                        # docs that match only some of the tokens
+                        token_positions[token_number] = [np.zeros(0, dtype=np.uint32)] * len(segment_doc_ids)
+
+                for position, doc_index in enumerate(in_segment.tolist()):
+                    doc_positions = {token_number: token_positions[token_number][position]
+                                     for token_number in phrase_tokens}
+                    factors[doc_index] = scoring.phrase_factor(doc_positions, phrases)
+            return factors
+
+    def read(self, segment_locs) -> postings.Postings:
+        """
+        Read a token's postings from every segment it appears in, without deleted documents.
+        """
+        segment_postings = [self.segments[segment_number].postings_reader.read(token_loc)
+                            for segment_number, token_loc in segment_locs]
+
+        # segments hold increasing doc id ranges so the concatenated doc ids stay sorted
+        doc_ids = np.concatenate([token_postings.doc_ids for token_postings in segment_postings])
+        freqs = np.concatenate([token_postings.freqs for token_postings in segment_postings])
+        field_freqs = np.concatenate([token_postings.field_freqs for token_postings in segment_postings])
+        if len(self.deleted_doc_ids):
+            live = ~np.isin(doc_ids, self.deleted_doc_ids, assume_unique=True)
+            doc_ids = doc_ids[live]
+            freqs = freqs[live]
+            field_freqs = field_freqs[live]
+        return postings.Postings(doc_ids, freqs, field_freqs)
+
+    def read_positions(self, token, segment_locs) -> np.ndarray:
+        """
+        Read the positions of a token's postings from every segment, without the positions of deleted documents.
+        """
+        segment_positions = []
+        for segment_number, token_loc in segment_locs:
+            segment = self.segments[segment_number]
+            token_postings = segment.postings_reader.read(token_loc)
+            positions = segment.get_positions_reader().read(token, token_postings.freqs)
+            if len(self.deleted_doc_ids):
+                live = ~np.isin(token_postings.doc_ids, self.deleted_doc_ids, assume_unique=True)
+                positions = positions[np.repeat(live, token_postings.freqs)]
+            segment_positions.append(positions)
+        return np.concatenate(segment_positions)
+
+
+def compact(index_dir=".", file_ids=None):
+    """
+    Merge the main segment and all delta segments into a new main segment without deleted documents.
+    file_ids (file -> doc id) is written as the new segment's file_id.json if given.
+    The new segment is published by replacing the segment list, so searchers keep working during compaction.
+    """
+    index = SegmentedIndex(index_dir)
+    if not index.segment_list["deltas"]:
+        print("nothing to compact")
+        return
+
+    segment_name = new_segment_name("main", index_dir)
+    segment_path = os.path.join(index_dir, segment_name)
+    os.makedirs(segment_path + ".tmp")
+
+    # rewrite every token's live postings, and their positions if every segment has them
+    token_count = 0
+    doc_freqs = {}
+    positions_writer = None
+    if all(segment.get_positions_reader() is not None for segment in index.segments):
+        positions_writer = postings.PositionsWriter(os.path.join(segment_path + ".tmp", postings.positions_file))
+    with postings.PostingsWriter(os.path.join(segment_path + ".tmp", postings.binary_index_file)) as postings_writer:
+        for token in index.lexicon:
+            segment_locs = index.lexicon[token]
+            token_postings = index.read(segment_locs)
+            if len(token_postings.doc_ids):
+                postings_writer.write(token, token_postings.doc_ids, token_postings.freqs, token_postings.field_freqs,
+                                      index.doc_body_lengths[token_postings.doc_ids])
+                if positions_writer is not None:
+                    positions_writer.write(token, token_postings.doc_ids, token_postings.freqs,
+                                           index.read_positions(token, segment_locs))
+                doc_freqs[token] = len(token_postings.doc_ids)
+                token_count += 1
+    with open(os.path.join(segment_path + ".tmp", postings.binary_token_locations_file), "wb") as f:
+        f.write(orjson.dumps(postings_writer.token_locs))
+    if positions_writer is not None:
+        positions_writer.close()
+        with open(os.path.join(segment_path + ".tmp", postings.position_locations_file), "wb") as f:
+            f.write(orjson.dumps(positions_writer.token_locs))
+
+    # keep the doc ids, deleted documents get word counts and a norm of 0 and no url
+    deleted = set(index.deleted_doc_ids.tolist())
+    doc_wordcounts = index.doc_body_lengths.astype(np.uint32)
+    doc_field_lengths = index.doc_field_lengths.astype(np.uint32)
+    doc_norms = index.doc_norms.astype(np.float32)
+    doc_wordcounts[0] = 0
+    doc_norms[0] = 0
+    url_dict = {}
+    for doc_id in range(1, index.max_doc_id + 1):
+        if doc_id in deleted or index.url_list[doc_id] is None:
+            doc_wordcounts[doc_id] = 0
+            doc_field_lengths[doc_id] = 0
+            doc_norms[doc_id] = 0
+        else:
+            url_dict[str(doc_id)] = index.url_list[doc_id]
+    doc_wordcounts.tofile(os.path.join(segment_path + ".tmp", doc_wordcounts_file))
+    doc_field_lengths.tofile(os.path.join(segment_path + ".tmp", doc_field_lengths_file))
+    doc_norms.tofile(os.path.join(segment_path + ".tmp", doc_norms_file))
+    with open(os.path.join(segment_path + ".tmp", "url_dict.json"), "wb") as f:
+        f.write(orjson.dumps(url_dict))
+    with open(os.path.join(segment_path + ".tmp", segment_meta_file), "wb") as f:
+        f.write(orjson.dumps({"base_doc_id": 0, "doc_count": index.live_doc_count}))
+    stem_table = {}
+    for segment in index.segments:
+        try:
+            with open(os.path.join(segment.path, stemming.stem_table_file), "rb") as f:
+                stem_table.update(orjson.loads(f.read()))
+        except FileNotFoundError:
+            pass
+    stemming.write_stem_table(segment_path + ".tmp", stem_table)
+    spelling.write_spelling_index(segment_path + ".tmp", [
+        word for word, stem in stem_table.items()
+        if spelling.is_suggestable(word) and doc_freqs.get(stem, 0) >= spelling.min_doc_freq])
+    if file_ids is not None:
+        with open(os.path.join(segment_path + ".tmp", "file_id.json"), "wb") as f:
+            f.write(orjson.dumps(file_ids))
+    write_segment_tables(segment_path + ".tmp")
+    os.rename(segment_path + ".tmp", segment_path)
+
+    # publish the compacted segment, the segments it replaces are removed by the next publish
+    old_segment_dirs = [index.segment_list["main"]] + index.segment_list["deltas"]
+    publish_segment_list({"main": segment_name, "deltas": [], "max_doc_id": index.max_doc_id}, index_dir)
+
+    print("compacted", len(old_segment_dirs), "segments into", segment_name, "with", token_count, "tokens and",
+          index.live_doc_count, "documents")
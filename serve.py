@@ -0,0 +1,116 @@
+import os
+import gc
+import sys
+import signal
+import socket
+import argparse
+from werkzeug.serving import make_server, WSGIRequestHandler
+import app
+
+# production server of the search interface: the parent process loads the index once and forks the worker
+# processes, which accept connections on the same listening socket and answer each request in a thread.
+# the workers share the pages of the loaded index with the parent, and the lexicon, urls, stem tables and postings
+# are memory-mapped files (see tables.py) read from the page cache, so adding workers adds little memory.
+# configuration is the same as for the flask app (SEARCH_INDEX_DIR, SEARCH_SCORER, ... see app.py)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """
+    Request handler that doesn't log every request.
+    """
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def run_worker(listen_socket, threaded=True, quiet=False):
+    """
+    Serve requests on the listening socket until the process is terminated.
+    """
+    # the parent stops the workers, a ctrl-c in the terminal only reaches them through it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if quiet:
+        # process_search prints the results of every search
+        sys.stdout = open(os.devnull, "w")
+    host, port = listen_socket.getsockname()[:2]
+    server = make_server(host, port, app.app, threaded=threaded,
+                         request_handler=QuietRequestHandler if quiet else None, fd=listen_socket.fileno())
+    server.serve_forever()
+
+
+def start_worker(listen_socket, threaded, quiet):
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 0
+        try:
+            run_worker(listen_socket, threaded, quiet)
+        except BaseException:
+            exit_code = 1
+            raise
+        finally:
+            os._exit(exit_code)
+    return pid
+
+
+def serve(host="127.0.0.1", port=5000, workers=None, threaded=True, quiet=False):
+    """
+    Load the index, fork the workers and restart the workers that exit until the server gets SIGTERM or SIGINT.
+    """
+    workers = workers or os.cpu_count() or 1
+    listen_socket = socket.create_server((host, port), backlog=1024)
+    listen_socket.set_inheritable(True)
+
+    # load the index before forking so the workers share it, and keep the garbage collector from touching the
+    # loaded objects (which would copy their pages into every worker)
+    app.get_searcher()
+    gc.collect()
+    gc.freeze()
+
+    stopping = False
+    worker_pids = set()
+
+    def stop(signal_number, frame):
+        nonlocal stopping
+        stopping = True
+        for worker_pid in worker_pids:
+            try:
+                os.kill(worker_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        worker_pids.add(start_worker(listen_socket, threaded, quiet))
+    print("serving on", f"http://{host}:{listen_socket.getsockname()[1]}", "with", workers, "workers:",
+          " ".join(str(worker_pid) for worker_pid in sorted(worker_pids)), flush=True)
+
+    while worker_pids:
+        try:
+            worker_pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_pids.discard(worker_pid)
+        if not stopping:
+            print("worker", worker_pid, "exited with status", status, "restarting it", flush=True)
+            worker_pids.add(start_worker(listen_socket, threaded, quiet))
+    listen_socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the search interface with pre-forked worker processes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes, the number of cpus by default")
+    parser.add_argument("--single-threaded", action="store_true",
+                        help="answer one request at a time in each worker instead of a thread per request")
+    parser.add_argument("--quiet", action="store_true", help="don't log every request and its results")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, not args.single_threaded, args.quiet)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
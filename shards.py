@@ -0,0 +1,231 @@
+import os
+import heapq
+import shutil
+import itertools
+import concurrent.futures
+import orjson
+import numpy as np
+import postings
+import segments
+import spelling
+import metrics
+
+# a sharded index splits the documents between independent indices, the shards, that are built in parallel and
+# searched concurrently (see indexer.create_sharded_index and indexer.rank_shards). every shard has its own
+# segments, lexicon, urls and document tables and a global stats sidecar, so its scores use the document counts,
+# lengths and document frequencies of the whole index and the top documents of the shards can be merged
+
+# list of the shards of an index: {"shards": [dir, ...]}, the directories are relative to the index directory
+shards_file = "shards.json"
+
+# the shards of every sharded build are created in a new directory of this directory (shards/set-1/shard-0, ...),
+# which is only published once all its shards are built. directories ending in .tmp are being built
+shards_dir = "shards"
+
+
+def read_shard_list(index_dir="."):
+    """
+    Read the shard directories of a sharded index, or return None if the index isn't sharded.
+    """
+    try:
+        with open(os.path.join(index_dir, shards_file), "rb") as f:
+            return orjson.loads(f.read())["shards"]
+    except FileNotFoundError:
+        return None
+
+
+def write_shard_list(shard_dirs, index_dir="."):
+    """
+    Publish the shards of a sharded build, the file is replaced atomically like the segment list.
+    """
+    path = os.path.join(index_dir, shards_file)
+    with open(path + ".tmp", "wb") as f:
+        f.write(orjson.dumps({"shards": shard_dirs}))
+    os.replace(path + ".tmp", path)
+
+
+def new_shard_set_name(index_dir="."):
+    """
+    Return the next free directory name for the shards of a build like shards/set-3.
+    """
+    os.makedirs(os.path.join(index_dir, shards_dir), exist_ok=True)
+    numbers = [int(name.rsplit("-", 1)[1]) for name in os.listdir(os.path.join(index_dir, shards_dir))
+               if name.startswith("set-") and name.rsplit("-", 1)[1].isdigit()]
+    return os.path.join(shards_dir, f"set-{max(numbers, default=0) + 1}")
+
+
+def publish_shard_list(shard_dirs, index_dir="."):
+    """
+    Publish the shards of a sharded build and remove the shards that are in neither the new nor the previous list.
+    The previous shards are kept until the next publish for the searches that started before this one, like the
+    segments of a segment list (see segments.publish_segment_list).
+    """
+    previous_dirs = read_shard_list(index_dir) or []
+    write_shard_list(shard_dirs, index_dir)
+    kept_names = set()
+    for shard_dir in shard_dirs + previous_dirs:
+        parts = os.path.normpath(shard_dir).split(os.sep)
+        if len(parts) > 1 and parts[0] == shards_dir:
+            kept_names.add(parts[1])
+    for name in os.listdir(os.path.join(index_dir, shards_dir)):
+        if name not in kept_names and not name.endswith(".tmp"):
+            shutil.rmtree(os.path.join(index_dir, shards_dir, name), ignore_errors=True)
+
+
+def remove_shard_list(index_dir="."):
+    """
+    Turn a sharded index back into the index of the index directory, used by unsharded builds. The shards are
+    removed after the list, so a searcher never reads a shard list without its shards.
+    """
+    if os.path.exists(os.path.join(index_dir, shards_file)):
+        os.remove(os.path.join(index_dir, shards_file))
+    shutil.rmtree(os.path.join(index_dir, shards_dir), ignore_errors=True)
+
+
+def shard_tokens(shard_number, index):
+    """
+    Every token of a shard in sorted order with the shard number, its postings location and its document frequency.
+    """
+    for token in index.lexicon:
+        segment_locs = index.lexicon[token]
+        ((_, token_loc),) = segment_locs
+        yield token, shard_number, token_loc, index.doc_freq(segment_locs)
+
+
+def write_global_stats(shard_dirs, index_dir="."):
+    """
+    Write the global stats sidecar of every shard: the live documents and their summed word counts over all shards,
+    and the summed document frequency of every token of the shard. The tokens of the shards are merged in sorted
+    order, so the lexicon of the whole index is never held in memory.
+    """
+    # the stats of the shards themselves are read, not those of an earlier sidecar
+    for shard_dir in shard_dirs:
+        main_dir = os.path.join(index_dir, shard_dir, segments.read_segment_list(os.path.join(index_dir,
+                                                                                              shard_dir))["main"])
+        for name in (segments.global_stats_file, segments.global_doc_freqs_file):
+            if os.path.exists(os.path.join(main_dir, name)):
+                os.remove(os.path.join(main_dir, name))
+    indexes = [segments.SegmentedIndex(os.path.join(index_dir, shard_dir)) for shard_dir in shard_dirs]
+    if any(len(index.segments) != 1 for index in indexes):
+        raise ValueError("every shard has to be a single segment")
+
+    doc_count = sum(index.live_doc_count for index in indexes)
+    body_length = 0.0
+    field_lengths = np.zeros(len(postings.fields), dtype=np.float64)
+    for index in indexes:
+        shard_body_length, shard_field_lengths = index.live_lengths()
+        body_length += shard_body_length
+        field_lengths += shard_field_lengths
+
+    token_locs = [[] for _ in indexes]
+    doc_freqs = [[] for _ in indexes]
+    merged_tokens = heapq.merge(*(shard_tokens(shard_number, index) for shard_number, index in enumerate(indexes)))
+    for _, token_shards in itertools.groupby(merged_tokens, key=lambda token_shard: token_shard[0]):
+        token_shards = list(token_shards)
+        doc_freq = sum(shard_doc_freq for _, _, _, shard_doc_freq in token_shards)
+        for _, shard_number, token_loc, _ in token_shards:
+            token_locs[shard_number].append(token_loc)
+            doc_freqs[shard_number].append(doc_freq)
+
+    for shard_number, index in enumerate(indexes):
+        path = index.segments[0].path
+        entries = np.zeros(len(token_locs[shard_number]), dtype=segments.global_doc_freq_entry)
+        entries["loc"] = token_locs[shard_number]
+        entries["doc_freq"] = doc_freqs[shard_number]
+        entries.sort(order="loc")
+        entries.tofile(os.path.join(path, segments.global_doc_freqs_file))
+        with open(os.path.join(path, segments.global_stats_file), "wb") as f:
+            f.write(orjson.dumps({"shard_count": len(indexes), "doc_count": doc_count, "body_length": body_length,
+                                  "field_lengths": field_lengths.tolist()}))
+    return doc_count
+
+
+class ShardedLexicon:
+    """
+    The tokens of every shard, a token is in the index if it is in one of the shards.
+    """
+
+    def __init__(self, shard_indexes):
+        self.shard_indexes = shard_indexes
+        self.token_count = None
+
+    def __contains__(self, token):
+        return any(token in index.lexicon for index in self.shard_indexes)
+
+    def __len__(self):
+        # counted by merging the sorted tokens of the shards
+        if self.token_count is None:
+            self.token_count = sum(1 for _ in itertools.groupby(heapq.merge(*(index.lexicon
+                                                                              for index in self.shard_indexes))))
+        return self.token_count
+
+    def prefix_tokens(self, prefix, limit=None):
+        """
+        The tokens of any shard that start with a prefix, the limit ones in the most documents first.
+        """
+        return segments.MergedLexicon([segment for index in self.shard_indexes
+                                       for segment in index.segments]).prefix_tokens(prefix, limit)
+
+
+class ShardedUrls:
+    """
+    Urls of the results of a sharded index, which are (shard number, doc id) pairs.
+    """
+
+    def __init__(self, shard_indexes):
+        self.shard_indexes = shard_indexes
+
+    def __getitem__(self, result):
+        shard_number, doc_id = result
+        return self.shard_indexes[shard_number].url_list[doc_id]
+
+
+class ShardedIndex:
+    """
+    The shards of a sharded index searched as one index. Query words are matched and corrected against every
+    shard, and the shards are ranked concurrently by a thread pool (see indexer.rank_shards).
+    """
+
+    def __init__(self, index_dir=".", scorer="tfidf", field_weights=None):
+        self.index_dir = index_dir
+        self.shard_dirs = read_shard_list(index_dir)
+        self.shard_indexes = [segments.SegmentedIndex(os.path.join(index_dir, shard_dir), scorer, field_weights)
+                              for shard_dir in self.shard_dirs]
+        self.lexicon = ShardedLexicon(self.shard_indexes)
+        self.url_list = ShardedUrls(self.shard_indexes)
+        self.segments = [segment for index in self.shard_indexes for segment in index.segments]
+        self.field_weights = self.shard_indexes[0].field_weights
+        self.live_doc_count = self.shard_indexes[0].live_doc_count
+        self.executor = concurrent.futures.ThreadPoolExecutor(len(self.shard_indexes),
+                                                              thread_name_prefix="shard")
+
+    def scatter(self, function):
+        """
+        Call function(shard number, shard index) for every shard concurrently and return the results in shard order.
+        """
+        return list(self.executor.map(function, range(len(self.shard_indexes)), self.shard_indexes))
+
+    def word_doc_freq(self, word) -> int:
+        """
+        Number of documents of the whole index that contain the stem of a word, every shard that has the stem
+        knows it.
+        """
+        for index in self.shard_indexes:
+            doc_freq = index.word_doc_freq(word)
+            if doc_freq:
+                return doc_freq
+        return 0
+
+    def correct_spelling(self, word):
+        """
+        Return the word of any shard closest to a word that isn't in the index, or None (see spelling.suggest).
+        """
+        with metrics.search_metrics.timer("spelling"):
+            if not spelling.is_suggestable(word):
+                return None
+            candidates = set()
+            for segment in self.segments:
+                spelling_index = segment.get_spelling_index()
+                if spelling_index is not None:
+                    candidates.update(spelling_index.candidates(word))
+            return spelling.suggest(word, candidates, self.word_doc_freq)
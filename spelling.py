@@ -0,0 +1,125 @@
+import os
+import zlib
+import numpy as np
+import tables
+
+# per segment files: the sorted words that can be suggested as a string table (see tables.py), and a
+# (delete key, word number) pair for the word and every string made by deleting one or two of its letters, sorted
+# by key
+spelling_words_file = "spelling_words.bin"
+spelling_index_file = "spelling_index.bin"
+spelling_entry = np.dtype([("key", "<u4"), ("word", "<u4")])
+
+# words that can be suggested: letters only, of a reasonable length and in at least min_doc_freq documents
+min_word_length = 3
+max_word_length = 20
+min_doc_freq = 2
+
+# suggestions are at most this many edits (insertions, deletions, substitutions or swaps) away
+max_edit_distance = 2
+
+
+def delete_keys(word: str) -> list:
+    """
+    crc32 of the word and of every string made by deleting up to max_edit_distance of its letters. Two words
+    within max_edit_distance edits share a key (for two substitutions, the string without both letters).
+    crc32 collisions only add candidates that are checked.
+    """
+    variants = {word}
+    deleted_variants = [word]
+    for _ in range(max_edit_distance):
+        deleted_variants = {variant[:position] + variant[position + 1:] for variant in deleted_variants
+                            for position in range(len(variant))}
+        variants.update(deleted_variants)
+    return [zlib.crc32(variant.encode()) for variant in variants]
+
+
+def is_suggestable(word: str) -> bool:
+    return min_word_length <= len(word) <= max_word_length and word.isascii() and word.isalpha()
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    Damerau-Levenshtein distance with adjacent swaps (optimal string alignment).
+    """
+    two_rows_back = None
+    previous_row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], two_rows_back[j - 2] + 1)
+        two_rows_back, previous_row = previous_row, row
+    return previous_row[len(b)]
+
+
+def write_spelling_index(path: str, words) -> int:
+    """
+    Write the deletion neighborhood of the words to a segment. Returns the number of words.
+    """
+    words = sorted(words)
+    keys = []
+    word_numbers = []
+    for word_number, word in enumerate(words):
+        word_keys = delete_keys(word)
+        keys.extend(word_keys)
+        word_numbers.extend([word_number] * len(word_keys))
+
+    # sort by key and word number as a single uint64, much faster than sorting the structured entries
+    packed = np.array(keys, dtype=np.uint64) << np.uint64(32) | np.array(word_numbers, dtype=np.uint64)
+    packed.sort()
+    entries = np.zeros(len(keys), dtype=spelling_entry)
+    entries["key"] = packed >> np.uint64(32)
+    entries["word"] = packed & np.uint64(0xffffffff)
+    # the entries are memory-mapped by searchers, replace the file instead of overwriting it
+    entries.tofile(os.path.join(path, spelling_index_file + ".tmp"))
+    os.replace(os.path.join(path, spelling_index_file + ".tmp"), os.path.join(path, spelling_index_file))
+    tables.write_string_table(os.path.join(path, spelling_words_file), words)
+    return len(words)
+
+
+class SpellingIndex:
+    """
+    Deletion neighborhood of the suggestable words of a segment, opened by the first query with an unknown word.
+    The entries and the words are memory-mapped.
+    """
+
+    def __init__(self, path):
+        self.words = tables.StringTable(os.path.join(path, spelling_words_file))
+        # searching the keys in place is as fast as searching a contiguous copy of them
+        entries = np.frombuffer(tables.map_file(os.path.join(path, spelling_index_file)), dtype=spelling_entry)
+        self.keys = entries["key"]
+        self.word_numbers = entries["word"]
+
+    def candidates(self, word: str) -> set:
+        """
+        Words that share a delete key with the word.
+        """
+        keys = np.array(delete_keys(word), dtype=np.uint32)
+        starts = np.searchsorted(self.keys, keys, side="left")
+        ends = np.searchsorted(self.keys, keys, side="right")
+        word_numbers = np.concatenate([self.word_numbers[start:end] for start, end in zip(starts, ends)])
+        return {self.words[word_number] for word_number in np.unique(word_numbers).tolist()}
+
+
+def suggest(word: str, candidates, doc_freq) -> str:
+    """
+    Return the candidate closest to the word, the most frequent one (doc_freq(candidate)) among the closest,
+    or None if no candidate that is still in a document is within max_edit_distance.
+    """
+    best = None
+    for candidate in candidates:
+        if abs(len(candidate) - len(word)) > max_edit_distance or candidate == word:
+            continue
+        distance = edit_distance(word, candidate)
+        if distance > max_edit_distance:
+            continue
+        candidate_doc_freq = doc_freq(candidate)
+        if not candidate_doc_freq:
+            continue
+        key = (distance, -candidate_doc_freq, candidate)
+        if best is None or key < best:
+            best = key
+    return best[2] if best is not None else None
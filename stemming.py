@@ -0,0 +1,116 @@
+import os
+import orjson
+import tables
+
+# file with the stem of every word of a segment's documents, {word: stem}
+stem_table_file = "stem_table.json"
+
+# word -> stem of the words stemmed by this process or loaded from stem tables, words aren't added once it's full
+stem_cache = {}
+max_cache_size = 2000000
+
+# segment path -> memory-mapped stem table of every segment of the searched index (see tables.py), words that
+# aren't in the cache are looked up in these tables before they are stemmed with nltk
+stem_tables = {}
+
+# word -> stem of the words stemmed since the last take_new_stems call, sent from the worker processes to the
+# main process of a build so it can write the stem table
+new_stems = {}
+
+# porter and snowball stemmer, nltk is only imported once a word isn't in the cache
+stemmers = None
+
+
+def get_stemmers():
+    global stemmers
+    if stemmers is None:
+        from nltk.stem import PorterStemmer, SnowballStemmer
+        stemmers = (PorterStemmer(), SnowballStemmer("english"))
+    return stemmers
+
+
+def stem_word(word: str) -> str:
+    """
+    Stem plurals to singles with the porter stemmer and then stem the root with the snowball stemmer.
+    """
+    stem = stem_cache.get(word)
+    if stem is None:
+        for stem_table in stem_tables.values():
+            stem = stem_table.get(word)
+            if stem is not None:
+                break
+        else:
+            plural_stemmer, snowball_stemmer = get_stemmers()
+            stem = snowball_stemmer.stem(plural_stemmer.stem(word))
+            new_stems[word] = stem
+        if len(stem_cache) < max_cache_size:
+            stem_cache[word] = stem
+    return stem
+
+
+def stem_tokens(tokens: list) -> list:
+    """
+    Stem every token, each distinct word is only stemmed once.
+    """
+    return [stem_word(token) for token in tokens]
+
+
+def stem_counts(word_counts: dict) -> dict:
+    """
+    Turn word frequencies into stem frequencies.
+    """
+    stem_freqs = {}
+    for word, count in word_counts.items():
+        stem = stem_word(word)
+        stem_freqs[stem] = stem_freqs.get(stem, 0) + count
+    return stem_freqs
+
+
+def take_new_stems() -> dict:
+    """
+    Return and forget the words stemmed since the last call.
+    """
+    global new_stems
+    stems = new_stems
+    new_stems = {}
+    return stems
+
+
+def load_stem_table(path: str) -> int:
+    """
+    Add a segment's stem table to the cache, or map it if the segment has one as a table, so its words are stemmed
+    without nltk. Returns the number of words of the table.
+    """
+    if os.path.exists(os.path.join(path, tables.stem_words_file)):
+        stem_tables[path] = tables.read_table_dict(os.path.join(path, tables.stem_words_file),
+                                                   os.path.join(path, tables.stems_file), string_values=True)
+        return len(stem_tables[path])
+    try:
+        with open(os.path.join(path, stem_table_file), "rb") as f:
+            stem_table = orjson.loads(f.read())
+    except FileNotFoundError:
+        return 0
+    for word, stem in stem_table.items():
+        if len(stem_cache) >= max_cache_size:
+            break
+        stem_cache.setdefault(word, stem)
+    return len(stem_table)
+
+
+def load_stem_tables(paths: list) -> None:
+    """
+    Keep the stem tables of exactly the segments at paths, the segments of the index a searcher just loaded.
+    The tables of segments that aren't searched anymore are dropped, so their maps are released and the space of
+    their removed folders is freed.
+    """
+    for path in list(stem_tables):
+        if path not in paths:
+            del stem_tables[path]
+    for path in paths:
+        if path not in stem_tables:
+            load_stem_table(path)
+
+
+def write_stem_table(path: str, stem_table: dict) -> None:
+    with open(os.path.join(path, stem_table_file), "wb") as f:
+        f.write(orjson.dumps(stem_table))
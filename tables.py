@@ -0,0 +1,355 @@
+import os
+import mmap
+import struct
+import bisect
+import numpy as np
+
+# immutable tables of an index segment that are memory-mapped instead of loaded into dicts, so every searcher
+# process of a server reads the same pages of the page cache and the memory of a server doesn't grow with its
+# number of worker processes
+
+# per segment files: the sorted tokens as a front-coded table with the location of their postings record (and of
+# their positions record if the segment has positions) and their number of postings, the url of every doc id of
+# the segment (an empty string if it has none) and the sorted words of the stem table with their stems
+lexicon_file = "terms.bin"
+token_locations_file = "token_locations.bin"
+token_doc_freqs_file = "token_doc_freqs.bin"
+position_locations_file = "position_locations.bin"
+urls_file = "urls.bin"
+stem_words_file = "stem_words.bin"
+stems_file = "stems.bin"
+
+# a string table starts with the number of strings n, followed by n + 1 offsets into the string bytes as
+# uint64 and the utf-8 bytes of every string one after the other, strings are read by their number.
+# a uint table is an array of uint64, sorted string tables and their uint or string values are read as a dict.
+# tables are written to a temporary file that replaces the old one, processes that still map the old file keep
+# reading it
+string_table_header = struct.Struct("<Q")
+
+# a front-coded table stores sorted strings in blocks of front_coding_block_size strings, the first string of a
+# block whole and every other one as the number of leading bytes it shares with the string before it and the rest
+# of its bytes. it starts with the number of strings and of strings per block, followed by the byte offset of
+# every block as uint64 and the blocks. the lengths are varints: a string is found by a binary search over the
+# first strings of the blocks and a scan of one block, and the strings that start with a prefix are a range
+front_coded_header = struct.Struct("<QQ")
+front_coding_block_size = 16
+
+
+def write_string_table(path: str, strings) -> None:
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    with open(path + ".tmp", "wb") as f:
+        f.write(string_table_header.pack(len(encoded)))
+        f.write(offsets.tobytes())
+        f.write(b"".join(encoded))
+    os.replace(path + ".tmp", path)
+
+
+def write_uint_table(path: str, values) -> None:
+    np.asarray(values, dtype="<u8").tofile(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def map_file(path: str):
+    """
+    Read-only memory map of a file, or an empty buffer for an empty file (which can't be mapped).
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_uint_table(path: str) -> memoryview:
+    """
+    The values of a uint table, indexing it returns ints.
+    """
+    return memoryview(map_file(path)).cast("Q")
+
+
+class StringTable:
+    """
+    Memory-mapped string table, a sequence of str.
+    """
+
+    def __init__(self, path):
+        self.table_map = map_file(path)
+        (self.count,) = string_table_header.unpack_from(self.table_map, 0)
+        offsets_end = string_table_header.size + 8 * (self.count + 1)
+        self.offsets = memoryview(self.table_map)[string_table_header.size:offsets_end].cast("Q")
+        self.strings_start = offsets_end
+        # the raw bytes of every string as a sequence, for binary searches
+        self.encoded = EncodedStrings(self)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, number) -> str:
+        if not 0 <= number < self.count:
+            raise IndexError(number)
+        return self.encoded[number].decode()
+
+    def __iter__(self):
+        for number in range(self.count):
+            yield self[number]
+
+    def find(self, string: str) -> int:
+        """
+        Number of a string in a sorted table, or -1 if it isn't in it. utf-8 bytes sort like python strings.
+        """
+        encoded = string.encode()
+        number = bisect.bisect_left(self.encoded, encoded)
+        if number < self.count and self.encoded[number] == encoded:
+            return number
+        return -1
+
+
+class EncodedStrings:
+    """
+    The strings of a StringTable as bytes.
+    """
+
+    def __init__(self, table):
+        self.count = table.count
+        self.table_map = table.table_map
+        self.offsets = table.offsets
+        self.strings_start = table.strings_start
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, number) -> bytes:
+        return self.table_map[self.strings_start + self.offsets[number]:self.strings_start + self.offsets[number + 1]]
+
+
+def encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def decode_varint(buffer, position: int):
+    """
+    The varint at a position of a buffer and the position after it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def write_front_coded_table(path: str, strings, block_size=front_coding_block_size) -> None:
+    """
+    Write sorted strings as a front-coded table.
+    """
+    blocks = []
+    block = bytearray()
+    previous = b""
+    count = 0
+    for string in strings:
+        encoded = string.encode()
+        if count % block_size == 0:
+            if count:
+                blocks.append(bytes(block))
+            block = bytearray(encode_varint(len(encoded)))
+            block += encoded
+        else:
+            shared = 0
+            for previous_byte, byte in zip(previous, encoded):
+                if previous_byte != byte:
+                    break
+                shared += 1
+            block += encode_varint(shared)
+            block += encode_varint(len(encoded) - shared)
+            block += encoded[shared:]
+        previous = encoded
+        count += 1
+    if count:
+        blocks.append(bytes(block))
+
+    offsets = np.zeros(len(blocks) + 1, dtype="<u8")
+    np.cumsum([len(block) for block in blocks], out=offsets[1:])
+    with open(path + ".tmp", "wb") as f:
+        f.write(front_coded_header.pack(count, block_size))
+        f.write(offsets.tobytes())
+        f.write(b"".join(blocks))
+    os.replace(path + ".tmp", path)
+
+
+class FrontCodedTable:
+    """
+    Memory-mapped front-coded table, a sequence of sorted str. Only the first strings of the blocks are read
+    when the table is opened, a lookup scans a single block of the mapped file.
+    """
+
+    def __init__(self, path):
+        self.table_map = map_file(path)
+        self.count, self.block_size = front_coded_header.unpack_from(self.table_map, 0)
+        self.block_count = -(-self.count // self.block_size)
+        offsets_end = front_coded_header.size + 8 * (self.block_count + 1)
+        self.offsets = memoryview(self.table_map)[front_coded_header.size:offsets_end].cast("Q")
+        self.blocks_start = offsets_end
+        # the first string of every block as bytes, for binary searches
+        self.block_heads = [self.read_block_head(block) for block in range(self.block_count)]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, number) -> str:
+        if not 0 <= number < self.count:
+            raise IndexError(number)
+        block, block_number = divmod(number, self.block_size)
+        for string_number, encoded in enumerate(self.read_block(block)):
+            if string_number == block_number:
+                return encoded.decode()
+
+    def __iter__(self):
+        return self.iterate()
+
+    def read_block_head(self, block) -> bytes:
+        position = self.blocks_start + self.offsets[block]
+        length, position = decode_varint(self.table_map, position)
+        return self.table_map[position:position + length]
+
+    def read_block(self, block):
+        """
+        The strings of a block as bytes, decoded one after the other. Lengths below 128 are a single byte.
+        """
+        table_map = self.table_map
+        position = self.blocks_start + self.offsets[block]
+        end = self.blocks_start + self.offsets[block + 1]
+        length, position = decode_varint(table_map, position)
+        encoded = table_map[position:position + length]
+        position += length
+        yield encoded
+        while position < end:
+            shared = table_map[position]
+            if shared < 0x80:
+                position += 1
+            else:
+                shared, position = decode_varint(table_map, position)
+            length = table_map[position]
+            if length < 0x80:
+                position += 1
+            else:
+                length, position = decode_varint(table_map, position)
+            encoded = encoded[:shared] + table_map[position:position + length]
+            position += length
+            yield encoded
+
+    def iterate(self, first=0, end=None):
+        """
+        The strings with numbers from first up to end (the last string by default).
+        """
+        end = self.count if end is None else end
+        number = first - first % self.block_size
+        for block in range(first // self.block_size, -(-end // self.block_size)):
+            for encoded in self.read_block(block):
+                if number >= end:
+                    return
+                if number >= first:
+                    yield encoded.decode()
+                number += 1
+
+    def lower_bound(self, encoded: bytes) -> int:
+        """
+        Number of the first string whose bytes aren't below encoded, the number of strings if there is none.
+        """
+        block = bisect.bisect_right(self.block_heads, encoded) - 1
+        if block < 0:
+            return 0
+        number = block * self.block_size
+        for string in self.read_block(block):
+            if string >= encoded:
+                return number
+            number += 1
+        return number
+
+    def find(self, string: str) -> int:
+        """
+        Number of a string, or -1 if it isn't in the table. utf-8 bytes sort like python strings.
+        """
+        encoded = string.encode()
+        block = bisect.bisect_right(self.block_heads, encoded) - 1
+        if block < 0:
+            return -1
+        if self.block_heads[block] == encoded:
+            return block * self.block_size
+        for block_number, block_string in enumerate(self.read_block(block)):
+            if block_string >= encoded:
+                return block * self.block_size + block_number if block_string == encoded else -1
+        return -1
+
+    def prefix_range(self, prefix: str):
+        """
+        First number and end of the numbers of the strings that start with a prefix.
+        """
+        encoded = prefix.encode()
+        first = self.lower_bound(encoded)
+        # the smallest bytes above every string that starts with the prefix
+        upper = encoded.rstrip(b"\xff")
+        if not upper:
+            return first, self.count
+        return first, self.lower_bound(upper[:-1] + bytes([upper[-1] + 1]))
+
+
+class TableDict:
+    """
+    Read-only dict of the strings of a sorted string table to the values at the same numbers in another table.
+    """
+
+    def __init__(self, keys, values):
+        self.keys_table = keys
+        self.values_table = values
+
+    def get(self, key, default=None):
+        number = self.keys_table.find(key)
+        return self.values_table[number] if number >= 0 else default
+
+    def __getitem__(self, key):
+        number = self.keys_table.find(key)
+        if number < 0:
+            raise KeyError(key)
+        return self.values_table[number]
+
+    def __contains__(self, key):
+        return self.keys_table.find(key) >= 0
+
+    def __iter__(self):
+        return iter(self.keys_table)
+
+    def __len__(self):
+        return len(self.keys_table)
+
+    def keys(self):
+        return iter(self.keys_table)
+
+    def items(self):
+        for number, key in enumerate(self.keys_table):
+            yield key, self.values_table[number]
+
+
+def write_table_dict(keys_path, values_path, mapping, string_values=False) -> None:
+    """
+    Write a dict as a sorted string table of its keys and a uint or string table of their values.
+    """
+    keys = sorted(mapping)
+    write_string_table(keys_path, keys)
+    if string_values:
+        write_string_table(values_path, [mapping[key] for key in keys])
+    else:
+        write_uint_table(values_path, [mapping[key] for key in keys])
+
+
+def read_table_dict(keys_path, values_path, string_values=False) -> TableDict:
+    values = StringTable(values_path) if string_values else read_uint_table(values_path)
+    return TableDict(StringTable(keys_path), values)
@@ -0,0 +1,58 @@
+import os
+import sys
+import shutil
+import subprocess
+import pytest
+
+repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository_dir)
+
+from benchmarks import suite  # noqa: E402
+
+# the synthetic corpus of the tests, small enough to build in a few seconds
+corpus_documents = 300
+corpus_vocabulary = 2000
+corpus_words = 300
+
+
+def run_indexer(index_dir, *args):
+    """
+    run indexer.py in index_dir like a user does, every build gets a fresh process and module state
+    """
+    subprocess.run([sys.executable, os.path.join(repository_dir, "indexer.py"), *args], cwd=index_dir, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    """
+    the DEV folder of the tests and the vocabulary of its pages, most common words first. the pages have no
+    duplicates, so sharded builds (which only find duplicates within a shard) index the same pages
+    """
+    corpus_dir = tmp_path_factory.mktemp("corpus")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(suite, "duplicate_share", 0)
+        monkeypatch.setattr(suite, "near_duplicate_share", 0)
+        vocabulary, _, _ = suite.generate_corpus(str(corpus_dir / "DEV"), corpus_documents, corpus_vocabulary,
+                                                 corpus_words, 0)
+    return corpus_dir / "DEV", vocabulary
+
+
+@pytest.fixture
+def index_dir(tmp_path, corpus):
+    """
+    an empty index directory with a copy of the DEV folder, the tests can change the copy
+    """
+    shutil.copytree(corpus[0], tmp_path / "DEV")
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def built_index(tmp_path_factory, corpus):
+    """
+    a full build of the corpus shared by the tests that only search it, they must not change it
+    """
+    index_dir = tmp_path_factory.mktemp("index")
+    (index_dir / "DEV").symlink_to(corpus[0])
+    run_indexer(index_dir)
+    return index_dir
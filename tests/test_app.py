@@ -0,0 +1,19 @@
+import app
+from conftest import run_indexer
+
+
+def test_search_before_the_index_is_built(index_dir, corpus, monkeypatch):
+    _, vocabulary = corpus
+    monkeypatch.setattr(app, "index_dir", str(index_dir))
+    monkeypatch.setattr(app, "searcher", None)
+    client = app.app.test_client()
+
+    response = client.get("/search", query_string={"q": vocabulary[0]})
+    assert response.status_code == 503
+    assert b"indexer.py" in response.data
+
+    # the next request after the build finds the index
+    run_indexer(index_dir)
+    response = client.get("/search", query_string={"q": vocabulary[0]})
+    assert response.status_code == 200
+    assert response.get_json()["results"]
@@ -0,0 +1,86 @@
+import gzip
+import os
+import tarfile
+import zipfile
+import orjson
+import pytest
+import corpus as corpus_readers
+import segments
+from conftest import run_indexer
+
+
+def write_corpus(dev_dir, path):
+    """
+    write the pages of the DEV folder to a zip or tar archive or a JSON lines bundle, by the suffix of path
+    """
+    files = sorted(os.path.join(root, name) for root, _, names in os.walk(dev_dir) for name in names)
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for file in files:
+                archive.write(file, os.path.relpath(file, os.path.dirname(dev_dir)))
+            archive.writestr("DEV/.DS_Store", b"")
+    elif path.endswith(".tar.gz"):
+        with tarfile.open(path, "w:gz") as archive:
+            archive.add(dev_dir, "DEV")
+    else:
+        with gzip.open(path, "wb") as bundle:
+            for file in files:
+                with open(file, "rb") as f:
+                    # empty lines aren't pages
+                    bundle.write(orjson.dumps(orjson.loads(f.read())) + b"\n\n")
+
+
+def live_urls(index_dir):
+    index = segments.SegmentedIndex(str(index_dir))
+    return {index.url_list[doc_id] for doc_id in range(1, len(index.url_list)) if index.url_list[doc_id]}
+
+
+@pytest.mark.parametrize("suffix", [".zip", ".tar.gz", ".jsonl.gz"])
+def test_archives_and_bundles_index_the_same_pages_as_the_folder(tmp_path, corpus, built_index, suffix):
+    dev_dir, _ = corpus
+    corpus_path = str(tmp_path / ("corpus" + suffix))
+    write_corpus(str(dev_dir), corpus_path)
+    run_indexer(tmp_path, "--corpus", corpus_path)
+    assert live_urls(tmp_path) == live_urls(built_index)
+
+    # every page is listed once with a name that reads it again
+    corpus_reader = corpus_readers.open_corpus(corpus_path)
+    entries = [entry for entry, _ in corpus_reader.scan(lambda entry: False)]
+    assert len(entries) == len({entry.name for entry in entries}) == sum(len(names) for _, _, names in
+                                                                      os.walk(dev_dir))
+    names = {entries[0].name, entries[-1].name}
+    pages = list(corpus_reader.scan(lambda entry: True, names))
+    assert {entry.name for entry, _ in pages} == names
+    assert all(entry.size == len(content) for entry, content in pages)
+    assert all(orjson.loads(content)["url"] for _, content in pages)
+
+
+def test_read_ahead_raises_the_errors_of_the_reader():
+    def pages():
+        yield 1
+        yield 2
+        raise ValueError("broken page")
+
+    read_pages = []
+    with pytest.raises(ValueError, match="broken page"):
+        for page in corpus_readers.read_ahead(pages(), 1):
+            read_pages.append(page)
+    assert read_pages == [1, 2]
+
+
+def test_folder_files_removed_before_they_are_read_are_skipped(tmp_path):
+    for name in "abcd":
+        (tmp_path / (name + ".json")).write_bytes(orjson.dumps({"url": name}))
+    reader = corpus_readers.DirectoryCorpus(str(tmp_path))
+    names = sorted(reader.paths())
+
+    # the accept callback of b removes b before it is read and c before its size is read
+    def accept(entry):
+        if entry.name == names[1]:
+            os.remove(names[1])
+            os.remove(names[2])
+        return True
+
+    pages = list(corpus_readers.read_ahead(reader.scan(accept, names + [str(tmp_path / "e.json")])))
+    assert [entry.name for entry, _ in pages] == [names[0], names[3]]
+    assert reader.missing_files == [names[1], names[2], str(tmp_path / "e.json")]
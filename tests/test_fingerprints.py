@@ -0,0 +1,45 @@
+import random
+import pytest
+import fingerprints
+
+
+@pytest.mark.parametrize("max_distance", [0, 1, 3, 6])
+def test_band_lookup_matches_brute_force(max_distance):
+    rng = random.Random(max_distance)
+    index = fingerprints.FingerprintIndex(max_distance)
+    added = [rng.getrandbits(64) for _ in range(2000)]
+    for fingerprint in added:
+        index.add(fingerprint)
+    assert len(index) == len(added)
+
+    # fingerprints a few bits away from added ones, across band borders, and random ones
+    queries = [rng.getrandbits(64) for _ in range(200)]
+    for _ in range(1000):
+        fingerprint = rng.choice(added)
+        for bit in rng.sample(range(64), rng.randint(0, max_distance + 2)):
+            fingerprint ^= 1 << bit
+        queries.append(fingerprint)
+    for fingerprint in queries:
+        near = index.find_near(fingerprint)
+        expected = any(fingerprints.hamming_distance(fingerprint, other) <= max_distance for other in added)
+        assert (near is not None) == expected
+        if near is not None:
+            assert near in added and fingerprints.hamming_distance(fingerprint, near) <= max_distance
+
+    index.clear()
+    assert len(index) == 0 and index.find_near(added[0]) is None
+
+
+def test_simhash_of_similar_pages_is_close():
+    rng = random.Random(0)
+    words = [f"word{number}" for number in range(300)]
+    page = {word: rng.randint(1, 5) for word in rng.sample(words, 200)}
+    similar_page = dict(page)
+    similar_page[words[0]] = similar_page.get(words[0], 0) + 1
+    other_page = {word: rng.randint(1, 5) for word in rng.sample(words, 200)}
+
+    fingerprint = fingerprints.simhash(page)
+    assert fingerprints.simhash(dict(reversed(page.items()))) == fingerprint
+    assert fingerprints.hamming_distance(fingerprints.simhash(similar_page), fingerprint) <= 3
+    assert fingerprints.hamming_distance(fingerprints.simhash(other_page), fingerprint) > 3
+    assert fingerprints.simhash({}) == 0
@@ -0,0 +1,46 @@
+import os
+import orjson
+import indexer
+import segments
+from conftest import run_indexer
+
+
+def dev_files(index_dir):
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(index_dir / "DEV") for name in names)
+
+
+def test_deletion_only_update(index_dir, corpus):
+    _, vocabulary = corpus
+    run_indexer(index_dir)
+    doc_count = segments.SegmentedIndex(str(index_dir)).live_doc_count
+
+    deleted_urls = set()
+    for path in dev_files(index_dir)[:3]:
+        with open(path, "rb") as f:
+            deleted_urls.add(orjson.loads(f.read())["url"])
+        os.remove(path)
+    run_indexer(index_dir, "--incremental")
+
+    segment_list = segments.read_segment_list(str(index_dir))
+    assert len(segment_list["deltas"]) == 1
+    index = segments.SegmentedIndex(str(index_dir))
+    assert index.live_doc_count == doc_count - 3
+    doc_ids = indexer.process_user_query(vocabulary[0], index.lexicon, index)[0]
+    assert doc_ids
+    assert not deleted_urls & {index.url_list[doc_id] for doc_id in doc_ids}
+
+    # the delta segment without documents can be compacted
+    run_indexer(index_dir, "--compact")
+    assert segments.SegmentedIndex(str(index_dir)).live_doc_count == doc_count - 3
+
+
+def test_touched_files_are_not_reindexed(index_dir):
+    run_indexer(index_dir, "--workers", "2")
+    manifest = orjson.loads((index_dir / "manifest.json").read_bytes())
+    assert all(entry[2] for entry in manifest.values() if entry[3])
+
+    # a new modification time with the same content isn't a change
+    for path in dev_files(index_dir):
+        os.utime(path, ns=(0, 0))
+    run_indexer(index_dir, "--incremental")
+    assert segments.read_segment_list(str(index_dir))["deltas"] == []
@@ -0,0 +1,63 @@
+import array
+import numpy as np
+import postings
+
+
+def test_single_block_postings_round_trip():
+    # unsorted doc ids, gaps and frequencies of several varint bytes and postings without field frequencies
+    doc_ids = np.array([70000, 3, 200, 2 ** 31], dtype=np.uint32)
+    freqs = array.array("I", [1, 300, 2, 20000])
+    field_freqs = np.array([[0, 0, 0, 0], [5, 0, 200, 0], [0, 0, 0, 1], [0, 0, 0, 0]], dtype=np.uint32)
+    doc_lengths = np.array([10, 600, 7, 40000], dtype=np.float64)
+    positions = array.array("I", [4] + list(range(0, 3000, 10)) + [0, 5] + list(range(20000)))
+
+    buffer = postings.encode_postings(doc_ids, freqs, field_freqs, doc_lengths)
+    order = np.argsort(doc_ids)
+    decoded = postings.decode_postings(buffer)
+    assert decoded.doc_ids.tolist() == doc_ids[order].tolist()
+    assert decoded.freqs.tolist() == np.array(freqs)[order].tolist()
+    assert decoded.field_freqs.tolist() == field_freqs[order].tolist()
+
+    # the maxima are float32 upper bounds of the tfs
+    skip_table = postings.read_skip_table(buffer)
+    tfs = np.array(freqs) / doc_lengths
+    field_tfs = field_freqs / doc_lengths[:, None]
+    assert skip_table.block_count == 1
+    assert skip_table.max_freq == 20000
+    assert skip_table.block_max_field_freqs[:, 0].tolist() == [5, 0, 200, 1]
+    assert tfs.max() < skip_table.max_tf == skip_table.block_max_tfs[0]
+    assert (field_tfs.max(axis=0) < skip_table.block_max_field_tfs[:, 0]).all()
+    assert skip_table.block_max_tfs[0] == postings.round_up_float32(np.array([tfs.max()]))[0]
+
+    positions_buffer = postings.encode_positions(doc_ids, freqs, positions)
+    posting_positions = np.split(np.array(positions), np.cumsum(freqs)[:-1])
+    expected_positions = np.concatenate([posting_positions[index] for index in order])
+    assert postings.decode_positions(positions_buffer, 0, decoded.freqs).tolist() == expected_positions.tolist()
+
+
+def random_postings(rng, count):
+    """
+    a random postings list of count postings with unsorted doc ids, frequencies and gaps of several varint bytes,
+    mostly empty field frequencies with some fields in no posting at all and the positions of every posting
+    """
+    doc_ids = rng.choice(2 ** 31, count, replace=False).astype(np.uint32)
+    if rng.random() < 0.5:
+        doc_ids.sort()
+    freqs = rng.integers(1, rng.choice([3, 300]), count).astype(np.uint32)
+    field_freqs = rng.integers(0, rng.choice([3, 1000]), (count, len(postings.fields))).astype(np.uint32)
+    field_freqs *= rng.random((count, len(postings.fields))) < 0.2
+    field_freqs[:, rng.random(len(postings.fields)) < 0.3] = 0
+    doc_lengths = rng.integers(1, 50000, count).astype(np.float64)
+    positions = np.concatenate([np.sort(rng.choice(100000, freq, replace=False)) for freq in freqs.tolist()])
+    return doc_ids, freqs, field_freqs, doc_lengths, positions.astype(np.uint32)
+
+
+def test_single_block_encoders_match_the_numpy_encoders():
+    rng = np.random.default_rng(0)
+    for count in list(range(1, postings.block_size + 1)) * 4:
+        doc_ids, freqs, field_freqs, doc_lengths, positions = random_postings(rng, count)
+        assert postings.encode_postings(doc_ids, array.array("I", freqs.tolist()), field_freqs, doc_lengths) == \
+            postings.encode_array_postings(doc_ids, freqs, field_freqs, doc_lengths)
+        assert postings.encode_positions(doc_ids, array.array("I", freqs.tolist()),
+                                         array.array("I", positions.tolist())) == \
+            postings.encode_array_positions(doc_ids, freqs, positions)
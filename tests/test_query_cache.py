@@ -0,0 +1,54 @@
+import os
+import orjson
+from query_cache import QueryCache
+from searcher import Searcher
+from conftest import run_indexer
+
+
+def test_entries_are_evicted_and_invalidated(tmp_path):
+    cache = QueryCache(max_entries=2, ttl_seconds=300, shared_path=str(tmp_path / "cache.sqlite"))
+    cache.put("5:a", "v1", ["a"])
+    cache.put("5:b", "v1", ["b"])
+    assert cache.get("5:a", "v1") == ["a"]
+    # the least recently used entry is evicted from the process cache, the shared cache still has it
+    cache.put("5:c", "v1", ["c"])
+    assert list(cache.entries) == ["5:a", "5:c"]
+    assert cache.get("5:b", "v1") == ["b"]
+    assert cache.counters["evictions"] >= 1 and cache.counters["shared_hits"] == 1
+
+    # another worker process shares the entries of the same index version
+    other_cache = QueryCache(max_entries=2, ttl_seconds=300, shared_path=str(tmp_path / "cache.sqlite"))
+    assert other_cache.get("5:c", "v1") == ["c"]
+
+    # a new index version drops every entry of the old one, in the process and in the shared cache
+    assert other_cache.get("5:c", "v2") is None
+    assert cache.get("5:a", "v2") is None
+    assert cache.counters["invalidations"] == 2
+
+    expiring_cache = QueryCache(ttl_seconds=-1)
+    expiring_cache.put("5:a", "v1", ["a"])
+    assert expiring_cache.get("5:a", "v1") is None and expiring_cache.counters["expirations"] == 1
+
+
+def test_cached_results_are_not_served_after_a_new_index_is_published(index_dir, corpus):
+    _, vocabulary = corpus
+    run_indexer(index_dir)
+    searcher = Searcher(str(index_dir), cache_size=16, cache_path=str(index_dir / "cache.sqlite"))
+    other_searcher = Searcher(str(index_dir), cache_size=16, cache_path=str(index_dir / "cache.sqlite"))
+    urls = searcher.search(vocabulary[0], 5)[0]
+    assert urls and searcher.search(vocabulary[0], 5)[0] == urls
+    assert searcher.cache.counters["hits"] == 1
+
+    # remove the pages of the cached results and publish a delta segment that deletes them
+    deleted_urls = set(urls)
+    for root, _, names in os.walk(index_dir / "DEV"):
+        for name in names:
+            with open(os.path.join(root, name), "rb") as f:
+                if orjson.loads(f.read())["url"] in deleted_urls:
+                    os.remove(os.path.join(root, name))
+    run_indexer(index_dir, "--incremental")
+
+    for current_searcher in (searcher, other_searcher):
+        new_urls = current_searcher.search(vocabulary[0], 5)[0]
+        assert new_urls and not deleted_urls & set(new_urls)
+    assert searcher.cache.counters["invalidations"] >= 1
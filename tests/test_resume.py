@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import pytest
+import indexer
+import segments
+from conftest import repository_dir, run_indexer
+
+# runs indexer.py but stops the process without any cleanup when it gets to the document given as the first argument
+crashing_indexer = """
+import os
+import sys
+sys.path.insert(0, sys.argv.pop(1))
+import indexer
+crash_document = int(sys.argv.pop(1))
+index_document = indexer.index_document
+indexed_documents = 0
+
+
+def crashing_index_document(document):
+    global indexed_documents
+    indexed_documents += 1
+    if indexed_documents == crash_document:
+        os._exit(1)
+    index_document(document)
+
+
+indexer.index_document = crashing_index_document
+indexer.main()
+"""
+
+
+def main_segment_files(index_dir):
+    segment_dir = index_dir / segments.read_segment_list(str(index_dir))["main"]
+    return {name: (segment_dir / name).read_bytes() for name in sorted(os.listdir(segment_dir))}
+
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_resumed_build_matches_a_build_that_did_not_stop(tmp_path, corpus, workers):
+    dev_dir, _ = corpus
+    options = ["--max-memory", "1M", "--workers", workers]
+    for name in ("resumed", "complete"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "DEV").symlink_to(dev_dir)
+
+    # the build stops after several partial indices were dumped and checkpointed
+    crashed = subprocess.run([sys.executable, "-c", crashing_indexer, repository_dir, "200", *options],
+                             cwd=tmp_path / "resumed", stdout=subprocess.DEVNULL)
+    assert crashed.returncode == 1
+    assert os.path.exists(tmp_path / "resumed" / segments.segments_dir / "build.tmp" / indexer.checkpoint_file)
+    assert not os.path.exists(tmp_path / "resumed" / segments.segments_file)
+    # results.txt is only written once the partial indices are merged
+    assert not os.path.exists(tmp_path / "resumed" / segments.segments_dir / "build.tmp" / "results.txt")
+
+    run_indexer(tmp_path / "resumed", "--resume", *options)
+    run_indexer(tmp_path / "complete", *options)
+    assert main_segment_files(tmp_path / "resumed") == main_segment_files(tmp_path / "complete")
+    assert not os.path.exists(tmp_path / "resumed" / segments.segments_dir / "build.tmp")
+    results = (tmp_path / "resumed" / "results.txt").read_text().splitlines()
+    token_count = len(segments.SegmentedIndex(str(tmp_path / "resumed")).lexicon)
+    assert results[1] == "number of unique words: " + str(token_count)
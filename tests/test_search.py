@@ -0,0 +1,105 @@
+import math
+import random
+import pytest
+import indexer
+import segments
+import spelling
+
+
+def query_tokens(index, rng, vocabulary, count):
+    """
+    count words of the vocabulary with distinct indexed stems, and their stems
+    """
+    words = {}
+    while len(words) < count:
+        word = rng.choice(vocabulary[:300])
+        stem = indexer.parse_query(word)[1][0]
+        if stem in index.lexicon and stem not in words.values():
+            words[word] = stem
+    return list(words), list(words.values())
+
+
+@pytest.mark.parametrize("scorer", ["tfidf", "bm25", "cosine"])
+def test_min_match_returns_docs_with_enough_query_words(built_index, corpus, scorer):
+    _, vocabulary = corpus
+    index = segments.SegmentedIndex(str(built_index), scorer)
+    rng = random.Random(0)
+    for _ in range(20):
+        words, tokens = query_tokens(index, rng, vocabulary, rng.randint(2, 5))
+        doc_matches = {}
+        for token in tokens:
+            for doc_id in index.read(index.lexicon[token]).doc_ids.tolist():
+                doc_matches[doc_id] = doc_matches.get(doc_id, 0) + 1
+
+        query = " ".join(words)
+        for min_match in [0.1, 0.5, 0.75, 1.0]:
+            min_matches = min(max(math.ceil(min_match * len(tokens)), 1), len(tokens))
+            doc_ids = indexer.process_user_query(query, index.lexicon, index, None, min_match)[0]
+            assert set(doc_ids) == {doc_id for doc_id, matches in doc_matches.items() if matches >= min_matches}
+            # docs with more query words rank first, the top k are the first k of all of them
+            matches = [doc_matches[doc_id] for doc_id in doc_ids]
+            assert matches == sorted(matches, reverse=True)
+            for k in [1, 5, 20]:
+                assert indexer.process_user_query(query, index.lexicon, index, k, min_match)[0] == doc_ids[:k]
+
+
+def test_misspelled_words_are_replaced_by_the_closest_common_word(built_index, corpus):
+    _, vocabulary = corpus
+    index = segments.SegmentedIndex(str(built_index))
+    spelling_words = [word for segment in index.segments for word in segment.get_spelling_index().words]
+    rng = random.Random(0)
+    corrected = 0
+    for word in rng.sample([word for word in vocabulary[:500] if spelling.is_suggestable(word)], 40):
+        # one or two substitutions, insertions or deletions
+        typo = word
+        for _ in range(rng.randint(1, 2)):
+            position = rng.randrange(len(typo))
+            edit = rng.choice(["substitute", "insert", "delete"])
+            if edit == "substitute":
+                typo = typo[:position] + rng.choice("qxz") + typo[position + 1:]
+            elif edit == "insert":
+                typo = typo[:position] + rng.choice("qxz") + typo[position:]
+            else:
+                typo = typo[:position] + typo[position + 1:]
+        if not spelling.is_suggestable(typo) or indexer.parse_query(typo)[1][0] in index.lexicon:
+            continue
+
+        # the closest word, the one in the most documents among the closest
+        closest = min(((spelling.edit_distance(typo, candidate), -index.word_doc_freq(candidate), candidate)
+                       for candidate in spelling_words if candidate != typo and index.word_doc_freq(candidate)),
+                      default=None)
+        expected = closest[2] if closest and closest[0] <= spelling.max_edit_distance else None
+        assert index.correct_spelling(typo) == expected
+        if expected is not None:
+            corrected += 1
+            doc_ids, result_query, exact_query = indexer.process_user_query(typo, index.lexicon, index, 5)
+            assert doc_ids and result_query == expected and not exact_query
+    assert corrected >= 20
+
+
+def test_prefix_words_match_any_of_their_most_common_tokens(built_index, corpus):
+    _, vocabulary = corpus
+    index = segments.SegmentedIndex(str(built_index))
+    lexicon_tokens = list(index.lexicon)
+    other_word = vocabulary[1]
+    other_token = indexer.parse_query(other_word)[1][0]
+    other_docs = set(index.read(index.lexicon[other_token]).doc_ids.tolist())
+    for word in [vocabulary[0], vocabulary[3], vocabulary[40]]:
+        # prefixes of a single letter aren't expanded
+        assert indexer.parse_prefixes(word[:1] + "*") == []
+        for prefix in [word[:2], word[:3], word[:4]]:
+            # the expansions are the tokens that start with the prefix in the most documents
+            doc_freqs = {token: index.doc_freq(index.lexicon[token]) for token in lexicon_tokens
+                         if token.startswith(prefix)}
+            expansions = sorted(doc_freqs, key=lambda token: (-doc_freqs[token], token))[:indexer.max_prefix_expansions]
+            assert index.lexicon.prefix_tokens(prefix, indexer.max_prefix_expansions) == expansions
+
+            prefix_docs = set().union(*(index.read(index.lexicon[token]).doc_ids.tolist() for token in expansions))
+            doc_ids, result_query, _ = indexer.process_user_query(prefix + "*", index.lexicon, index)
+            assert set(doc_ids) == prefix_docs and result_query == prefix + "*"
+            if other_token in expansions:
+                continue
+            query = other_word + " " + prefix + "*"
+            assert set(indexer.process_user_query(query, index.lexicon, index)[0]) == prefix_docs & other_docs
+            assert set(indexer.process_user_query(query, index.lexicon, index, None, 0.5)[0]) == \
+                prefix_docs | other_docs
@@ -0,0 +1,22 @@
+import os
+import segments
+import stemming
+from searcher import Searcher
+from conftest import run_indexer
+
+
+def test_reload_keeps_only_the_live_stem_tables(index_dir):
+    run_indexer(index_dir)
+    searcher = Searcher(str(index_dir), cache_size=0)
+    first_paths = [segment.path for segment in searcher.index.segments]
+
+    # two full builds publish main-2 and main-3, main-1 is removed by the second one
+    for publish_number in range(2):
+        run_indexer(index_dir)
+        # a new signature even if the list was replaced within the resolution of the file times
+        os.utime(index_dir / segments.segments_file, ns=(publish_number, publish_number))
+        assert searcher.reload_if_changed()
+        live_paths = [segment.path for segment in searcher.index.segments]
+        assert sorted(stemming.stem_tables) == sorted(live_paths)
+    assert not set(first_paths) & set(stemming.stem_tables)
+    assert not any(os.path.exists(path) for path in first_paths)
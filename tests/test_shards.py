@@ -0,0 +1,29 @@
+import indexer
+import segments
+import shards
+from conftest import run_indexer
+
+
+def search(index, query, k, min_match):
+    doc_ids = indexer.process_user_query(query, index.lexicon, index, k, min_match)[0]
+    return sorted(index.url_list[doc_id] for doc_id in doc_ids)
+
+
+def test_repeated_stems_match_unsharded_search(tmp_path, corpus):
+    dev_dir, vocabulary = corpus
+    (tmp_path / "sharded").mkdir()
+    (tmp_path / "unsharded").mkdir()
+    for name in ("sharded", "unsharded"):
+        (tmp_path / name / "DEV").symlink_to(dev_dir)
+    run_indexer(tmp_path / "sharded", "--shards", "3")
+    run_indexer(tmp_path / "unsharded")
+    sharded_index = shards.ShardedIndex(str(tmp_path / "sharded"))
+    unsharded_index = segments.SegmentedIndex(str(tmp_path / "unsharded"))
+
+    # words that share a stem, the query has the same token twice
+    common_word = vocabulary[0]
+    for query in [common_word + " " + common_word, common_word + " " + common_word + " " + vocabulary[1]]:
+        for k, min_match in [(None, None), (10, None), (10, 0.5)]:
+            unsharded_results = search(unsharded_index, query, k, min_match)
+            assert unsharded_results
+            assert search(sharded_index, query, k, min_match) == unsharded_results
@@ -0,0 +1,23 @@
+import spelling
+
+
+def test_words_within_two_edits_are_suggested(tmp_path):
+    words = ["machine", "learning", "informatics", "computer", "science"]
+    spelling.write_spelling_index(str(tmp_path), words)
+    index = spelling.SpellingIndex(str(tmp_path))
+
+    def suggest(word):
+        return spelling.suggest(word, index.candidates(word), lambda candidate: 1)
+
+    # one edit of every kind
+    assert suggest("machne") == "machine"
+    assert suggest("machinne") == "machine"
+    assert suggest("mechine") == "machine"
+    assert suggest("mahcine") == "machine"
+    # two edits: two substitutions, two deletions, two insertions and a deletion with a substitution
+    assert suggest("lezrnimg") == "learning"
+    assert suggest("infrmatcs") == "informatics"
+    assert suggest("compuuterr") == "computer"
+    assert suggest("scinxe") == "science"
+    # three edits are too far
+    assert suggest("sxixnxe") is None
@@ -0,0 +1,23 @@
+import random
+import pytest
+import tables
+
+
+@pytest.mark.parametrize("block_size", [1, 4, tables.front_coding_block_size])
+def test_front_coded_table_finds_strings_and_prefixes(tmp_path, block_size):
+    rng = random.Random(0)
+    strings = sorted({"".join(rng.choices("abcé", k=rng.randint(1, 6))) for _ in range(500)} | {"", "ab", "abc"})
+    tables.write_front_coded_table(str(tmp_path / "table.bin"), strings, block_size)
+    table = tables.FrontCodedTable(str(tmp_path / "table.bin"))
+
+    assert len(table) == len(strings)
+    assert list(table) == strings
+    assert [table[number] for number in range(0, len(strings), 7)] == strings[::7]
+    assert all(table.find(string) == number for number, string in enumerate(strings))
+    assert table.find("abcd" * 3) == -1
+    assert list(table.iterate(5, 17)) == strings[5:17]
+
+    # prefixes of every length, including ones no string starts with and ones past the last string
+    for prefix in ["", "a", "ab", "abc", "é", "éé", "ca", "d", "zz", "\U0010ffff"]:
+        first, end = table.prefix_range(prefix)
+        assert list(table.iterate(first, end)) == [string for string in strings if string.startswith(prefix)]